@@ -0,0 +1,428 @@
+"""
+backends.py: in-process stand-ins for DynamoDB and GenomeLink
+
+MemoryDynamoDB answers the boto3 DynamoDB resource and Table calls
+genomeMatch makes, from dicts held in memory, and install_dynamodb puts
+it in place of the real resource.  FakeGenomeLink serves report
+summaries over HTTP on localhost, with optional latency and errors, and
+points GENOME_LINK_API at itself.  Both are thread safe, so the load
+generator can use them from many threads.
+
+Items are copied in and out with genomeMatch.copy_item, as boto3 builds
+new objects for each response.  botocore must be installed, since
+genomeMatch imports its ClientError, which is also what MemoryTable
+raises.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomeMatch  # noqa: E402
+
+# name of the shared report cache table in tests and benchmarks
+CACHE_TABLE = 'genomeReportCache'
+# key attributes of each table, by the table's name
+KEY_SCHEMAS = {
+    genomeMatch.DEFAULT_DB_TABLE: (genomeMatch.USERID,),
+    genomeMatch.DEFAULT_DB_PROFILE_TABLE: (genomeMatch.USERID,
+                                           genomeMatch.PROFILE),
+    CACHE_TABLE: (genomeMatch.CACHE_KEY,),
+}
+# items in each scan page, about what fits DynamoDB's 1 MB for item layout
+SCAN_PAGE_ITEMS = 100
+# the condition and update functions update_item understands
+CONDITION = re.compile(r'(attribute_exists|attribute_not_exists)\((#\w+)\)$')
+IF_NOT_EXISTS = re.compile(r'if_not_exists\((#\w+), *(:\w+)\)$')
+# summary texts by score, as GenomeLink words them
+SUMMARY_TEXTS = ['Weak tendency to be {0}', 'Slight tendency to be {0}',
+                 'Intermediate', 'Stronger tendency to be {0}',
+                 'Strong tendency to be {0}']
+
+
+def client_error(code, message, operation):
+    """botocore ClientError like DynamoDB sends"""
+    from botocore.exceptions import ClientError
+    return ClientError({'Error': {'Code': code, 'Message': message}},
+                       operation)
+
+
+class MemoryTable:
+    """DynamoDB Table held in a dict of key tuple: item"""
+
+    def __init__(self, name, keys, latency=0.0):
+        self.name = name
+        self.keys = keys
+        self.latency = latency
+        self.items = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.lock_wait = 0.0    # seconds callers waited for the lock
+        self.segments = {}      # TotalSegments: sorted keys of each segment
+
+    @contextlib.contextmanager
+    def locked(self):
+        """hold the table lock for one call, after any latency"""
+        if self.latency:
+            time.sleep(self.latency)
+        start = time.perf_counter()
+        with self.lock:
+            self.lock_wait += time.perf_counter() - start
+            self.calls += 1
+            yield
+
+    def key(self, item):
+        """key tuple of `item` or of a Key dict"""
+        return tuple(item[name] for name in self.keys)
+
+    def get_item(self, Key, ProjectionExpression=None,
+                 ExpressionAttributeNames=None):
+        with self.locked():
+            item = self.items.get(self.key(Key))
+            if item is None:
+                return {}
+            return {'Item': project(genomeMatch.copy_item(item),
+                                    ProjectionExpression,
+                                    ExpressionAttributeNames)}
+
+    def put_item(self, Item):
+        with self.locked():
+            self.segments.clear()
+            self.items[self.key(Item)] = genomeMatch.copy_item(Item)
+        return {}
+
+    def delete_item(self, Key):
+        with self.locked():
+            self.segments.clear()
+            self.items.pop(self.key(Key), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues=None, ConditionExpression=None):
+        names = ExpressionAttributeNames
+        values = ExpressionAttributeValues or {}
+        check_unused(names, values, UpdateExpression, ConditionExpression)
+        updates = []
+        parts = re.split(r'\b(SET|REMOVE)\b', UpdateExpression)
+        for (action, clauses) in zip(parts[1::2], parts[2::2]):
+            # commas inside function calls don't end a clause
+            for clause in re.split(r',(?![^(]*\))', clauses):
+                (path, _, value) = clause.partition('=')
+                updates.append((action, path.strip(), value.strip()))
+        with self.locked():
+            if self.key(Key) not in self.items:
+                self.segments.clear()
+            item = self.items.get(self.key(Key), dict(Key))
+            if not condition_holds(item, ConditionExpression, names):
+                raise client_error('ConditionalCheckFailedException',
+                                   'The conditional request failed',
+                                   'UpdateItem')
+            # every path is checked before any is changed, so a failed
+            # update leaves the table as it was
+            targets = [walk(item, path, names)
+                       for (action, path, value) in updates]
+            self.items[self.key(Key)] = item
+            for ((action, path, value), (parent, last)) in zip(updates,
+                                                               targets):
+                if action == 'SET':
+                    match = IF_NOT_EXISTS.match(value)
+                    if match:
+                        # only the if_not_exists of the path set
+                        if last in parent:
+                            continue
+                        value = match.group(2)
+                    parent[last] = genomeMatch.copy_item(values[value])
+                else:
+                    parent.pop(last, None)
+        return {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeNames,
+              ExpressionAttributeValues, ProjectionExpression=None,
+              ExclusiveStartKey=None):
+        # only the partition key equality genomeMatch uses
+        value = list(ExpressionAttributeValues.values())[0]
+        with self.locked():
+            items = [genomeMatch.copy_item(item) for (key, item)
+                     in sorted(self.items.items()) if key[0] == value]
+        return {'Items': [project(item, ProjectionExpression,
+                                  ExpressionAttributeNames)
+                          for item in items]}
+
+    def scan(self, Segment=0, TotalSegments=1, ExclusiveStartKey=None,
+             Limit=SCAN_PAGE_ITEMS, ProjectionExpression=None,
+             ExpressionAttributeNames=None):
+        # one page of a segment, in key order; segments split by key hash
+        with self.locked():
+            if TotalSegments not in self.segments:
+                split = [[] for _ in range(TotalSegments)]
+                for key in sorted(self.items):
+                    split[segment_of(key, TotalSegments)].append(key)
+                self.segments[TotalSegments] = split
+            keys = self.segments[TotalSegments][Segment]
+            start = 0
+            if ExclusiveStartKey is not None:
+                start = bisect_right(keys, self.key(ExclusiveStartKey))
+            page = keys[start:start + Limit]
+            items = [genomeMatch.copy_item(self.items[key]) for key in page]
+        response = {'Items': [project(item, ProjectionExpression,
+                                      ExpressionAttributeNames)
+                              for item in items]}
+        if start + Limit < len(keys):
+            response['LastEvaluatedKey'] = dict(zip(self.keys, page[-1]))
+        return response
+
+    def batch_writer(self):
+        return MemoryBatch(self)
+
+
+class MemoryBatch:
+    """batch_writer of a MemoryTable"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key)
+
+
+def segment_of(key, segments):
+    """scan segment of a key tuple, from a hash of its partition key"""
+    return zlib.crc32(str(key[0]).encode('utf-8')) % segments
+
+
+def check_unused(names, values, *expressions):
+    """raise the ValidationException DynamoDB sends for unused names"""
+    text = ' '.join(expression for expression in expressions if expression)
+    used = set(re.findall(r'[#:]\w+', text))
+    unused = sorted(set(names) - used) + sorted(set(values) - used)
+    if unused:
+        raise client_error('ValidationException',
+                           'Value provided in ExpressionAttributeNames or '
+                           'ExpressionAttributeValues unused in '
+                           'expressions: keys: {' + ', '.join(unused) + '}',
+                           'UpdateItem')
+
+
+def condition_holds(item, expression, names):
+    """
+    True if `item` meets a ConditionExpression
+
+    Only attribute_exists and attribute_not_exists of top-level
+    attributes joined by AND, the conditions genomeMatch uses.
+    """
+    if not expression:
+        return True
+    for clause in expression.split(' AND '):
+        match = CONDITION.match(clause.strip())
+        exists = names[match.group(2)] in item
+        if exists != (match.group(1) == 'attribute_exists'):
+            return False
+    return True
+
+
+def walk(item, path, names):
+    """(dict holding the last step of `path` in `item`, last step)"""
+    steps = [names[step.strip()] for step in path.split('.')]
+    parent = item
+    for step in steps[:-1]:
+        if not isinstance(parent.get(step), dict):
+            raise client_error('ValidationException',
+                               'The document path provided in the update '
+                               'expression is invalid for update',
+                               'UpdateItem')
+        parent = parent[step]
+    return (parent, steps[-1])
+
+
+def project(item, expression, names):
+    """`item` with only the attributes of a ProjectionExpression"""
+    if not expression:
+        return item
+    attributes = [names.get(name.strip(), name.strip())
+                  for name in expression.split(',')]
+    return {name: item[name] for name in attributes if name in item}
+
+
+class MemoryDynamoDB:
+    """boto3 DynamoDB resource over MemoryTables"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = MemoryTable(
+                    name, KEY_SCHEMAS.get(name, (genomeMatch.USERID,)),
+                    self.latency)
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for (name, request) in RequestItems.items():
+            table = self.Table(name)
+            found = []
+            for key in request['Keys']:
+                item = table.get_item(
+                    key, request.get('ProjectionExpression'),
+                    request.get('ExpressionAttributeNames')).get('Item')
+                if item is not None:
+                    found.append(item)
+            responses[name] = found
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def stats(self):
+        """calls and seconds waited for table locks, over every table"""
+        tables = list(self.tables.values())
+        return (sum(table.calls for table in tables),
+                sum(table.lock_wait for table in tables))
+
+
+def install_dynamodb(latency=0.0):
+    """put a new MemoryDynamoDB in place of genomeMatch's resource"""
+    genomeMatch._dynamodb = MemoryDynamoDB(latency)
+    genomeMatch._db_table = None
+    genomeMatch._profile_table = None
+    genomeMatch._store = None
+    return genomeMatch._dynamodb
+
+
+def random_profile(rng):
+    """one complete profile, as stored, with random scores"""
+    profile = {}
+    for trait in genomeMatch.TRAIT_LIST:
+        score = rng.randint(0, 4)
+        profile[trait] = (score, genomeMatch.clean_phrase(
+            trait, SUMMARY_TEXTS[score].format(trait)))
+    return profile
+
+
+def seed_user(dynamodb, userId, count, seed=0):
+    """store `count` random profiles for user in the configured layout"""
+    rng = random.Random(seed)
+    data = {'profile{0}'.format(i): random_profile(rng)
+            for i in range(count)}
+    if genomeMatch.use_profile_layout():
+        table = dynamodb.Table(os.environ.get(
+            genomeMatch.DB_PROFILE_TABLE_ENV,
+            genomeMatch.DEFAULT_DB_PROFILE_TABLE))
+        for (name, profile) in data.items():
+            table.put_item({genomeMatch.USERID: userId,
+                            genomeMatch.PROFILE: name,
+                            genomeMatch.DATA: profile})
+    else:
+        table = dynamodb.Table(os.environ.get(genomeMatch.DB_TABLE_ENV,
+                                              genomeMatch.DEFAULT_DB_TABLE))
+        table.put_item({genomeMatch.USERID: userId, genomeMatch.DATA: data})
+    return data
+
+
+class FakeGenomeLink:
+    """
+    GenomeLink report API on localhost
+
+    Each request waits `latency` seconds plus up to `jitter` more, then
+    fails with a 500 with probability `error_rate`.  Scores come from a
+    hash of the trait and token, so the same token always gets the same
+    report.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        """serve in a daemon thread and set GENOME_LINK_API to it"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body in one packet, or keep-alive clients wait
+            # out a delayed ACK on every request
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                fake.answer(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        os.environ[genomeMatch.GENOMELINK_API_ENV] = self.url
+        return self
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, handler):
+        """reply to one report request"""
+        time.sleep(self.latency + random.random() * self.jitter)
+        trait = handler.path.split('/')[3]
+        token = handler.headers.get('Authorization', '').split()[-1]
+        failed = random.random() < self.error_rate
+        with self.lock:
+            self.requests += 1
+            self.errors += failed
+        if failed:
+            body = b'{"detail": "injected error"}'
+            handler.send_response(500)
+        else:
+            digest = hashlib.sha256((trait + token).encode('utf-8'))
+            score = int(digest.hexdigest(), 16) % len(SUMMARY_TEXTS)
+            body = json.dumps({'summary': {
+                'score': score,
+                'text': SUMMARY_TEXTS[score].format(trait)}}).encode('utf-8')
+            handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+class Discard:
+    """stdout stand-in that drops the skill's log and metric lines"""
+
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def quiet():
+    """context manager sending stdout to Discard"""
+    return contextlib.redirect_stdout(Discard())
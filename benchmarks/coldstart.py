@@ -0,0 +1,90 @@
+"""
+coldstart.py: cold-start benchmark for genomeMatch
+
+Each sample runs in a fresh interpreter, so it pays the same import cost
+as a new Lambda container.  Reports the time to import genomeMatch and
+the time to the first response for each request type, plus which heavy
+modules ended up loaded.
+
+    python benchmarks/coldstart.py [-n RUNS] [request type ...]
+
+DynamoDB is the MemoryDynamoDB stand-in of backends.py, installed after
+the import is timed, so the first response is the skill's own work and
+not a failed call for want of credentials.  Point GENOME_DB_ENDPOINT at
+a local DynamoDB to include real database access, boto3 included.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+HEAVY_MODULES = ['boto3', 'botocore', 'requests', 'asyncio',
+                 'concurrent.futures']
+
+CHILD = """
+import json, sys, time
+sys.path[:0] = [{root!r}, {here!r}]
+start = time.perf_counter()
+import genomeMatch
+imported = time.perf_counter()
+import events
+if {stand_in!r}:
+    import backends
+    backends.install_dynamodb()
+event = events.EVENTS[{label!r}]()
+error = None
+ready = time.perf_counter()
+try:
+    genomeMatch.lambda_handler(event, event['context'])
+except Exception as e:
+    error = '%s: %s' % (type(e).__name__, e)
+done = time.perf_counter()
+print(json.dumps({{
+    'import': imported - start,
+    'first_response': done - ready,
+    'loaded': [m for m in {heavy!r} if m in sys.modules],
+    'error': error
+}}))
+"""
+
+
+def run_sample(label):
+    """run one cold start for `label` in a new interpreter"""
+    code = CHILD.format(root=ROOT, here=HERE, label=label, heavy=HEAVY_MODULES,
+                        stand_in=not os.environ.get('GENOME_DB_ENDPOINT'))
+    out = subprocess.run([sys.executable, '-c', code],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         universal_newlines=True, check=True).stdout
+    # handler output goes to stdout too, result is the last line
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    sys.path.insert(0, HERE)
+    import events
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help="cold starts per request type")
+    parser.add_argument('labels', nargs='*', default=list(events.EVENTS),
+                        help="request types to measure")
+    args = parser.parse_args(argv)
+    print("{:<22}{:>12}{:>16}  {}".format('request', 'import ms',
+                                          'response ms', 'loaded'))
+    for label in args.labels:
+        samples = [run_sample(label) for _ in range(args.runs)]
+        import_ms = statistics.median(s['import'] for s in samples) * 1000
+        first_ms = (statistics.median(s['first_response'] for s in samples)
+                    * 1000)
+        loaded = ','.join(samples[-1]['loaded']) or '-'
+        print("{:<22}{:>12.2f}{:>16.2f}  {}".format(label, import_ms,
+                                                    first_ms, loaded))
+        if samples[-1]['error']:
+            print("    error:", samples[-1]['error'])
+
+
+if __name__ == '__main__':
+    main()
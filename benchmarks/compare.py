@@ -0,0 +1,77 @@
+"""
+compare.py: micro-benchmark of profile comparison
+
+Times the dict-of-tuples comparison get_comparison used to do against
+get_comparison on plain data (match_records, no packing), on session
+TrackedData (packed once), and the packed-profile kernel on profiles
+packed ahead of time.
+
+    python benchmarks/compare.py [-n NUMBER]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomeMatch  # noqa: E402
+
+
+def dict_comparison(data, slotA, slotB):
+    """get_comparison before packed profiles, without the debug print"""
+    high_trait = []
+    moderate_trait = []
+    for trait in genomeMatch.TRAIT_LIST:
+        if trait not in data[slotA] or trait not in data[slotB]:
+            continue
+        if (data[slotA][trait][0] == 0 and data[slotB][trait][0] == 0 or
+                data[slotA][trait][0] == 4 and data[slotB][trait][0] == 4):
+            high_trait.append(data[slotA][trait][1])
+        elif (data[slotA][trait][0] < 2 and data[slotB][trait][0] < 2 or
+                data[slotA][trait][0] > 2 and data[slotB][trait][0] > 2):
+            moderate_trait.append(data[slotA][trait][1])
+    return (high_trait, moderate_trait)
+
+
+def random_record(rng):
+    """one profile with random scores"""
+    return {trait: (rng.randint(0, 4), "They phrase for " + trait)
+            for trait in genomeMatch.TRAIT_LIST}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--number', type=int, default=100000,
+                        help="comparisons per timing")
+    args = parser.parse_args(argv)
+    rng = random.Random(0)
+    data = {'a': random_record(rng), 'b': random_record(rng)}
+    tracked = genomeMatch.TrackedData(data, genomeMatch.new_changes())
+    packed_a = genomeMatch.pack_profile(data['a'])
+    packed_b = genomeMatch.pack_profile(data['b'])
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert (genomeMatch.get_comparison(data, 'a', 'b') ==
+                dict_comparison(data, 'a', 'b'))
+    cases = [
+        ('dict comparison', lambda: dict_comparison(data, 'a', 'b')),
+        ('get_comparison', lambda: genomeMatch.get_comparison(data, 'a',
+                                                              'b')),
+        ('get_comparison tracked',
+         lambda: genomeMatch.get_comparison(tracked, 'a', 'b')),
+        ('pack_profile', lambda: genomeMatch.pack_profile(data['a'])),
+        ('match_packed', lambda: genomeMatch.match_packed(packed_a,
+                                                          packed_b)),
+    ]
+    print("{:<24}{:>12}".format('case', 'us/call'))
+    for label, call in cases:
+        # get_comparison prints the data it compares
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = min(timeit.repeat(call, number=args.number, repeat=3))
+        print("{:<24}{:>12.3f}".format(label, seconds / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
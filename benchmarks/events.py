@@ -0,0 +1,90 @@
+"""events.py: synthetic Alexa request events for benchmarking genomeMatch"""
+
+USER_ID = 'amzn1.ask.account.BENCHMARK'
+
+
+def make_session(attributes=None, new=False, userId=USER_ID):
+    """session block as sent by Alexa"""
+    session = {
+        'new': new,
+        'sessionId': 'amzn1.echo-api.session.benchmark',
+        'application': {'applicationId': 'amzn1.ask.skill.benchmark'},
+        'user': {'userId': userId}
+    }
+    if attributes is not None:
+        session['attributes'] = attributes
+    return session
+
+
+def make_context(apiAccessToken=''):
+    """context block as sent by Alexa"""
+    return {
+        'System': {
+            'apiAccessToken': apiAccessToken,
+            'apiEndpoint': 'https://api.amazonalexa.com'
+        }
+    }
+
+
+def launch_request(attributes=None, locale='en-US', userId=USER_ID):
+    """LaunchRequest event"""
+    return {
+        'version': '1.0',
+        'session': make_session(attributes, new=True, userId=userId),
+        'context': make_context(),
+        'request': {
+            'type': 'LaunchRequest',
+            'requestId': 'amzn1.echo-api.request.launch',
+            'locale': locale
+        }
+    }
+
+
+def intent_request(name, slots=None, attributes=None, locale='en-US',
+                   userId=USER_ID):
+    """IntentRequest event for intent `name` with {slot: value} `slots`"""
+    slots = slots or {}
+    return {
+        'version': '1.0',
+        'session': make_session(attributes if attributes is not None
+                                else {}, userId=userId),
+        'context': make_context(),
+        'request': {
+            'type': 'IntentRequest',
+            'requestId': 'amzn1.echo-api.request.' + name,
+            'locale': locale,
+            'intent': {
+                'name': name,
+                'slots': {slot: {'name': slot, 'value': value}
+                          for slot, value in slots.items()}
+            }
+        }
+    }
+
+
+def session_ended_request(attributes=None, locale='en-US',
+                          userId=USER_ID):
+    """SessionEndedRequest event"""
+    return {
+        'version': '1.0',
+        'session': make_session(attributes if attributes is not None
+                                else {}, userId=userId),
+        'context': make_context(),
+        'request': {
+            'type': 'SessionEndedRequest',
+            'requestId': 'amzn1.echo-api.request.ended',
+            'locale': locale,
+            'reason': 'USER_INITIATED'
+        }
+    }
+
+
+# request types measured by the benchmarks, by label
+EVENTS = {
+    'LaunchRequest': lambda: launch_request(),
+    'AMAZON.HelpIntent': lambda: intent_request('AMAZON.HelpIntent'),
+    'AMAZON.StopIntent': lambda: intent_request('AMAZON.StopIntent'),
+    'ListIntent': lambda: intent_request('ListIntent'),
+    'LoadIntent': lambda: intent_request('LoadIntent'),
+    'SessionEndedRequest': lambda: session_ended_request(),
+}
@@ -0,0 +1,96 @@
+"""
+export.py: rows per second of tools/export_profiles.py by scan workers
+
+Stores profiles for many users in the MemoryDynamoDB stand-in, with
+--db-latency seconds added to every scan page like the round trip for a
+page from DynamoDB, then exports them with each number of workers and
+loads the export back into the memory and sqlite engines.  Every export
+is checked against the stored profiles, phrases included.
+
+    python benchmarks/export.py [-u USERS] [-p PROFILES] [-w 1 2 4 ...]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tools'))
+import backends  # noqa: E402
+import export_profiles  # noqa: E402
+import genomeMatch  # noqa: E402
+
+DEFAULT_WORKERS = [1, 2, 4, 8]
+
+
+def seed_users(dynamodb, users, profiles):
+    """store `profiles` profiles for each of `users` users"""
+    stored = {}
+    for i in range(users):
+        userId = 'amzn1.ask.account.EXPORT{0}'.format(i)
+        stored[userId] = backends.seed_user(dynamodb, userId, profiles,
+                                            seed=i)
+    return stored
+
+
+def check(path, stored):
+    """assert the export at `path` holds exactly the stored profiles"""
+    exported = {}
+    with open(path, 'rb') as file:
+        for (userId, name, record) in export_profiles.read_export(file):
+            exported.setdefault(userId, {})[name] = record
+    assert exported == stored, "export differs from stored profiles"
+
+
+def report(case, rows, seconds, size):
+    """print a row of rows/s and file size"""
+    print("{:<20}{:>9}{:>10.3f}{:>12.0f}{:>12}{:>10.1f}".format(
+        case, rows, seconds, rows / seconds, size, size / rows))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-u', '--users', type=int, default=2000,
+                        help="users stored")
+    parser.add_argument('-p', '--profiles', type=int, default=20,
+                        help="profiles stored for each user")
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=DEFAULT_WORKERS,
+                        help="scan workers to export with")
+    parser.add_argument('--db-latency', type=float, default=0.05,
+                        help="seconds each scan page takes")
+    args = parser.parse_args(argv)
+    dynamodb = backends.install_dynamodb(args.db_latency)
+    stored = seed_users(dynamodb, args.users, args.profiles)
+    print("{:<20}{:>9}{:>10}{:>12}{:>12}{:>10}".format(
+        'case', 'rows', 'seconds', 'rows/s', 'bytes', 'bytes/row'))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'profiles.export')
+        for workers in args.workers:
+            start = time.perf_counter()
+            rows = export_profiles.export_profiles(path, workers)
+            report('export, {0} workers'.format(workers), rows,
+                   time.perf_counter() - start, os.path.getsize(path))
+            check(path, stored)
+        stores = [
+            ('load, memory', genomeMatch.MemoryStore()),
+            ('load, sqlite', genomeMatch.SqliteStore(
+                os.path.join(directory, 'profiles.db'))),
+        ]
+        for (case, store) in stores:
+            start = time.perf_counter()
+            with backends.quiet():
+                rows = export_profiles.load_export(path, store)
+            report(case, rows, time.perf_counter() - start,
+                   os.path.getsize(path))
+            # sqlite gives back JSON lists for the (score, phrase) tuples
+            for userId in list(stored)[:10]:
+                assert (json.dumps(store.get(userId)[genomeMatch.DATA]) ==
+                        json.dumps(stored[userId]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+load.py: concurrent load on one warm container's lambda_handler
+
+Runs whole sessions (see suite.replay_session) for many users at once,
+from a thread pool sharing one genomeMatch - its DynamoDB resource,
+report cache, thread pool and HTTP session, as concurrent invocations
+would if Lambda ran them in one container - or from a process pool,
+each process a container of its own.  Each concurrency level gets a new
+MemoryDynamoDB with the users' profiles stored, and every level talks to
+one FakeGenomeLink with the latency and errors asked for.
+
+For each level it reports sessions, requests and failed requests,
+requests per second, p50/p95/p99 request latency, the peak number of
+threads and the errors FakeGenomeLink injected (5xx), which the skill
+retries or reports as a partial download rather than failing.  For
+contention it also reports the DynamoDB stand-in's lock wait per
+request and the peak backlog of the shared genomeMatch thread pool.
+Both are per process with the process pool.
+
+    python benchmarks/load.py [-c 1 4 16 ...] [--pool thread|process]
+        [--latency S] [--jitter S] [--error-rate P] [--db-latency S]
+"""
+import argparse
+import collections
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import backends  # noqa: E402
+import genomeMatch  # noqa: E402
+import suite  # noqa: E402
+
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16, 32]
+SAMPLE_INTERVAL = 0.005     # seconds between thread and backlog samples
+
+
+class Monitor:
+    """samples thread count and thread pool backlog in the background"""
+
+    def __init__(self):
+        self.threads = 0
+        self.backlog = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.threads = max(self.threads, threading.active_count())
+            executor = genomeMatch._executor
+            if executor is not None:
+                self.backlog = max(self.backlog, executor._work_queue.qsize())
+            time.sleep(SAMPLE_INTERVAL)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return (self.threads, self.backlog)
+
+
+def user_ids(users):
+    """the userIds of `users` users"""
+    return ['amzn1.ask.account.LOAD{0}'.format(i) for i in range(users)]
+
+
+def install_users(users, profiles, db_latency):
+    """
+    new MemoryDynamoDB holding `profiles` profiles for each user
+
+    Then runs one untimed session, so imports and connections are made
+    before the load starts, as in a warm container.
+    """
+    dynamodb = backends.install_dynamodb(db_latency)
+    for (i, userId) in enumerate(user_ids(users)):
+        backends.seed_user(dynamodb, userId, profiles, seed=i)
+    with backends.quiet():
+        suite.replay_session(user_ids(1)[0])
+    return dynamodb
+
+
+def run_session(userId):
+    """
+    one session, counting failed requests
+
+    Returns:
+        (list of seconds per request, Counter of exception names)
+    """
+    errors = collections.Counter()
+    try:
+        timings = suite.replay_session(userId)
+    except Exception as e:
+        errors[type(e).__name__] += 1
+        return ([], errors)
+    return ([seconds for (label, seconds) in timings], errors)
+
+
+def run_sessions(userIds):
+    """
+    sessions for each of `userIds` in turn, in a process pool worker
+
+    Returns:
+        (seconds per request, Counter of exception names, peak threads,
+        peak thread pool backlog, DynamoDB calls, seconds of lock wait)
+    """
+    monitor = Monitor()
+    samples = []
+    errors = collections.Counter()
+    with backends.quiet():
+        for userId in userIds:
+            (timings, failed) = run_session(userId)
+            samples.extend(timings)
+            errors.update(failed)
+    (threads, backlog) = monitor.stop()
+    (calls, lock_wait) = genomeMatch._dynamodb.stats()
+    return (samples, errors, threads, backlog, calls, lock_wait)
+
+
+def init_process(users, profiles, db_latency, api):
+    """set up a process pool worker as a container of its own"""
+    os.environ[genomeMatch.GENOMELINK_API_ENV] = api
+    install_users(users, profiles, db_latency)
+
+
+def run_threads(concurrency, sessions, users, profiles, db_latency):
+    """sessions from a thread pool, all in this process"""
+    dynamodb = install_users(users, profiles, db_latency)
+    ids = user_ids(users)
+    monitor = Monitor()
+    samples = []
+    errors = collections.Counter()
+    start = time.perf_counter()
+    with backends.quiet():
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            for (timings, failed) in pool.map(
+                    run_session, [ids[i % users] for i in range(sessions)]):
+                samples.extend(timings)
+                errors.update(failed)
+    elapsed = time.perf_counter() - start
+    (threads, backlog) = monitor.stop()
+    (calls, lock_wait) = dynamodb.stats()
+    return (samples, errors, elapsed, threads, backlog, lock_wait)
+
+
+def run_processes(concurrency, sessions, users, profiles, db_latency,
+                  api):
+    """sessions from a process pool, `concurrency` processes"""
+    ids = user_ids(users)
+    shares = [[ids[i % users] for i in range(worker, sessions, concurrency)]
+              for worker in range(concurrency)]
+    samples = []
+    errors = collections.Counter()
+    (threads, backlog, lock_wait) = (0, 0, 0.0)
+    with concurrent.futures.ProcessPoolExecutor(
+            concurrency, initializer=init_process,
+            initargs=(users, profiles, db_latency, api)) as pool:
+        # start every worker before timing, so warming up isn't counted
+        list(pool.map(time.sleep, [0.1] * concurrency))
+        start = time.perf_counter()
+        for result in pool.map(run_sessions, shares):
+            samples.extend(result[0])
+            errors.update(result[1])
+            threads = max(threads, result[2])
+            backlog = max(backlog, result[3])
+            lock_wait += result[5]
+        elapsed = time.perf_counter() - start
+    return (samples, errors, elapsed, threads, backlog, lock_wait)
+
+
+def report(pool, concurrency, sessions, outcome, injected):
+    """print a row for one concurrency level"""
+    (samples, errors, elapsed, threads, backlog, lock_wait) = outcome
+    ordered = sorted(samples) or [0.0]
+    print("{:<8}{:>6}{:>9}{:>9}{:>8}{:>10.0f}{:>10.1f}{:>10.1f}{:>10.1f}"
+          "{:>9}{:>10.3f}{:>9}{:>7}".format(
+              pool, concurrency, sessions, len(samples), sum(errors.values()),
+              len(samples) / elapsed,
+              suite.percentile(ordered, 50) * 1000,
+              suite.percentile(ordered, 95) * 1000,
+              suite.percentile(ordered, 99) * 1000,
+              threads, lock_wait * 1000 / max(len(samples), 1), backlog,
+              injected))
+    if errors:
+        print("    failed:", dict(errors))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-c', '--concurrency', type=int, nargs='+',
+                        default=DEFAULT_CONCURRENCY,
+                        help="simultaneous sessions to run at")
+    parser.add_argument('-s', '--sessions', type=int, default=4,
+                        help="sessions for each unit of concurrency")
+    parser.add_argument('-u', '--users', type=int, default=64,
+                        help="users the sessions are spread over")
+    parser.add_argument('-p', '--profiles', type=int, default=20,
+                        help="profiles stored for each user")
+    parser.add_argument('--pool', choices=['thread', 'process'],
+                        default='thread', help="how to run sessions")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="seconds FakeGenomeLink takes per report")
+    parser.add_argument('--jitter', type=float, default=0.05,
+                        help="up to this many seconds more per report")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of reports that fail with a 500")
+    parser.add_argument('--db-latency', type=float, default=0.0,
+                        help="seconds each DynamoDB call takes")
+    parser.add_argument('--report-cache', action='store_true',
+                        help="keep downloaded reports in the report cache")
+    args = parser.parse_args(argv)
+    if not args.report_cache:
+        os.environ[genomeMatch.CACHE_SIZE_ENV] = '0'
+    genomelink = backends.FakeGenomeLink(args.latency, args.jitter,
+                                         args.error_rate).start()
+    print("{:<8}{:>6}{:>9}{:>9}{:>8}{:>10}{:>10}{:>10}{:>10}{:>9}{:>10}"
+          "{:>9}{:>7}".format('pool', 'conc', 'sessions', 'requests',
+                              'failed', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                              'threads', 'lock ms', 'backlog', '5xx'))
+    for concurrency in args.concurrency:
+        sessions = concurrency * args.sessions
+        injected = genomelink.errors
+        if args.pool == 'thread':
+            outcome = run_threads(concurrency, sessions, args.users,
+                                  args.profiles, args.db_latency)
+        else:
+            outcome = run_processes(concurrency, sessions, args.users,
+                                    args.profiles, args.db_latency,
+                                    genomelink.url)
+        report(args.pool, concurrency, sessions, outcome,
+               genomelink.errors - injected)
+    genomelink.stop()
+
+
+if __name__ == '__main__':
+    main()
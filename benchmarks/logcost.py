@@ -0,0 +1,86 @@
+"""
+logcost.py: CPU time and log bytes of requests
+
+Sends each request of a session on warm data through lambda_handler and
+measures the CPU time it takes and the bytes it writes to stdout, which
+on Lambda all goes to CloudWatch Logs.  Run it once for each
+GENOME_LOG_LEVEL to compare:
+
+    GENOME_LOG_LEVEL=DEBUG python benchmarks/logcost.py [-n NUMBER]
+    python benchmarks/logcost.py [-p PROFILES]
+"""
+import argparse
+import contextlib
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import events  # noqa: E402
+import genomeMatch  # noqa: E402
+
+
+class ByteCounter:
+    """stdout stand-in that counts what is written to it"""
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, text):
+        self.count += len(text.encode('utf-8'))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def session_events(profiles):
+    """events of a session over `profiles` saved data sets, by label"""
+    rng = random.Random(0)
+    data = {'name{0}'.format(i): {trait: (rng.randint(0, 4),
+                                          "They phrase for " + trait)
+                                  for trait in genomeMatch.TRAIT_LIST}
+            for i in range(profiles)}
+    attributes = genomeMatch.encode_attributes({genomeMatch.DATA_KEY: data})
+    return [
+        ('ListIntent', events.intent_request('ListIntent',
+                                             attributes=attributes)),
+        ('CompareIntent', events.intent_request(
+            'CompareIntent', {'nameA': 'name0', 'nameB': 'name1'},
+            attributes=attributes)),
+        ('RankIntent', events.intent_request('RankIntent', {'name': 'name0'},
+                                             attributes=attributes)),
+        ('AMAZON.HelpIntent', events.intent_request('AMAZON.HelpIntent',
+                                                    attributes=attributes)),
+        ('SessionEndedRequest',
+         events.session_ended_request(attributes=attributes)),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help="requests of each kind")
+    parser.add_argument('-p', '--profiles', type=int, default=50,
+                        help="saved data sets in the session")
+    args = parser.parse_args(argv)
+    print("log level {0}, {1} profiles".format(
+        os.environ.get('GENOME_LOG_LEVEL', 'default'), args.profiles))
+    print("{:<24}{:>12}{:>14}".format('request', 'cpu us', 'log bytes'))
+    for label, event in session_events(args.profiles):
+        batch = [copy.deepcopy(event) for _ in range(args.number)]
+        counter = ByteCounter()
+        with contextlib.redirect_stdout(counter):
+            start = time.process_time()
+            for each in batch:
+                genomeMatch.lambda_handler(each, None)
+            seconds = time.process_time() - start
+        print("{:<24}{:>12.1f}{:>14.0f}".format(
+            label, seconds / args.number * 1e6, counter.count / args.number))
+
+
+if __name__ == '__main__':
+    main()
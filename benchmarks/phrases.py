@@ -0,0 +1,87 @@
+"""
+phrases.py: benchmark of clean_phrase
+
+Checks clean_phrase and the old chain of re.sub calls against GOLDEN of
+tests/test_phrases.py, which pytest runs, then times the chain against
+the rule table with the memo cleared on every call, and with it warm as
+it is for repeat downloads.
+
+    python benchmarks/phrases.py [-n NUMBER]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+import genomeMatch  # noqa: E402
+from test_phrases import GOLDEN  # noqa: E402
+
+
+def chained_phrase(trait, phrase):
+    """clean_phrase before the rule table, with its openness test fixed"""
+    if (trait == 'bmi' or trait == 'body-fat-mass' or trait == 'breast-size'
+       or trait == 'mathematical-ability' or trait == 'hippocampal-volume'
+       or trait == 'reading-and-spelling-ability'):
+        phrase = 'tend to have a ' + phrase + trait.replace('-', ' ')
+    if trait == 'openness':
+        if phrase.find('not to be') >= 0:
+            phrase = 'tend not to be open to experience. '
+        else:
+            phrase = 'tend to be open to experience. '
+    phrase = re.sub(r', slightly$', '', phrase)
+    phrase = re.sub(r'^Weak', 'have low', phrase)
+    phrase = re.sub(r'^Does not show', 'have low', phrase)
+    phrase = re.sub(r'^Somewhat prone', 'are somewhat prone', phrase)
+    phrase = re.sub(r'^Not easily', 'are not easily', phrase)
+    phrase = re.sub(r'^Easily', 'are easily', phrase)
+    phrase = re.sub(r'^Stronger tendency', 'have a strong tendency', phrase)
+    phrase = re.sub(r'^Slight tendency', 'have a tendency', phrase)
+    phrase = re.sub(r'^Strong', 'have high', phrase)
+    return "They " + phrase
+
+
+def check_golden():
+    """assert clean_phrase and chained_phrase give every GOLDEN phrase"""
+    for (trait, text, expected) in GOLDEN:
+        for clean in (genomeMatch.clean_phrase, chained_phrase):
+            phrase = clean(trait, text)
+            assert phrase == expected, "{0} of {1!r} for {2}: {3!r}".format(
+                clean.__name__, text, trait, phrase)
+
+
+def download(clean):
+    """clean every GOLDEN summary once, like a download of each"""
+    for (trait, text, _) in GOLDEN:
+        clean(trait, text)
+
+
+def cold_download():
+    """download with the clean_phrase memo cleared first"""
+    genomeMatch.rewrite_phrase.cache_clear()
+    download(genomeMatch.clean_phrase)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help="downloads per timing")
+    args = parser.parse_args(argv)
+    check_golden()
+    print("{0} golden phrases match".format(len(GOLDEN)))
+    cases = [
+        ('chained re.sub', lambda: download(chained_phrase)),
+        ('rule table, cold', cold_download),
+        ('rule table, memoized',
+         lambda: download(genomeMatch.clean_phrase)),
+    ]
+    print("{:<24}{:>14}".format('case', 'us/download'))
+    for label, call in cases:
+        seconds = min(timeit.repeat(call, number=args.number, repeat=3))
+        print("{:<24}{:>14.3f}".format(label, seconds / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+storage.py: reads and writes of user items by storage engine
+
+Times what a launch reads (load_dbdata) and what a session end writes
+(save_dbdata with one profile named) for each GENOME_DB_ENGINE, with and
+without the in-memory cache in front.  DynamoDB is the MemoryDynamoDB
+stand-in of backends.py with --db-latency seconds added to every call,
+like the network round trip; SQLite is a file in a temporary directory.
+
+    python benchmarks/storage.py [-n NUMBER] [-p PROFILES] [--db-latency S]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import backends  # noqa: E402
+import genomeMatch  # noqa: E402
+import suite  # noqa: E402
+
+USER_ID = 'amzn1.ask.account.STORAGE'
+# (label, environment) of each configuration timed
+CONFIGS = [
+    ('dynamodb', {}),
+    ('dynamodb + cache', {genomeMatch.DB_CACHE_SIZE_ENV: '64'}),
+    ('sqlite', {genomeMatch.DB_ENGINE_ENV: genomeMatch.ENGINE_SQLITE}),
+    ('sqlite + cache', {genomeMatch.DB_ENGINE_ENV: genomeMatch.ENGINE_SQLITE,
+                        genomeMatch.DB_CACHE_SIZE_ENV: '64'}),
+    ('memory', {genomeMatch.DB_ENGINE_ENV: genomeMatch.ENGINE_MEMORY}),
+]
+
+
+def configure(environment, latency, directory):
+    """new store for `environment`, over a new MemoryDynamoDB"""
+    for name in (genomeMatch.DB_ENGINE_ENV, genomeMatch.DB_CACHE_SIZE_ENV):
+        os.environ.pop(name, None)
+    os.environ.update(environment)
+    os.environ[genomeMatch.DB_PATH_ENV] = os.path.join(
+        directory, '{0}.db'.format(len(os.listdir(directory))))
+    dynamodb = backends.install_dynamodb(latency)
+    return (genomeMatch.get_store(), dynamodb)
+
+
+def save(profiles, rng):
+    """save_dbdata of loaded data with one profile renamed"""
+    (stored, used) = genomeMatch.load_dbdata(USER_ID)
+    data = genomeMatch.TrackedData(stored, genomeMatch.new_changes())
+    data['bench'] = profiles['profile{0}'.format(
+        rng.randrange(len(profiles)))]
+    genomeMatch.save_dbdata(USER_ID, data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help="launches and saves of each configuration")
+    parser.add_argument('-p', '--profiles', type=int, default=50,
+                        help="profiles stored for the user")
+    parser.add_argument('--db-latency', type=float, default=0.005,
+                        help="seconds each DynamoDB call takes")
+    args = parser.parse_args(argv)
+    profiles = backends.seed_user(backends.MemoryDynamoDB(), USER_ID,
+                                  args.profiles)
+    print("{:<18}{:<8}{:>11}{:>11}{:>11}{:>11}".format(
+        'engine', 'case', 'p50 us', 'p95 us', 'p99 us', 'db calls'))
+    with tempfile.TemporaryDirectory() as directory:
+        for (label, environment) in CONFIGS:
+            (store, dynamodb) = configure(environment, args.db_latency,
+                                          directory)
+            rng = random.Random(0)
+            cases = [
+                ('launch', lambda: genomeMatch.load_dbdata(USER_ID)),
+                ('save', lambda: save(profiles, rng)),
+            ]
+            with backends.quiet():
+                store.put(USER_ID, profiles)
+            for (case, call) in cases:
+                calls = dynamodb.stats()[0]
+                with backends.quiet():
+                    samples = sorted(suite.sample(call, args.number))
+                print("{:<18}{:<8}{:>11.1f}{:>11.1f}{:>11.1f}{:>11.2f}".format(
+                    label, case, suite.percentile(samples, 50) * 1e6,
+                    suite.percentile(samples, 95) * 1e6,
+                    suite.percentile(samples, 99) * 1e6,
+                    (dynamodb.stats()[0] - calls) / args.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+suite.py: function and end-to-end benchmarks by stored-profile count
+
+The function level times get_comparison, clean_phrase, say_list,
+get_options_messages and the response builders.  The handler level
+replays a whole session through lambda_handler - LaunchRequest,
+LoadIntent, NameIntent, CompareIntent and SessionEndedRequest - against
+the MemoryDynamoDB and FakeGenomeLink stand-ins of backends.py, with the
+user's stored profiles restored before each session.  Both report
+p50/p95/p99 latency and throughput for each number of stored profiles.
+
+    python benchmarks/suite.py [-n NUMBER] [-s SESSIONS]
+                               [-p PROFILES ...] [--level LEVEL]
+
+The report cache is emptied so every LoadIntent downloads; pass
+--report-cache to keep it warm like repeat downloads of demo tokens.
+"""
+import argparse
+import copy
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import backends  # noqa: E402
+import events  # noqa: E402
+import genomeMatch  # noqa: E402
+
+DEFAULT_PROFILES = [1, 10, 100, 1000]
+
+
+def percentile(ordered, q):
+    """nearest-rank `q` percentile of sorted `ordered`"""
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def report(level, label, profiles, samples):
+    """print a row of percentiles in us and calls per second"""
+    ordered = sorted(samples)
+    print("{:<9}{:<26}{:>9}{:>11.1f}{:>11.1f}{:>11.1f}{:>11.0f}".format(
+        level, label, profiles, percentile(ordered, 50) * 1e6,
+        percentile(ordered, 95) * 1e6, percentile(ordered, 99) * 1e6,
+        len(samples) / sum(samples)))
+
+
+def sample(call, number):
+    """seconds taken by each of `number` calls"""
+    samples = []
+    for _ in range(number):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def function_cases(profiles):
+    """(label, call) for the function level with `profiles` stored"""
+    data = backends.seed_user(backends.MemoryDynamoDB(), events.USER_ID,
+                              profiles)
+    names = list(data)
+    other = names[1] if profiles > 1 else names[0]
+    tracked = genomeMatch.TrackedData(data, genomeMatch.new_changes())
+    session = events.make_session({genomeMatch.DATA_KEY: tracked})
+    summaries = [(trait, text.format(trait))
+                 for trait in genomeMatch.TRAIT_LIST
+                 for text in backends.SUMMARY_TEXTS]
+    calls = iter(range(1 << 62))
+    speech = "There was a strong match in 3 traits. " * 4
+    return [
+        ('get_comparison', lambda: genomeMatch.get_comparison(
+            data, names[0], other)),
+        ('get_comparison tracked', lambda: genomeMatch.get_comparison(
+            tracked, names[0], other)),
+        ('clean_phrase', lambda: genomeMatch.clean_phrase(
+            *summaries[next(calls) % len(summaries)])),
+        ('say_list', lambda: genomeMatch.say_list(names, 'en-US')),
+        ('get_options_messages', lambda: genomeMatch.get_options_messages(
+            session, 'en-US')),
+        ('response_ask', lambda: genomeMatch.response_ask(speech, speech)),
+        ('response', lambda: genomeMatch.response(
+            session['attributes'], genomeMatch.response_ask(speech,
+                                                            speech))),
+    ]
+
+
+def run_functions(profiles, number):
+    """time the function level with `profiles` stored"""
+    for (label, call) in function_cases(profiles):
+        with backends.quiet():
+            samples = sample(call, number)
+        report('function', label, profiles, samples)
+
+
+def replay_session(userId=events.USER_ID):
+    """
+    send a session of user through lambda_handler, timing each request
+
+    Returns:
+        list of (request label, seconds)
+    """
+    steps = [
+        ('LaunchRequest', lambda attributes: events.launch_request(
+            userId=userId)),
+        ('LoadIntent', lambda attributes: events.intent_request(
+            'LoadIntent', attributes=dict(attributes, testUser=1),
+            userId=userId)),
+        ('NameIntent', lambda attributes: events.intent_request(
+            'NameIntent', {'name': 'bench'}, attributes=attributes,
+            userId=userId)),
+        ('CompareIntent', lambda attributes: events.intent_request(
+            'CompareIntent', {'nameA': 'profile0', 'nameB': 'bench'},
+            attributes=attributes, userId=userId)),
+        ('SessionEndedRequest', lambda attributes:
+         events.session_ended_request(attributes, userId=userId)),
+    ]
+    timings = []
+    attributes = {}
+    for (label, make_event) in steps:
+        event = make_event(attributes)
+        start = time.perf_counter()
+        result = genomeMatch.lambda_handler(event, None)
+        timings.append((label, time.perf_counter() - start))
+        if result is not None:
+            attributes = result['sessionAttributes']
+    return timings
+
+
+def run_handler(profiles, sessions):
+    """time the handler level with `profiles` stored"""
+    dynamodb = backends.install_dynamodb()
+    backends.seed_user(dynamodb, events.USER_ID, profiles)
+    stored = {name: dict(table.items)
+              for (name, table) in dynamodb.tables.items()}
+    samples = {}
+    with backends.quiet():
+        # the first session pays for imports and connections
+        replay_session()
+    for _ in range(sessions):
+        for (name, items) in stored.items():
+            dynamodb.tables[name].items = copy.deepcopy(items)
+        with backends.quiet():
+            timings = replay_session()
+        for (label, seconds) in timings:
+            samples.setdefault(label, []).append(seconds)
+    for (label, seconds) in samples.items():
+        report('handler', label, profiles, seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--number', type=int, default=2000,
+                        help="calls of each function")
+    parser.add_argument('-s', '--sessions', type=int, default=30,
+                        help="sessions replayed through lambda_handler")
+    parser.add_argument('-p', '--profiles', type=int, nargs='+',
+                        default=DEFAULT_PROFILES,
+                        help="stored profile counts to measure")
+    parser.add_argument('--level', choices=['function', 'handler', 'all'],
+                        default='all', help="which level to run")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds FakeGenomeLink takes per report")
+    parser.add_argument('--report-cache', action='store_true',
+                        help="keep downloaded reports in the report cache")
+    args = parser.parse_args(argv)
+    if not args.report_cache:
+        os.environ[genomeMatch.CACHE_SIZE_ENV] = '0'
+    genomelink = backends.FakeGenomeLink(latency=args.latency).start()
+    print("{:<9}{:<26}{:>9}{:>11}{:>11}{:>11}{:>11}".format(
+        'level', 'case', 'profiles', 'p50 us', 'p95 us', 'p99 us',
+        'per s'))
+    for profiles in args.profiles:
+        if args.level in ('function', 'all'):
+            run_functions(profiles, args.number)
+        if args.level in ('handler', 'all'):
+            run_handler(profiles, args.sessions)
+    genomelink.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,18 @@
 """genomeMatch.py: compares two Genome Link data reports"""
+import contextlib
+import contextvars
+import hashlib
 import json
+import logging
+import os
+import random
 import re
+import reprlib
 import sys
-import asyncio
-import concurrent.futures
-from functools import partial
-import genomelink
-import boto3
-from botocore.exceptions import ClientError
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, partial, wraps
 
 __copyright__ = 'Copyright (C) 2018 Milton Huang'
 __license__ = 'MIT'
@@ -17,21 +22,145 @@ PRINT_LIMIT = 22
 
 # --------------- attributes keys -----------------
 DATA_KEY = 'genome data'
+CHANGES_KEY = 'data changes'    # names changed since load, for saving
+CHANGED = 'changed'
+REMOVED = 'removed'
+TOUCHED = 'touched'             # names only newly used, for profile layout
+USED_KEY = 'last used'          # name: epoch_day used today, to save
+PHRASES_KEY = 'phrases'         # phrase table for packed DATA_KEY
+NO_SCORE = '-'                  # packed placeholder for a missing trait
+PAIR_SEP = '\t'                 # between names in PAIRS_KEY keys
+MISSING_SCORE = -1              # score matrix placeholder for missing trait
+RANK_TOP_K = 3                  # matches said by RankIntent
+GROUP_SAY_NAMES = 5             # GroupIntent counts larger groups
+GROUP_SAY_TRAITS = 8            # traits said per match class by GroupIntent
+EVICT_SAY_NAMES = 5             # evicted names said before counting the rest
+GROUP_FILLER = ('and', 'with', 'all', 'everyone', 'everybody', 'the',
+                'group', 'of', 'us')    # words in NAMES_SLOT that aren't names
+OPT_IN_KEY = 'match opt in'     # cached OPT_IN of user
+PAIRS_KEY = 'pair matches'      # pair_key: match_mask of pairs compared
+PAGES_KEY = 'more pages'        # speech pages left for NextIntent
+TOKEN_KEY = 'download token'    # token_digest 'untitled' came from, or None
+COMMON_KEY = 'in common'        # common summary, with 'saved' if stored
+COMPARE_PAGE_TRAITS = 5         # traits said per page by CompareIntent
+LIST_PAGE_NAMES = 10            # names said per page by ListIntent
 SPEECHOUTPUT_KEY = 'speechOutput'
 REPROMPT_KEY = 'repromptText'
 # --------------- slots names -----------------
 NAME_SLOT = 'name'
 NAME_SLOTA = 'nameA'
 NAME_SLOTB = 'nameB'
+NAMES_SLOT = 'names'
 # --------------- DynamoDB names -----------------
-USERID = 'userId'   # table key
-DATA = 'data'       # table record
-
-# local version
-# DYNAMODB = boto3.resource('dynamodb', region_name='us-east-1',
-#                           endpoint_url='http://localhost:8000')
-DYNAMODB = boto3.resource('dynamodb', region_name='us-east-1')
-db_table = DYNAMODB.Table('genomeTable')
+USERID = 'userId'       # table key
+DATA = 'data'           # table record
+PROFILE = 'profile'     # sort key of per-profile table
+OPT_IN = 'matchOptIn'   # user agreed to cross-user matching
+LAST_USED = 'lastUsed'  # epoch_day of each profile's last use
+EXPIRES = 'expires'     # TTL of an unnamed profile item, epoch seconds
+TOKEN = 'token'         # token_digest of a partial 'untitled' download
+COMMON = 'common'       # common summary of the user's named profiles
+
+# --------------- DynamoDB config -----------------
+# set GENOME_DB_ENDPOINT=http://localhost:8000 for local version
+DB_REGION_ENV = 'GENOME_DB_REGION'
+DB_TABLE_ENV = 'GENOME_DB_TABLE'
+DB_ENDPOINT_ENV = 'GENOME_DB_ENDPOINT'
+DB_PROFILE_TABLE_ENV = 'GENOME_DB_PROFILE_TABLE'
+DB_LAYOUT_ENV = 'GENOME_DB_LAYOUT'
+DEFAULT_DB_REGION = 'us-east-1'
+DEFAULT_DB_TABLE = 'genomeTable'
+DEFAULT_DB_PROFILE_TABLE = 'genomeProfileTable'
+# storage layouts: one item with all data per user, or one item per profile
+LAYOUT_ITEM = 'item'
+LAYOUT_PROFILE = 'profile'
+BATCH_GET_LIMIT = 100   # keys per BatchGetItem call
+
+# --------------- storage config -----------------
+# GENOME_DB_ENGINE picks where userId items of the item layout live:
+# dynamodb, sqlite in the file GENOME_DB_PATH, or memory in this process
+# only.  GENOME_DB_CACHE_SIZE above 0 keeps that many users' items in
+# memory in front of dynamodb or sqlite, for GENOME_DB_CACHE_TTL seconds
+DB_ENGINE_ENV = 'GENOME_DB_ENGINE'
+DB_PATH_ENV = 'GENOME_DB_PATH'
+DB_CACHE_SIZE_ENV = 'GENOME_DB_CACHE_SIZE'
+DB_CACHE_TTL_ENV = 'GENOME_DB_CACHE_TTL'
+ENGINE_DYNAMODB = 'dynamodb'
+ENGINE_SQLITE = 'sqlite'
+ENGINE_MEMORY = 'memory'
+DEFAULT_DB_PATH = 'genome.db'
+DEFAULT_DB_CACHE_SIZE = 0
+DEFAULT_DB_CACHE_TTL = 60       # seconds
+
+# --------------- storage budget config -----------------
+# Named profiles used least recently (compared, ranked or named) are
+# evicted to keep a user within GENOME_MAX_PROFILES, 0 for no cap, and in
+# the item layout within GENOME_MAX_ITEM_BYTES, under DynamoDB's 400 KB
+# item limit.  An 'untitled' download not named in GENOME_UNTITLED_TTL
+# days is deleted, 0 for never.
+MAX_PROFILES_ENV = 'GENOME_MAX_PROFILES'
+MAX_ITEM_BYTES_ENV = 'GENOME_MAX_ITEM_BYTES'
+UNTITLED_TTL_ENV = 'GENOME_UNTITLED_TTL'
+DEFAULT_MAX_PROFILES = 0
+DEFAULT_MAX_ITEM_BYTES = 350000
+DEFAULT_UNTITLED_TTL = 7        # days
+DAY_SECONDS = 24 * 60 * 60
+ITEM_OVERHEAD = 512     # bytes of userId, OPT_IN and map headers
+
+# --------------- match index config -----------------
+# GENOME_MATCH_INDEX is the path of an index built by
+# tools/build_match_index.py; cross-user matching is off without it
+MATCH_INDEX_ENV = 'GENOME_MATCH_INDEX'
+
+# --------------- report cache config -----------------
+# GENOME_CACHE_TABLE turns on the shared tier, a table keyed on cacheKey
+# with DynamoDB TTL enabled on the expires attribute
+CACHE_SIZE_ENV = 'GENOME_CACHE_SIZE'
+CACHE_TTL_ENV = 'GENOME_CACHE_TTL'
+CACHE_TABLE_ENV = 'GENOME_CACHE_TABLE'
+DEFAULT_CACHE_SIZE = 1024           # reports kept in memory
+DEFAULT_CACHE_TTL = 24 * 60 * 60    # seconds
+CACHE_KEY = 'cacheKey'
+CACHE_SUMMARY = 'summary'
+CACHE_EXPIRES = 'expires'
+
+# --------------- logging config -----------------
+# GENOME_LOG_LEVEL is DEBUG, INFO (default), WARNING or ERROR; any other
+# level logs a warning and falls back to INFO.  Each value logged is cut
+# to GENOME_LOG_FIELD_LIMIT characters; secrets like tokens are cut
+# further, to PRINT_LIMIT.
+LOG_LEVEL_ENV = 'GENOME_LOG_LEVEL'
+DEFAULT_LOG_LEVEL = 'INFO'
+LOG_FIELD_LIMIT_ENV = 'GENOME_LOG_FIELD_LIMIT'
+DEFAULT_LOG_FIELD_LIMIT = 500
+LOGGER_NAME = 'genomeMatch'
+
+# --------------- tracing config -----------------
+# GENOME_TRACE_RATE is the fraction of requests traced, from 0 (default,
+# off) to 1 (every request)
+TRACE_RATE_ENV = 'GENOME_TRACE_RATE'
+DEFAULT_TRACE_RATE = 0.0
+
+# --------------- memory profiling config -----------------
+# GENOME_MEMORY_PROFILE set to a number of allocation sites, like 10,
+# profiles every request with tracemalloc; it is off when unset or 0
+MEMORY_PROFILE_ENV = 'GENOME_MEMORY_PROFILE'
+
+# created on first use and kept for warm invocations
+_logger = None
+_log_field_limit = DEFAULT_LOG_FIELD_LIMIT
+_log_repr = None        # reprlib.Repr cutting logged values
+_dynamodb = None
+_db_table = None
+_profile_table = None
+_store = None
+_report_cache = None
+_match_index = None
+_executor = None
+_http_session = None
+_runtime_lock = threading.Lock()
+_thread_state = threading.local()   # event loop for each thread
+_memory_peaks = {}      # handler name: largest peak bytes profiled
 
 DATA_SCOPE = [('report:agreeableness report:anger report:conscientiousness '
                'report:depression report:extraversion report:gambling '
@@ -41,6 +170,28 @@ TRAIT_LIST = ['agreeableness', 'anger', 'conscientiousness',
               'depression', 'extraversion', 'gambling',
               'harm-avoidance', 'neuroticism', 'openness',
               'novelty-seeking', 'reward-dependence']
+POPULATION = 'european'
+
+# --------------- report fetching limits (seconds) -----------------
+ALEXA_TIMEOUT = 8.0     # Alexa gives up waiting for a response after this
+RESPONSE_MARGIN = 1.0   # kept back from the deadline to build the response
+FETCH_TIMEOUT = 3.0     # for one attempt at one trait
+FETCH_RETRIES = 2       # attempts after the first one
+FETCH_BACKOFF = 0.25    # first retry delay, doubled for each later one
+PROGRESSIVE_TIMEOUT = 1.0   # for sending a progressive response
+# GENOME_DIRECTIVE_ENDPOINT replaces the apiEndpoint Alexa sends, e.g. to
+# point progressive responses at a local stub server
+DIRECTIVE_ENDPOINT_ENV = 'GENOME_DIRECTIVE_ENDPOINT'
+DIRECTIVE_PATH = '/v1/directives'
+
+# --------------- GenomeLink API config -----------------
+# GENOME_LINK_API replaces the GenomeLink server, e.g. with a local fake
+GENOMELINK_API_ENV = 'GENOME_LINK_API'
+DEFAULT_GENOMELINK_API = 'https://genomelink.io'
+REPORT_PATH = '/v1/reports/{0}/'
+# GENOME_WORKERS bounds the threads shared by all blocking calls
+WORKERS_ENV = 'GENOME_WORKERS'
+DEFAULT_WORKERS = 12
 
 """
  * When editing messages pay attention to punctuation.
@@ -90,6 +241,13 @@ languageSupport = {
                                     "downloads. Continue when you are "
                                     "ready by saying open genome match"),
             'GENOMELOAD_CONFIRM': "I have downloaded the data set. ",
+            'GENOMELOAD_PARTIAL': ("I could only download {0} of the {1} "
+                                   "traits. "),
+            'RESUME_OPTION': "Say load data to download the rest. ",
+            'NEXT_OPTION': "Say next to hear more. ",
+            'NO_MORE_MESSAGE': "There is no more to hear. ",
+            'INCOMPLETE_MESSAGE': ("Your last download is missing {0} "
+                                   "traits. "),
             'GENOMELOAD_ERROR': ("I got an error while trying "
                                  "to download data. You can try again, "
                                  "or you can go back to the alexa app "
@@ -110,12 +268,45 @@ languageSupport = {
             'NEW_NAME_MESSAGE': ("That name is already in use.  Please "
                                  "pick another one. "),
             'NAME_CONFIRM_MESSAGE': "I have named the data set {0}. ",
+            'EVICTED_MESSAGE': ("To make room, I removed the data you "
+                                "used least: "),
             'NO_MATCH_MESSAGE': ("There are no strong matches in genetic "
                                  "similarity for the traits I examined. "),
             'HIGH_MATCH_MESSAGE': "There was a strong match in {0} traits. ",
             'MOD_MATCH_MESSAGE': ("There was a moderately strong match "
                                   "in {0} traits. "),
             'MATCH_START_MESSAGE': "For {0} and {1}, ",
+            'RANK_MESSAGE': "The best matches for {0} are ",
+            'RANK_ITEM': "{0}, with {1} strong and {2} moderate matches",
+            'RANK_OPTION': ("You can have me find who matches someone best "
+                            "by saying who matches, then the name. "),
+            'OPT_IN_MESSAGE': ("Your named data sets can now be matched "
+                               "with other people who agreed to matching. "),
+            'OPT_OUT_MESSAGE': ("Your data sets won't be matched with other "
+                                "people any more. "),
+            'SIMILAR_OPTION': ("You can have me look for people similar to "
+                               "someone by saying find people like, then "
+                               "the name. "),
+            'SIMILAR_MESSAGE': ("Among people who agreed to matching, the "
+                                "closest to {0} shares {1} strong and {2} "
+                                "moderate matches. "),
+            'GROUP_START_MESSAGE': "For {0}, ",
+            'GROUP_COUNT_MESSAGE': "For the {0} people in the group, ",
+            'GROUP_HIGH_MESSAGE': ("everyone has a strong match in {0} "
+                                   "traits. "),
+            'GROUP_MOD_MESSAGE': ("everyone has at least a moderately strong "
+                                  "match in {0} traits. "),
+            'GROUP_NO_MATCH_MESSAGE': ("there are no traits where everyone "
+                                       "matches. "),
+            'MORE_TRAITS': "{0} more",
+            'GROUP_OPTION': ("You can have me compare a group by saying "
+                             "compare the group, then the names, or compare "
+                             "everyone. "),
+            'NO_SIMILAR_MESSAGE': "I didn't find anyone similar to {0}. ",
+            'NO_INDEX_MESSAGE': ("Matching with other people isn't "
+                                 "available right now. "),
+            'NEED_OPT_IN_MESSAGE': ("To match with other people, first say "
+                                    "share my data for matching. "),
         },
     },
     "en-GB": {
@@ -128,13 +319,200 @@ languageSupport = {
 
 
 def lambda_handler(event, context):
-    """App entry point"""
-    if event['request']['type'] == 'LaunchRequest':
-        return on_launch(event['request'], event['session'])
-    elif event['request']['type'] == 'IntentRequest':
-        return on_intent(event['request'], event['session'])
-    elif event['request']['type'] == 'SessionEndedRequest':
-        return on_session_ended(event['session'])
+    """
+    App entry point
+
+    Routes the request through REQUEST_HANDLERS, timing it under the
+    intent name for an IntentRequest, or the request type otherwise.
+    """
+    request = event['request']
+    if request['type'] not in REQUEST_HANDLERS:
+        return None
+    name = handler_name(request)
+    with profile_memory(name), trace_request(request, name):
+        if 'attributes' in event['session']:
+            decode_attributes(event['session']['attributes'])
+        args = {'request': request, 'session': event['session'],
+                'context': context, 'event_context': event.get('context')}
+        return timed(name, REQUEST_HANDLERS[request['type']], args)
+
+
+# --------------- tracing -----------------
+# A sampled request gets a Trace, and span() records a Span in it for each
+# step, nested by the span it runs in.  The trace and the current span are
+# context variables, so the report fetching tasks each nest under the span
+# that started them.  The whole trace is written to stdout as one JSON
+# line when the request is done.  Outside a sampled request span() does
+# nothing.
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+_current_span = contextvars.ContextVar('span', default=None)
+
+
+class Trace:
+    """spans of one request"""
+
+    def __init__(self, trace_id):
+        self.id = trace_id
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def as_dict(self):
+        """the trace as exported, times in ms from its start"""
+        return {'trace': self.id,
+                'spans': [each.as_dict(self.start) for each in self.spans]}
+
+
+class Span:
+    """one timed step of a request, with attributes"""
+    __slots__ = ('name', 'id', 'parent', 'start', 'end', 'attributes')
+
+    def __init__(self, name, span_id, parent, attributes):
+        self.name = name
+        self.id = span_id
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """add or replace attributes"""
+        self.attributes.update(attributes)
+
+    def as_dict(self, origin):
+        """the span as exported, times in ms from `origin`"""
+        end = self.end if self.end is not None else time.perf_counter()
+        return {'name': self.name, 'id': self.id, 'parent': self.parent,
+                'start_ms': round((self.start - origin) * 1000, 3),
+                'duration_ms': round((end - self.start) * 1000, 3),
+                'attributes': self.attributes}
+
+
+class NullSpan:
+    """what span() gives outside a sampled request"""
+
+    def set(self, **attributes):
+        """ignore attributes"""
+
+
+NULL_SPAN = NullSpan()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    record the block run in it as a span of the current trace
+
+    an exception leaving the block is recorded as the error attribute
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield NULL_SPAN
+        return
+    current = Span(name, len(trace.spans) + 1, _current_span.get(),
+                   attributes)
+    trace.spans.append(current)
+    token = _current_span.set(current.id)
+    try:
+        yield current
+    except BaseException:
+        current.set(error=repr(sys.exc_info()[1]))
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(func):
+    """decorator recording each call of `func` as a span of its name"""
+    @wraps(func)
+    def call(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return call
+
+
+@contextlib.contextmanager
+def trace_request(request, name):
+    """trace the request in the block if it is sampled, then export it"""
+    rate = float(os.environ.get(TRACE_RATE_ENV, DEFAULT_TRACE_RATE))
+    if rate <= 0 or random.random() >= rate:
+        yield
+        return
+    trace = Trace(request.get('requestId', ''))
+    token = _current_trace.set(trace)
+    try:
+        with span(name, type=request['type']):
+            yield
+    finally:
+        _current_trace.reset(token)
+        sys.stdout.write(json.dumps(trace.as_dict(), default=str) + '\n')
+
+# --------------- memory profiling -----------------
+# With GENOME_MEMORY_PROFILE set, tracemalloc runs from the first request
+# on, and each request writes one JSON line with the peak memory it
+# allocated over what was already in use, the largest such peak of its
+# handler so far in this container, the process max RSS, the allocation
+# sites that grew the most and the types of object whose count grew the
+# most.  Tracing allocations slows every
+# request several times over, so this is for sizing runs, not production.
+
+
+@contextlib.contextmanager
+def profile_memory(name):
+    """profile the memory the block allocates, if GENOME_MEMORY_PROFILE"""
+    top = int(os.environ.get(MEMORY_PROFILE_ENV, '0') or 0)
+    if top <= 0:
+        yield
+        return
+    import gc
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = count_objects(gc)
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    try:
+        yield
+    finally:
+        # only what the request added to what was already in use
+        peak = tracemalloc.get_traced_memory()[1] - start
+        objects = count_objects(gc) - objects
+        after = tracemalloc.take_snapshot()
+        report_memory(name, peak, before, after, objects, top)
+
+
+def count_objects(gc):
+    """Counter of the objects the garbage collector tracks, by type"""
+    from collections import Counter
+    return Counter(type(each).__name__ for each in gc.get_objects())
+
+
+def report_memory(name, peak, before, after, objects, top):
+    """write the memory profile of one request as a JSON line"""
+    import resource
+    import tracemalloc
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+    growth = after.filter_traces(ignore).compare_to(
+        before.filter_traces(ignore), 'lineno')
+    _memory_peaks[name] = max(peak, _memory_peaks.get(name, 0))
+    line = {
+        'memory': name,
+        'peak_bytes': peak,
+        'max_peak_bytes': _memory_peaks[name],
+        # kilobytes on Linux
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'sites': [{'site': '{0}:{1}'.format(stat.traceback[0].filename,
+                                            stat.traceback[0].lineno),
+                   'size_diff': stat.size_diff,
+                   'count_diff': stat.count_diff}
+                  for stat in growth[:top]],
+        'objects': dict(objects.most_common(top)),
+    }
+    sys.stdout.write(json.dumps(line) + '\n')
+
 
 # --------------- request handlers -----------------
 
@@ -142,16 +520,25 @@ def lambda_handler(event, context):
 def on_launch(request, session):
     """start"""
     userId = getuserId(session)
-    dbdata = get_dbdata(db_table, userId)
-    if 'attributes' in session:
-        session['attributes'][DATA_KEY] = dbdata
-    else:
-        session['attributes'] = {}
+    (dbdata, used) = load_dbdata(userId)
     if dbdata is None:
-        print("empty dbdata on launch")
+        log_info("empty dbdata on launch")
         dbdata = {}
     else:
-        print("on_launch dbdata: ", dbdata)
+        log_debug("on_launch dbdata: %s", dbdata)
+    if 'attributes' not in session:
+        session['attributes'] = {}
+    # freshly loaded data has nothing to save yet
+    session['attributes'][CHANGES_KEY] = new_changes()
+    session['attributes'][PAIRS_KEY] = {}
+    # days saved before today go back only when used again
+    today = epoch_day()
+    session['attributes'][USED_KEY] = {name: day for name, day
+                                       in used.items() if day == today}
+    session['attributes'][DATA_KEY] = TrackedData(
+        dbdata, session['attributes'][CHANGES_KEY],
+        session['attributes'][PAIRS_KEY], session['attributes'][USED_KEY])
+    expire_untitled(session['attributes'][DATA_KEY], used)
     locale = getlocale(request)
     resource = getresource(locale)
     speechmessage = resource['WELCOME_MESSAGE']
@@ -168,47 +555,49 @@ def on_launch(request, session):
                         response_ask(speechmessage, speechreprompt))
 
 
-def on_intent(request, session):
-    """called on Intent"""
-    intent_name = request['intent']['name']
-    print("on_intent: " + intent_name)
-    locale = getlocale(request)
+def on_intent(request, session, context=None, event_context=None):
+    """
+    called on Intent
 
-    if intent_name == "LoadIntent":
-        # check if have token or need to link
-        if get_accessToken(session) == "":
-            # return link_genome(session, locale)
-            return link_sample(session, locale)
+    `context` is the Lambda context, `event_context` the Alexa context
+    from the request event
+    """
+    intent_name = request['intent']['name']
+    log_info("on_intent: %s", intent_name)
+    if intent_name not in PAGE_INTENTS:
+        # pages left from an earlier answer are not next any more
+        session.get('attributes', {}).pop(PAGES_KEY, None)
+    args = {'request': request, 'session': session,
+            'locale': getlocale(request), 'context': context,
+            'event_context': event_context}
+    # unknown intents get help
+    return call_handler(INTENT_HANDLERS.get(intent_name,
+                                            INTENT_HANDLERS[HELP_INTENT]),
+                        args)
+
+
+def load_data(request, session, locale, context=None, event_context=None):
+    """link an account, or download from the linked one"""
+    # check if have token or need to link
+    if get_accessToken(session) == "":
+        # return link_genome(session, locale)
+        return link_sample(session, locale)
+    else:
+        if is_complete(pending_record(session)):
+            # after listing, will ask for naming
+            return get_list(session, locale)
         else:
-            if 'untitled' in session['attributes'][DATA_KEY]:
-                # after listing, will ask for naming
-                return get_list(session, locale)
-            else:
-                return download_genome(session, locale)
-    elif intent_name == 'NameIntent':
-        return set_name(request, session, locale)
-    elif intent_name == 'ListIntent':
-        return get_list(session, locale)
-    elif intent_name == 'CompareIntent':
-        return compare_data(request, session, locale)
-    elif intent_name == 'AMAZON.RepeatIntent':
-        return repeat_response(session)
-    elif intent_name == 'AMAZON.CancelIntent':
-        return stop_response(session, locale)
-    elif intent_name == 'AMAZON.StopIntent':
-        return stop_response(session, locale)
-    elif intent_name == 'AMAZON.HelpIntent':
-        return help_response(session, locale)
-    return help_response(session, locale)
+            # new download, or finish a partial one
+            return download_genome(request, session, locale, context,
+                                   event_context)
 
 
 def link_genome(session, locale):
     """get oauth accessToken from genomeLink"""
-    print("DEBUG: in link_genome with session: ", session)
+    log_debug("in link_genome with session: %s", session)
     resource = getresource(locale)
     # check if nameless data before loading more
-    session = check_init_session(session)
-    if 'untitled' in session['attributes'][DATA_KEY]:
+    if is_complete(pending_record(session)):
         speechmessage = (resource['NAMELESS_MESSAGE'] +
                          resource['GIVE_NAME_MESSAGE'])
         speechreprompt = resource['GIVE_NAME_MESSAGE']
@@ -228,11 +617,10 @@ def link_sample(session, locale):
 
     changes accessToken in session
     """
-    print("DEBUG: in link_sample with session: ", session)
+    log_debug("in link_sample with session: %s", session)
     resource = getresource(locale)
     # check if nameless data before loading more
-    session = check_init_session(session)
-    if 'untitled' in session['attributes'][DATA_KEY]:
+    if is_complete(pending_record(session)):
         speechmessage = (resource['NAMELESS_MESSAGE'] +
                          resource['GIVE_NAME_MESSAGE'])
         speechreprompt = resource['GIVE_NAME_MESSAGE']
@@ -242,7 +630,7 @@ def link_sample(session, locale):
         session['attributes']['testUser'] = 1
     # this doesn't work - can't set accessToken from skill
     # session['user']['accessToken'] = fetch_accessToken(session)
-    print("DEBUG exit link_sample:", session)
+    log_debug("exit link_sample: %s", session)
     speechmessage = resource['GENOMELINK_MESSAGE']
     speechreprompt = resource['GENOMELINK_REPROMPT']
     session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
@@ -251,76 +639,443 @@ def link_sample(session, locale):
                     response_ask_link_card(speechmessage, speechreprompt))
 
 
-def download_genome(session, locale):
-    """use accessToken to download data from genomeLink"""
-    err_flag = False
-    err_names = []
-    # TODO: add progressive response loading data
-    # https://developer.amazon.com/docs/custom-skills/send-the-user-a-progressive-response.html
-
-    loop = asyncio.get_event_loop()
-    data_record = loop.run_until_complete(fetch_reports(session))
+def download_genome(request, session, locale, context=None,
+                    event_context=None):
+    """
+    use accessToken to download data from genomeLink
+
+    Fetches only the traits still missing from the 'untitled' record and
+    saves whatever arrives before the deadline there, so a later
+    LoadIntent can finish a partial download.  The token is kept until the
+    record is complete so the rest comes from the same account; a partial
+    record from another account is discarded, not mixed with this one.
+    While reports download the user hears a progressive response; a
+    download answered from the report cache goes without.
+    """
     resource = getresource(locale)
-    if err_flag:
-        print("error downloading genome for: ", err_names)
-        speechmessage = resource['GENOMELOAD_ERROR']
-        speechreprompt = resource['TRY_AGAIN_MESSAGE']
-    else:
-        print("downloaded genome data: ", data_record)
-        session = check_init_session(session)
-        session['attributes'][DATA_KEY]['untitled'] = data_record
+    record = dict(pending_record(session) or {})
+    digest = token_digest(get_accessToken(session))
+    if record and pending_token(session) != digest:
+        log_info("discarded partial download of another account")
+        del session['attributes'][DATA_KEY]['untitled']
+        record = {}
+    traits = missing_traits(record)
+    loop = get_event_loop()
+    result = loop.run_until_complete(fetch_reports(
+        session, fetch_budget(context), traits, locale,
+        partial(send_progressive_response, request, event_context,
+                resource['GENOMELOAD_MESSAGE'])))
+    if result.errors:
+        log_warning("error downloading genome for: %s", result.errors)
+    if result.records:
+        log_debug("downloaded genome data: %s", result.records)
+        record.update(result.records)
+        session['attributes'][DATA_KEY]['untitled'] = record
+        session['attributes'][TOKEN_KEY] = digest
+    if is_complete(record):
         speechmessage = resource['GENOMELOAD_CONFIRM']
         speechmessage += resource['NAME_OPTION']
         speechreprompt = resource['NAME_OPTION']
-    # clear token
-    clearaccessToken(session)
+        clearaccessToken(session)
+    elif record:
+        speechmessage = resource['GENOMELOAD_PARTIAL'].format(
+            len(record), len(TRAIT_LIST))
+        speechmessage += resource['RESUME_OPTION']
+        speechreprompt = resource['RESUME_OPTION']
+    else:
+        speechmessage = resource['GENOMELOAD_ERROR']
+        speechreprompt = resource['TRY_AGAIN_MESSAGE']
+        clearaccessToken(session)
     session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
     session['attributes'][REPROMPT_KEY] = speechreprompt
-    print("exit download_genome:", session)
+    log_debug("exit download_genome: %s", session)
     return response(session['attributes'],
                     response_ask(speechmessage, speechreprompt))
 
 
-async def fetch_reports(session):
-    """report fetching coroutine"""
-    with concurrent.futures.ThreadPoolExecutor(max_workers=11) as executor:
-        loop = asyncio.get_event_loop()
-        token = get_accessToken(session)
-        futures = [
-            loop.run_in_executor(
-                executor,
-                partial(genomelink.Report.fetch,
-                        name=name, population='european', token=token)
-            )
-            for name in TRAIT_LIST
-        ]
-        data_record = {}
-        for name, response in zip(TRAIT_LIST, await asyncio.gather(*futures)):
-            data_record[name] = (response.summary['score'],
-                                 clean_phrase(name, response.summary['text']))
-            print('add record:', data_record[name])
-        return data_record
-
-        # try:
-        #     trait = genomelink.Report.fetch(name=name, population='european',
-        #                                     token=token)
-        #     data_record[name] = (trait.summary['score'],
-        #                          clean_phrase(name, trait.summary['text']))
-        #     print('fetched:', data_record[name])
-        # except:
-        #     print('error in downloading:', name, sys.exc_info())
-        #     err_flag = True
-        #     err_names.append((name, sys.exc_info()[1],
-        #                      sys.exc_info()[2].print_tb))
+class FetchResult:
+    """
+    outcome of fetch_reports
+
+    records maps each trait fetched to (score, phrase), errors maps each
+    trait that failed to a description of its last error
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.errors = {}
+
+    @property
+    def complete(self):
+        """True if every trait asked for was fetched"""
+        return not self.errors
+
+
+def fetch_budget(context):
+    """
+    seconds available to fetch reports in this invocation
+
+    the smaller of what is left of the Lambda timeout and Alexa's response
+    window, less RESPONSE_MARGIN to build the response
+    """
+    budget = ALEXA_TIMEOUT
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        budget = min(budget, context.get_remaining_time_in_millis() / 1000)
+    return max(budget - RESPONSE_MARGIN, 0)
+
+
+async def fetch_reports(session, budget=ALEXA_TIMEOUT - RESPONSE_MARGIN,
+                        traits=TRAIT_LIST, locale='en-US', notify=None):
+    """
+    report fetching coroutine
+
+    fetches `traits` concurrently, giving up on any still missing after
+    `budget` seconds.  `notify` is a coroutine function run alongside
+    the fetches, only if some trait isn't in the report cache.
+
+    Returns:
+        FetchResult
+    """
+    import asyncio
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + budget
+    token = get_accessToken(session)
+    result = FetchResult()
+    cache = get_report_cache()
+    with span('fetch_reports', traits=len(traits)) as fetch_span:
+        lookup = partial(cache.get_many, token, traits, POPULATION)
+        if cache.table_name:
+            # the shared tier is a DynamoDB read; keep it off the loop,
+            # in this context so its span joins the trace
+            summaries = await loop.run_in_executor(
+                None, contextvars.copy_context().run, lookup)
+        else:
+            summaries = lookup()
+        traits = [name for name in traits if name not in summaries]
+        fetch_span.set(cached=len(summaries))
+        if traits:
+            calls = [fetch_trait(name, token, deadline) for name in traits]
+            if notify is not None:
+                calls.append(notify())
+            outcomes = await asyncio.gather(*calls, return_exceptions=True)
+            fetched = {}
+            for name, outcome in zip(traits, outcomes):
+                if isinstance(outcome, Exception):
+                    result.errors[name] = repr(outcome)
+                else:
+                    fetched[name] = outcome
+            cache.put_many(token, fetched, POPULATION)
+            summaries.update(fetched)
+        fetch_span.set(failed=len(result.errors))
+    log_info("report cache: %s", cache.stats)
+    for name, summary in summaries.items():
+        result.records[name] = (summary['score'],
+                                clean_phrase(name, summary['text'], locale))
+        log_debug('add record: %s', result.records[name])
+    return result
+
+
+async def fetch_trait(name, token, deadline):
+    """
+    fetch one trait report, retrying with backoff until `deadline`
+
+    each attempt is limited to FETCH_TIMEOUT seconds, and the whole fetch
+    is a span with the trait and the number of attempts
+
+    Returns:
+        report summary dict with score and text
+    """
+    import asyncio
+    loop = asyncio.get_event_loop()
+    with span('fetch_trait', trait=name) as trait_span:
+        for attempt in range(FETCH_RETRIES + 1):
+            trait_span.set(attempts=attempt + 1)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("deadline passed for " + name)
+            timeout = min(FETCH_TIMEOUT, remaining)
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(
+                        None, partial(fetch_report, name, POPULATION, token,
+                                      timeout)),
+                    timeout)
+            except Exception:
+                log_warning('error in downloading: %s %s %s', name, attempt,
+                            sys.exc_info()[1])
+                delay = FETCH_BACKOFF * 2 ** attempt
+                if (attempt == FETCH_RETRIES or
+                        loop.time() + delay >= deadline):
+                    raise
+                await asyncio.sleep(delay)
+
+
+def fetch_report(name, population, token, timeout=FETCH_TIMEOUT):
+    """
+    GET one report summary from the GenomeLink API
+
+    Does the same request as genomelink.Report.fetch, but over the pooled
+    keep-alive session from get_http_session, so warm calls skip the
+    connection and TLS setup.
+
+    Returns:
+        report summary dict with score and text
+    """
+    api = os.environ.get(GENOMELINK_API_ENV, DEFAULT_GENOMELINK_API)
+    reply = get_http_session().get(
+        api.rstrip('/') + REPORT_PATH.format(name),
+        params={'population': population},
+        headers={'Authorization': 'Bearer ' + token},
+        timeout=timeout)
+    reply.raise_for_status()
+    summary = reply.json()['summary']
+    return {'score': summary['score'], 'text': summary['text']}
+
+
+async def send_progressive_response(request, event_context, speech):
+    """
+    send `speech` to the Alexa directive endpoint while the skill works
+    https://developer.amazon.com/docs/custom-skills/send-the-user-a-progressive-response.html
+
+    Failures are only logged; the final response still goes out.
+
+    Returns:
+        True if the directive was accepted
+    """
+    import asyncio
+    if event_context is None:
+        return False
+    token = getapiAccessToken(event_context)
+    endpoint = (os.environ.get(DIRECTIVE_ENDPOINT_ENV, '') or
+                getapiEndpoint(event_context))
+    if token == '' or endpoint == '':
+        return False
+    body = json.dumps({
+        'header': {
+            'requestId': request['requestId']
+        },
+        'directive': {
+            'type': 'VoicePlayer.Speak',
+            'speech': "<speak>" + speech + "</speak>"
+        }
+    }).encode('utf-8')
+    loop = asyncio.get_event_loop()
+    try:
+        with span('send_progressive_response') as directive_span:
+            status = await loop.run_in_executor(
+                None, partial(post_directive, endpoint.rstrip('/') +
+                              DIRECTIVE_PATH, body, token))
+            directive_span.set(status=status)
+    except Exception:
+        log_warning("progressive response failed: %s", sys.exc_info()[1])
+        return False
+    log_info("progressive response status: %s", status)
+    return status == 204
+
+
+def post_directive(url, body, token):
+    """POST json `body` to `url` with bearer `token`, returns HTTP status"""
+    import urllib.request
+    directive = urllib.request.Request(url, data=body, method='POST', headers={
+        'Authorization': 'Bearer ' + token,
+        'Content-Type': 'application/json'
+    })
+    with urllib.request.urlopen(directive,
+                                timeout=PROGRESSIVE_TIMEOUT) as reply:
+        return reply.status
+
+
+# --------------- warm container runtime -----------------
+# made once per container and reused by every warm invocation
+
+
+def get_executor():
+    """get the thread pool shared by all blocking calls"""
+    global _executor
+    with _runtime_lock:
+        if _executor is None:
+            import concurrent.futures
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.environ.get(WORKERS_ENV,
+                                               DEFAULT_WORKERS)),
+                thread_name_prefix='genome')
+    return _executor
+
+
+def get_event_loop():
+    """
+    get this thread's event loop, made on first use
+
+    Lambda runs one invocation at a time, so in practice this is the one
+    loop of the container.  Its default executor is get_executor().
+    """
+    loop = getattr(_thread_state, 'loop', None)
+    if loop is None or loop.is_closed():
+        import asyncio
+        loop = asyncio.new_event_loop()
+        loop.set_default_executor(get_executor())
+        asyncio.set_event_loop(loop)
+        _thread_state.loop = loop
+    return loop
+
+
+def get_http_session():
+    """get the keep-alive requests session for GenomeLink calls"""
+    global _http_session
+    with _runtime_lock:
+        if _http_session is None:
+            import requests
+            workers = int(os.environ.get(WORKERS_ENV, DEFAULT_WORKERS))
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=workers)
+            _http_session = requests.Session()
+            _http_session.mount('https://', adapter)
+            _http_session.mount('http://', adapter)
+    return _http_session
+
+
+def get_report_cache():
+    """get ReportCache configured from the environment, made on first use"""
+    global _report_cache
+    if _report_cache is None:
+        _report_cache = ReportCache(
+            int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE)),
+            int(os.environ.get(CACHE_TTL_ENV, DEFAULT_CACHE_TTL)),
+            os.environ.get(CACHE_TABLE_ENV, ''))
+    return _report_cache
+
+
+class ReportCache:
+    """
+    two-tier cache of GenomeLink report summaries
+
+    The first tier is an LRU dict in this process, so it lasts as long as
+    the Lambda container stays warm.  The optional second tier is a
+    DynamoDB table shared by all containers.  Entries in both expire after
+    `ttl` seconds.  Keys use a hash of the token, never the token itself.
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL,
+                 table_name=''):
+        self.size = size
+        self.ttl = ttl
+        self.table_name = table_name
+        self.stats = {'memory_hits': 0, 'shared_hits': 0, 'misses': 0}
+        self._entries = OrderedDict()    # key: (expires, summary)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token, trait, population):
+        """cache key for one report"""
+        return ':'.join((token_digest(token), population, trait))
+
+    def get_many(self, token, traits, population):
+        """
+        look up reports for `traits`
+
+        Returns:
+            dict of trait: summary for the traits found
+        """
+        now = time.time()
+        found = {}
+        keys = {self.key(token, trait, population): trait
+                for trait in traits}
+        with self._lock:
+            for key, trait in keys.items():
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[trait] = entry[1]
+            self.stats['memory_hits'] += len(found)
+        missing = {key: trait for key, trait in keys.items()
+                   if trait not in found}
+        if missing and self.table_name:
+            shared = self._get_shared(list(missing), now)
+            with self._lock:
+                for key, (expires, summary) in shared.items():
+                    self._remember(key, expires, summary)
+                    found[missing[key]] = summary
+                self.stats['shared_hits'] += len(shared)
+        with self._lock:
+            self.stats['misses'] += len(traits) - len(found)
+        return found
+
+    def put_many(self, token, summaries, population):
+        """store dict of trait: summary in both tiers"""
+        if not summaries:
+            return
+        expires = int(time.time()) + self.ttl
+        entries = {self.key(token, trait, population): summary
+                   for trait, summary in summaries.items()}
+        with self._lock:
+            for key, summary in entries.items():
+                self._remember(key, expires, summary)
+        if self.table_name:
+            self._put_shared(entries, expires)
+
+    def clear(self):
+        """drop the in-process tier and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            for name in self.stats:
+                self.stats[name] = 0
+
+    def _remember(self, key, expires, summary):
+        """add to in-process tier, evicting least recently used; locked"""
+        self._entries[key] = (expires, summary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    @traced
+    def _get_shared(self, keys, now):
+        """read unexpired `keys` from the shared table with BatchGetItem"""
+        from botocore.exceptions import ClientError
+        found = {}
+        request = {self.table_name: {
+            'Keys': [{CACHE_KEY: key} for key in keys]
+        }}
+        try:
+            while request:
+                response = get_dynamodb().batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    if item[CACHE_EXPIRES] > now:
+                        summary = item[CACHE_SUMMARY]
+                        found[item[CACHE_KEY]] = (
+                            int(item[CACHE_EXPIRES]),
+                            {'score': int(summary['score']),
+                             'text': summary['text']})
+                request = response.get('UnprocessedKeys')
+        except ClientError as e:
+            log_error("%s", e.response['Error']['Message'])
+        return found
+
+    @traced
+    def _put_shared(self, entries, expires):
+        """write dict of key: summary to the shared table"""
+        from botocore.exceptions import ClientError
+        table = get_dynamodb().Table(self.table_name)
+        try:
+            with table.batch_writer() as batch:
+                for key, summary in entries.items():
+                    batch.put_item(Item={CACHE_KEY: key,
+                                         CACHE_SUMMARY: summary,
+                                         CACHE_EXPIRES: expires})
+        except ClientError as e:
+            log_error("%s", e.response['Error']['Message'])
 
 
 def set_name(request, session, locale):
     """get name for data set"""
     resource = getresource(locale)
-    # check there is data to name
+    # check there is complete data to name
     session = check_init_session(session)
-    if 'untitled' not in session['attributes'][DATA_KEY]:
-        print("tried set_name with no data")
+    if not is_complete(pending_record(session)):
+        log_warning("tried set_name with no data")
         speechmessage = resource['NO_NAMELESS_MESSAGE']
         (addmessage, speechreprompt,
          useLink) = get_options_messages(session, locale)
@@ -336,27 +1091,39 @@ def set_name(request, session, locale):
                             response_ask(speechmessage, speechreprompt))
 
     slot_value = request['intent']['slots'][NAME_SLOT]['value']
-    print("DEBUG: set_name slots: ", request['intent']['slots'])
+    log_debug("set_name slots: %s", request['intent']['slots'])
     if slot_value in session['attributes'][DATA_KEY]:
         # name already used
         speechmessage = resource['NEW_NAME_MESSAGE']
         speechreprompt = resource['NEW_NAME_MESSAGE']
-        print("DEBUG: name already in use: ", slot_value)
+        log_debug("name already in use: %s", slot_value)
         session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
         session['attributes'][REPROMPT_KEY] = speechreprompt
         return response(session['attributes'],
                         response_ask(speechmessage, speechreprompt))
     else:
+        named = [name for name in session['attributes'][DATA_KEY]
+                 if name != 'untitled']
         session['attributes'][DATA_KEY][slot_value] = (session['attributes']
                                                        [DATA_KEY]['untitled'])
         del session['attributes'][DATA_KEY]['untitled']
+        evicted = enforce_budget(session['attributes'][DATA_KEY], slot_value,
+                                 getuserId(session))
+        unindex_profiles(session, evicted)
+        if not evicted:
+            # evicting can't be taken out of a summary; it is redone later
+            add_to_common(session, named, slot_value)
+        index_profiles(session, [slot_value])
         speechmessage = resource['NAME_CONFIRM_MESSAGE'].format(slot_value)
+        if evicted:
+            speechmessage += resource['EVICTED_MESSAGE']
+            speechmessage += say_some(evicted, locale, EVICT_SAY_NAMES)
         (addmessage, speechreprompt,
          useLink) = get_options_messages(session, locale)
         speechmessage += addmessage
         session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
         session['attributes'][REPROMPT_KEY] = speechreprompt
-        print("DEBUG: exit set_name: ", session, speechmessage)
+        log_debug("exit set_name: %s %s", session, speechmessage)
         if useLink:
             return response(session['attributes'],
                             response_ask_link_card(speechmessage,
@@ -370,25 +1137,18 @@ def get_list(session, locale):
     """say list of names"""
     session = check_init_session(session)
     name_list = list(session['attributes'][DATA_KEY].keys())
-    print("names in get_list: ", name_list)
+    log_debug("names in get_list: %s", name_list)
     resource = getresource(locale)
     if len(name_list) == 0:
-        speechmessage = resource['EMPTY_LIST_MESSAGE']
+        pages = [resource['EMPTY_LIST_MESSAGE']]
     else:
-        speechmessage = resource['LIST_MESSAGE']
-        speechmessage += say_list(name_list, locale)
+        pages = paginate([(resource['LIST_MESSAGE'], name_list)], locale,
+                         LIST_PAGE_NAMES)
     (addmessage, speechreprompt,
      useLink) = get_options_messages(session, locale)
-    speechmessage += addmessage
-    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
-    session['attributes'][REPROMPT_KEY] = speechreprompt
-    print("DEBUG: list response: ", speechmessage)
-    if useLink:
-        return response(session['attributes'],
-                        response_ask_link_card(speechmessage, speechreprompt))
-    else:
-        return response(session['attributes'],
-                        response_ask(speechmessage, speechreprompt))
+    log_debug("list pages: %s", pages)
+    return say_pages(session, locale, pages, addmessage, speechreprompt,
+                     useLink)
 
 
 def say_list(word_list, locale):
@@ -403,13 +1163,97 @@ def say_list(word_list, locale):
     return output
 
 
+def say_some(word_list, locale, limit):
+    """say_list of at most `limit` words, counting the rest"""
+    if len(word_list) <= limit:
+        return say_list(word_list, locale)
+    resource = getresource(locale)
+    more = resource['MORE_TRAITS'].format(len(word_list) - limit)
+    return say_list(word_list[:limit] + [more], locale)
+
+
+def paginate(sections, locale, size):
+    """
+    Split speech into pages of at most `size` listed words.
+
+    Each of `sections` is (intro, words), said as the intro and then
+    say_list of the words.  A list broken across pages ends each part
+    with a period, and an intro starts the page its first word is on.
+
+    Returns:
+        list of page speech strings
+    """
+    pages = []
+    page = ''
+    room = size
+    for intro, words in sections:
+        if room == 0 and words:
+            pages.append(page)
+            (page, room) = ('', size)
+        page += intro
+        while words:
+            if room == 0:
+                pages.append(page)
+                (page, room) = ('', size)
+            (part, words) = (words[:room], words[room:])
+            room -= len(part)
+            if words:
+                page += ', '.join(part) + '. '
+            else:
+                page += say_list(part, locale)
+    pages.append(page)
+    return pages
+
+
+def say_pages(session, locale, pages, options, reprompt, link=False):
+    """
+    say the first of `pages`, keeping the rest for NextIntent
+
+    The rest go in PAGES_KEY with `options` and `reprompt`, which follow
+    the last page, so later pages cost no recomputing.  `link` adds the
+    account link card to the last page.
+    """
+    session['attributes'][PAGES_KEY] = {'pages': pages, 'options': options,
+                                        'reprompt': reprompt, 'link': link}
+    return next_page(session, locale)
+
+
+def next_page(session, locale):
+    """say the next page kept by say_pages"""
+    resource = getresource(locale)
+    if 'attributes' not in session:
+        session['attributes'] = {}
+    cursor = session['attributes'].get(PAGES_KEY)
+    if cursor is None:
+        speechmessage = resource['NO_MORE_MESSAGE']
+        (addmessage, speechreprompt,
+         link) = get_options_messages(session, locale)
+        speechmessage += addmessage
+    elif len(cursor['pages']) > 1:
+        speechmessage = cursor['pages'].pop(0) + resource['NEXT_OPTION']
+        speechreprompt = resource['NEXT_OPTION']
+        link = False
+    else:
+        del session['attributes'][PAGES_KEY]
+        speechmessage = cursor['pages'][0] + cursor['options']
+        speechreprompt = cursor['reprompt']
+        link = cursor['link']
+    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
+    session['attributes'][REPROMPT_KEY] = speechreprompt
+    if link:
+        return response(session['attributes'],
+                        response_ask_link_card(speechmessage, speechreprompt))
+    else:
+        return response(session['attributes'],
+                        response_ask(speechmessage, speechreprompt))
+
+
 def compare_data(request, session, locale):
     """compare genome reports of names in two slots"""
-    # TODO: break up lists if longer than 5
     resource = getresource(locale)
     slotA_value = request['intent']['slots'][NAME_SLOTA]['value']
     slotB_value = request['intent']['slots'][NAME_SLOTB]['value']
-    print("compare_data slots: ", request['intent']['slots'])
+    log_debug("compare_data slots: %s", request['intent']['slots'])
     session = check_init_session(session)
     data = session['attributes'][DATA_KEY]
     if len(data) < 2:
@@ -433,39 +1277,33 @@ def compare_data(request, session, locale):
         return response(session['attributes'],
                         response_ask(speechmessage, speechreprompt))
 
+    ensure_profiles(session, [slotA_value, slotB_value])
+    data.touch([slotA_value, slotB_value])
     (high_trait, moderate_trait) = get_comparison(data, slotA_value,
                                                   slotB_value)
-    print("compare high: ", high_trait)
-    print("compare moderate: ", moderate_trait)
-    if len(high_trait) == 0 and len(moderate_trait) == 0:
-        speechmessage = resource['NO_MATCH_MESSAGE']
-    elif len(high_trait) != 0:
-        speechmessage = resource['MATCH_START_MESSAGE'].format(slotA_value,
-                                                               slotB_value)
-        speechmessage += resource['HIGH_MATCH_MESSAGE'].format(len(high_trait))
-        speechmessage += say_list(high_trait, locale)
-        if len(moderate_trait) != 0:
-            speechmessage += (resource['MOD_MATCH_MESSAGE']
-                              .format(len(moderate_trait)))
-            speechmessage += say_list(moderate_trait, locale)
+    log_debug("compare high: %s", high_trait)
+    log_debug("compare moderate: %s", moderate_trait)
+    sections = []
+    if len(high_trait) != 0:
+        sections.append((resource['HIGH_MATCH_MESSAGE'].format(
+            len(high_trait)), high_trait))
+    if len(moderate_trait) != 0:
+        sections.append((resource['MOD_MATCH_MESSAGE'].format(
+            len(moderate_trait)), moderate_trait))
+    if sections:
+        start = resource['MATCH_START_MESSAGE'].format(slotA_value,
+                                                       slotB_value)
+        sections[0] = (start + sections[0][0], sections[0][1])
+        pages = paginate(sections, locale, COMPARE_PAGE_TRAITS)
     else:
-        if len(moderate_trait) != 0:
-            speechmessage = resource['MATCH_START_MESSAGE'].format(slotA_value,
-                                                                   slotB_value)
-
-            speechmessage += (resource['MOD_MATCH_MESSAGE']
-                              .format(len(moderate_trait)))
-            speechmessage += say_list(moderate_trait, locale)
+        pages = [resource['NO_MATCH_MESSAGE']]
     # options to repeat, do another comparison, or add more data
-    speechmessage += resource['REPEAT_OPTION']
-    speechmessage += resource['LOAD_OPTION']
-    speechmessage += resource['LIST_OPTION'] + resource['OR']
-    speechmessage += resource['COMPARE_OPTION']
-    speechreprompt = resource['LLC_REPROMPT']
-    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
-    session['attributes'][REPROMPT_KEY] = speechreprompt
-    return response(session['attributes'],
-                    response_ask(speechmessage, speechreprompt))
+    options = resource['REPEAT_OPTION']
+    options += resource['LOAD_OPTION']
+    options += resource['LIST_OPTION'] + resource['OR']
+    options += resource['COMPARE_OPTION']
+    return say_pages(session, locale, pages, options,
+                     resource['LLC_REPROMPT'])
 
 
 def get_comparison(data, slotA, slotB):
@@ -483,101 +1321,1241 @@ def get_comparison(data, slotA, slotB):
     Returns:
         tuple of list of high matching traits and of moderate matching traits
     """
-    high_trait = []
-    moderate_trait = []
-    print("comparing", slotA, ", ", slotB, "with data: ", data)
-    for trait in TRAIT_LIST:
-        if (data[slotA][trait][0] == 0 and data[slotB][trait][0] == 0 or
-                data[slotA][trait][0] == 4 and data[slotB][trait][0] == 4):
-            high_trait.append(data[slotA][trait][1])
-        elif (data[slotA][trait][0] < 2 and data[slotB][trait][0] < 2 or
-                data[slotA][trait][0] > 2 and data[slotB][trait][0] > 2):
-            moderate_trait.append(data[slotA][trait][1])
+    log_debug("comparing %s, %s with data: %s", slotA, slotB, data)
+    if isinstance(data, TrackedData):
+        (high, moderate) = data.match(slotA, slotB)
+    else:
+        # packing costs more than it saves for one comparison
+        (high, moderate) = match_records(data[slotA], data[slotB])
+    record = data[slotA]
+    high_trait = [record[TRAIT_LIST[i]][1] for i in high]
+    moderate_trait = [record[TRAIT_LIST[i]][1] for i in moderate]
     return (high_trait, moderate_trait)
 
 
-def check_init_session(session):
-    if 'attributes' not in session:
-        session['attributes'] = {}
-    if DATA_KEY not in session['attributes']:
-        session['attributes'][DATA_KEY] = {}
-    return session
+def compare_group(request, session, locale):
+    """say the traits everyone in the group named in slot matches in"""
+    resource = getresource(locale)
+    slot = request['intent'].get('slots', {}).get(NAMES_SLOT, {})
+    log_debug("compare_group slots: %s", request['intent'].get('slots'))
+    session = check_init_session(session)
+    data = session['attributes'][DATA_KEY]
+    named = [name for name in data if name != 'untitled']
+    (names, unknown) = group_names(slot.get('value', ''), named)
+    everyone = not names and not unknown
+    if everyone:
+        # no names said means everyone
+        names = named
+    if unknown:
+        speechmessage = resource['NO_NAMED_MESSAGE'].format(unknown[0])
+        speechmessage += resource['GROUP_OPTION']
+        speechreprompt = resource['GROUP_OPTION']
+    elif len(names) < 2:
+        speechmessage = resource['MORE_DATA_MESSAGE']
+        speechmessage += resource['GROUP_OPTION']
+        speechreprompt = resource['GROUP_OPTION']
+    elif everyone:
+        (high_trait, moderate_trait) = get_common_comparison(session, names)
+        speechmessage = say_group(names, high_trait, moderate_trait, locale)
+        speechmessage += resource['REPEAT_OPTION']
+        speechmessage += resource['COMPARE_OPTION']
+        speechreprompt = resource['LLC_REPROMPT']
+    else:
+        ensure_profiles(session, names)
+        data.touch(names)
+        (high_trait, moderate_trait) = get_group_comparison(data, names)
+        log_debug("compare_group high: %s", high_trait)
+        log_debug("compare_group moderate: %s", moderate_trait)
+        speechmessage = say_group(names, high_trait, moderate_trait, locale)
+        speechmessage += resource['REPEAT_OPTION']
+        speechmessage += resource['COMPARE_OPTION']
+        speechreprompt = resource['LLC_REPROMPT']
+    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
+    session['attributes'][REPROMPT_KEY] = speechreprompt
+    return response(session['attributes'],
+                    response_ask(speechmessage, speechreprompt))
 
 
-def get_options_messages(session, locale):
+def group_names(value, names):
     """
-    Add messages outlining current options.  Contains a lot of the logic
-    might need to factor out logic for more flexibility
+    Find which of `names` were said in a slot value.
+
+    Names can be said in any order, separated by commas or "and", so each
+    known name is looked for as whole words, longest name first.
+
+    Returns:
+        tuple of list of names found, in the order said, and of the other
+        words said that aren't names
+    """
+    rest = value.lower()
+    found = []
+    for name in sorted(names, key=len, reverse=True):
+        match = re.search(r'\b' + re.escape(name.lower()) + r'\b', rest)
+        if match:
+            found.append((match.start(), name))
+            rest = (rest[:match.start()] + ' ' * len(name) +
+                    rest[match.end():])
+    unknown = [word for word in re.split(r'[\s,]+', rest)
+               if word and word not in GROUP_FILLER]
+    return ([name for (start, name) in sorted(found)], unknown)
+
+
+def get_group_comparison(data, names):
+    """
+    Compare data for a group of names
+
+    A trait is a high match if every score is 0 or every score is 4, and a
+    moderate match if every score is below 2 or every score is above 2, so
+    that every pair in the group matches at least that well.
 
     Args:
-        session: current session
-        locale: current locale
-        speechmessage: message stem function will add to
+        data: data as stored in DATA_KEY attribute
+        names: names of data to compare, assumed to be valid
 
     Returns:
-        tuple of (output message, reprompt message, need to use linkCard)
+        tuple of list of high matching traits and of moderate matching traits
     """
-    resource = getresource(locale)
-    session = check_init_session(session)
-    if session['attributes'][DATA_KEY] == {}:
-        output = resource['NO_DATA_MESSAGE']
-        output += resource['LOAD_OPTION']
-        reprompt = resource['NO_DATA_REPROMPT']
-        return (output, reprompt, False)
-    else:
-        dbdata = session['attributes'][DATA_KEY]
-        # check if nameless present
-        if 'untitled' in dbdata:
-            output = resource['NAMELESS_MESSAGE']
-            output += resource['GIVE_NAME_MESSAGE']
-            reprompt = resource['GIVE_NAME_MESSAGE']
-            return (output, reprompt, False)
-        # give count
-        output = resource['DATA_COUNT_MESSAGE'].format(len(dbdata))
-        if len(dbdata) >= 2:
-            output += resource['SELECT_MESSAGE']
-            reprompt = resource['SELECT_REPROMPT']
-            return (output, reprompt, False)
-        else:
-            output += resource['MORE_DATA_MESSAGE']
-            output += resource['GENOMELINK_MESSAGE']
-            reprompt = resource['GENOMELINK_REPROMPT']
-            return (output, reprompt, True)
+    (high, moderate) = group_matches(data, names)
+    record = data[names[0]]
+    high_trait = [record[TRAIT_LIST[i]][1] for i in high]
+    moderate_trait = [record[TRAIT_LIST[i]][1] for i in moderate]
+    return (high_trait, moderate_trait)
 
 
-def stop_response(session, locale):
-    """stop message response"""
+def get_common_comparison(session, names):
+    """
+    Compare every named profile, `names`, from the common summary
+
+    Only the first profile is read, for its phrases; in the profile
+    layout the rest stay unloaded.
+
+    Returns:
+        tuple of list of high matching traits and of moderate matching traits
+    """
+    (high, moderate) = summary_matches(common_summary(session, names))
+    ensure_profiles(session, names[:1])
+    record = session['attributes'][DATA_KEY][names[0]]
+    high_trait = [record[TRAIT_LIST[i]][1] for i in high]
+    moderate_trait = [record[TRAIT_LIST[i]][1] for i in moderate]
+    return (high_trait, moderate_trait)
+
+
+def say_group(names, high_trait, moderate_trait, locale):
+    """
+    Summarize a group comparison for speaking.
+
+    Large groups are counted instead of named, and each match class says
+    at most GROUP_SAY_TRAITS traits, so the speech stays well inside the
+    8000 characters Alexa allows however many profiles there are.
+    """
     resource = getresource(locale)
-    speechmessage = resource['STOP_MESSAGE']
-    return response(session['attributes'], response_tell(speechmessage))
+    if len(names) > GROUP_SAY_NAMES:
+        output = resource['GROUP_COUNT_MESSAGE'].format(len(names))
+    else:
+        output = resource['GROUP_START_MESSAGE'].format(
+            say_list(names, locale)[:-2])
+    if not high_trait and not moderate_trait:
+        return output + resource['GROUP_NO_MATCH_MESSAGE']
+    if high_trait:
+        output += resource['GROUP_HIGH_MESSAGE'].format(len(high_trait))
+        output += say_some(high_trait, locale, GROUP_SAY_TRAITS)
+    if moderate_trait:
+        output += resource['GROUP_MOD_MESSAGE'].format(len(moderate_trait))
+        output += say_some(moderate_trait, locale, GROUP_SAY_TRAITS)
+    return output
 
 
-def repeat_response(session):
-    """repeat last speechoutput"""
-    speechmessage = session['attributes'][SPEECHOUTPUT_KEY]
-    speechreprompt = session['attributes'][REPROMPT_KEY]
+def rank_data(request, session, locale):
+    """say which stored profiles match the one named in slot best"""
+    resource = getresource(locale)
+    slot_value = request['intent']['slots'][NAME_SLOT]['value']
+    log_debug("rank_data slots: %s", request['intent']['slots'])
+    session = check_init_session(session)
+    data = session['attributes'][DATA_KEY]
+    names = [name for name in data if name != 'untitled']
+    if len(names) < 2:
+        speechmessage = resource['MORE_DATA_MESSAGE']
+        speechreprompt = resource['LOAD_OPTION']
+    elif slot_value not in names:
+        speechmessage = resource['NO_NAMED_MESSAGE'].format(slot_value)
+        speechmessage += resource['RANK_OPTION']
+        speechreprompt = resource['RANK_OPTION']
+    else:
+        ensure_profiles(session, names)
+        data.touch([slot_value])
+        ranking = rank_matches(data, slot_value, RANK_TOP_K, names)
+        log_debug("rank_data ranking: %s", ranking)
+        speechmessage = resource['RANK_MESSAGE'].format(slot_value)
+        speechmessage += say_list([resource['RANK_ITEM'].format(*match)
+                                   for match in ranking], locale)
+        speechmessage += resource['REPEAT_OPTION']
+        speechmessage += resource['COMPARE_OPTION']
+        speechreprompt = resource['LLC_REPROMPT']
+    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
+    session['attributes'][REPROMPT_KEY] = speechreprompt
     return response(session['attributes'],
                     response_ask(speechmessage, speechreprompt))
 
 
-def help_response(session, locale):
-    """help response"""
+def opt_in(session, locale):
+    """let this user's named profiles be matched with other users"""
     resource = getresource(locale)
-    speechmessage = resource['HELP_MESSAGE']
-    speechreprompt = resource['HELP_REPROMPT']
+    session = check_init_session(session)
+    set_opt_in(get_store(), getuserId(session))
+    session['attributes'][OPT_IN_KEY] = True
+    names = [name for name in session['attributes'][DATA_KEY]
+             if name != 'untitled']
+    index_profiles(session, names)
+    speechmessage = resource['OPT_IN_MESSAGE']
+    speechmessage += resource['SIMILAR_OPTION']
+    speechreprompt = resource['SIMILAR_OPTION']
+    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
+    session['attributes'][REPROMPT_KEY] = speechreprompt
     return response(session['attributes'],
                     response_ask(speechmessage, speechreprompt))
 
 
-def on_session_ended(session):
-    """called on session end"""
-    userId = getuserId(session)
+def opt_out(session, locale):
+    """stop matching this user's profiles with other users"""
+    resource = getresource(locale)
     session = check_init_session(session)
-    print("on_session_ended data: ", session['attributes'][DATA_KEY])
-    put_dbdata(db_table, userId, session['attributes'][DATA_KEY])
+    clear_opt_in(get_store(), getuserId(session))
+    session['attributes'][OPT_IN_KEY] = False
+    unindex_profiles(session, list(session['attributes'][DATA_KEY]))
+    speechmessage = resource['OPT_OUT_MESSAGE']
+    (addmessage, speechreprompt,
+     useLink) = get_options_messages(session, locale)
+    speechmessage += addmessage
+    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
+    session['attributes'][REPROMPT_KEY] = speechreprompt
+    if useLink:
+        return response(session['attributes'],
+                        response_ask_link_card(speechmessage, speechreprompt))
+    else:
+        return response(session['attributes'],
+                        response_ask(speechmessage, speechreprompt))
 
 
-# --------------- request helpers -----------------
+def find_similar(request, session, locale):
+    """say how closely other users' profiles match the one named in slot"""
+    resource = getresource(locale)
+    slot_value = request['intent']['slots'][NAME_SLOT]['value']
+    session = check_init_session(session)
+    data = session['attributes'][DATA_KEY]
+    index = get_match_index()
+    if index is None:
+        speechmessage = resource['NO_INDEX_MESSAGE']
+        speechreprompt = resource['LLC_REPROMPT']
+    elif not is_opted_in(session):
+        speechmessage = resource['NEED_OPT_IN_MESSAGE']
+        speechreprompt = resource['NEED_OPT_IN_MESSAGE']
+    elif slot_value not in data or slot_value == 'untitled':
+        speechmessage = resource['NO_NAMED_MESSAGE'].format(slot_value)
+        speechmessage += resource['SIMILAR_OPTION']
+        speechreprompt = resource['SIMILAR_OPTION']
+    else:
+        ensure_profiles(session, [slot_value])
+        data.touch([slot_value])
+        own = member_id(getuserId(session), '')
+        matches = index.query(data[slot_value], 1, exclude_prefix=own)
+        log_debug("find_similar matches: %s", matches)
+        if matches:
+            speechmessage = resource['SIMILAR_MESSAGE'].format(
+                slot_value, matches[0][1], matches[0][2])
+        else:
+            speechmessage = resource['NO_SIMILAR_MESSAGE'].format(slot_value)
+        speechmessage += resource['REPEAT_OPTION']
+        speechreprompt = resource['LLC_REPROMPT']
+    session['attributes'][SPEECHOUTPUT_KEY] = speechmessage
+    session['attributes'][REPROMPT_KEY] = speechreprompt
+    return response(session['attributes'],
+                    response_ask(speechmessage, speechreprompt))
+
+
+# --------------- packed profiles -----------------
+# Scores are 0 to 4, so a profile packs into one int with SCORE_BITS bits
+# per trait, trait i of TRAIT_LIST at bits 3i to 3i+2.  A missing trait is
+# MISSING_CODE.  MATCH_TABLE gives the match class of every pair of codes,
+# so comparing two profiles is a shift, a mask and a lookup per trait.
+
+SCORE_BITS = 3
+SCORE_MASK = (1 << SCORE_BITS) - 1
+MISSING_CODE = SCORE_MASK
+NO_MATCH = 0
+MODERATE_MATCH = 1
+HIGH_MATCH = 2
+
+
+def match_class(a, b):
+    """
+    match class of scores `a` and `b`, None for a missing score
+
+    high if both are 0 or both are 4, moderate if both are below 2 or both
+    above 2 otherwise
+    """
+    if a is None or b is None:
+        return NO_MATCH
+    if a == b and a in (0, 4):
+        return HIGH_MATCH
+    if (a < 2 and b < 2) or (a > 2 and b > 2):
+        return MODERATE_MATCH
+    return NO_MATCH
+
+
+# indexed by code_a << SCORE_BITS | code_b
+MATCH_TABLE = tuple(
+    match_class(a if a < 5 else None, b if b < 5 else None)
+    for a in range(SCORE_MASK + 1) for b in range(SCORE_MASK + 1))
+TRAIT_SHIFTS = tuple((i, SCORE_BITS * i) for i in range(len(TRAIT_LIST)))
+
+
+def pack_profile(record):
+    """pack the trait scores of one record into an int"""
+    packed = 0
+    for i, trait in enumerate(TRAIT_LIST):
+        if trait in record:
+            code = int(record[trait][0])
+        else:
+            code = MISSING_CODE
+        packed |= code << (SCORE_BITS * i)
+    return packed
+
+
+def pack_scores(scores):
+    """pack a list of TRAIT_LIST scores, None where missing, into an int"""
+    packed = 0
+    for i, score in enumerate(scores):
+        packed |= (MISSING_CODE if score is None else score) << (
+            SCORE_BITS * i)
+    return packed
+
+
+def unpack_profile(packed):
+    """list of TRAIT_LIST scores in packed profile, None where missing"""
+    scores = []
+    for i in range(len(TRAIT_LIST)):
+        code = (packed >> (SCORE_BITS * i)) & SCORE_MASK
+        scores.append(None if code == MISSING_CODE else code)
+    return scores
+
+
+def match_packed(a, b):
+    """
+    Compare two packed profiles.
+
+    Returns:
+        tuple of lists of TRAIT_LIST indexes of high and of moderate matches
+    """
+    high = []
+    moderate = []
+    (table, mask, bits) = (MATCH_TABLE, SCORE_MASK, SCORE_BITS)
+    for i, shift in TRAIT_SHIFTS:
+        match = table[(a >> shift & mask) << bits | b >> shift & mask]
+        if match:
+            if match == HIGH_MATCH:
+                high.append(i)
+            else:
+                moderate.append(i)
+    return (high, moderate)
+
+
+def match_records(a, b):
+    """match_packed of two records that aren't packed"""
+    high = []
+    moderate = []
+    for i, trait in enumerate(TRAIT_LIST):
+        if trait in a and trait in b:
+            (score_a, score_b) = (a[trait][0], b[trait][0])
+            if score_a == score_b and score_a in (0, 4):
+                high.append(i)
+            elif ((score_a < 2 and score_b < 2) or
+                  (score_a > 2 and score_b > 2)):
+                moderate.append(i)
+    return (high, moderate)
+
+
+# --------------- vectorized matching -----------------
+# The same high and moderate rules as get_comparison, applied to a matrix
+# of scores with one row per profile and one column per TRAIT_LIST trait.
+# A trait missing from a partial download is MISSING_SCORE and never
+# matches.
+
+
+def score_matrix(data, names):
+    """
+    Build the scores of `names` into one N x len(TRAIT_LIST) array.
+
+    Args:
+        data: data as stored in DATA_KEY attribute
+        names: names in data, one per row
+
+    Returns:
+        numpy int8 array
+    """
+    import numpy
+    return numpy.array([[int(data[name][trait][0]) if trait in data[name]
+                         else MISSING_SCORE for trait in TRAIT_LIST]
+                        for name in names], dtype=numpy.int8).reshape(
+                            len(names), len(TRAIT_LIST))
+
+
+def match_classes(a, b):
+    """
+    Match score arrays `a` and `b`, broadcasting over leading axes.
+
+    Returns:
+        tuple of boolean arrays of high and of moderate matches
+    """
+    valid = (a >= 0) & (b >= 0)
+    high = valid & (((a == 0) & (b == 0)) | ((a == 4) & (b == 4)))
+    moderate = (valid & ~high &
+                (((a < 2) & (b < 2)) | ((a > 2) & (b > 2))))
+    return (high, moderate)
+
+
+def rank_matches(data, name, k=RANK_TOP_K, names=None):
+    """
+    Rank the other profiles by how well they match `name`.
+
+    Counts high and moderate matches against every other profile in one
+    pass and orders by high, then moderate count.  Falls back to
+    get_comparison for each profile when numpy isn't installed.
+
+    Args:
+        data: data as stored in DATA_KEY attribute
+        name: name of profile to match, assumed to be valid
+        k: number of matches to return
+        names: names to rank, default every name in data
+
+    Returns:
+        list of (name, high count, moderate count) for the best k
+    """
+    others = [other for other in (names or list(data)) if other != name]
+    try:
+        import numpy
+    except ImportError:
+        counts = []
+        for other in others:
+            (high, moderate) = get_comparison(data, name, other)
+            counts.append((other, len(high), len(moderate)))
+        counts.sort(key=lambda match: (-match[1], -match[2]))
+        return counts[:k]
+    if not others:
+        return []
+    scores = score_matrix(data, others)
+    (high, moderate) = match_classes(score_matrix(data, [name]), scores)
+    high_count = high.sum(axis=1)
+    moderate_count = moderate.sum(axis=1)
+    # lexsort sorts by last key first, ascending
+    order = numpy.lexsort((-moderate_count, -high_count))[:k]
+    return [(others[i], int(high_count[i]), int(moderate_count[i]))
+            for i in order]
+
+
+def rank_all_pairs(data, k=RANK_TOP_K, names=None):
+    """
+    Rank every pair of profiles by how well they match.
+
+    Args:
+        data: data as stored in DATA_KEY attribute
+        k: number of pairs to return
+        names: names to pair up, default every name in data
+
+    Returns:
+        list of (name, name, high count, moderate count) for the best k
+    """
+    import numpy
+    names = names or list(data)
+    if len(names) < 2:
+        return []
+    scores = score_matrix(data, names)
+    (high, moderate) = match_classes(scores[:, None, :], scores[None, :, :])
+    (rows, cols) = numpy.triu_indices(len(names), 1)
+    high_count = high.sum(axis=2)[rows, cols]
+    moderate_count = moderate.sum(axis=2)[rows, cols]
+    order = numpy.lexsort((-moderate_count, -high_count))[:k]
+    return [(names[rows[i]], names[cols[i]], int(high_count[i]),
+             int(moderate_count[i])) for i in order]
+
+
+def group_matches(data, names):
+    """
+    Match every profile of `names` at once, one column per trait.
+
+    Falls back to a loop over the traits when numpy isn't installed.
+
+    Args:
+        data: data as stored in DATA_KEY attribute
+        names: names of profiles in the group, assumed to be valid
+
+    Returns:
+        tuple of lists of TRAIT_LIST indexes of high and of moderate matches
+    """
+    try:
+        import numpy
+    except ImportError:
+        (high, moderate) = ([], [])
+        for (i, trait) in enumerate(TRAIT_LIST):
+            if any(trait not in data[name] for name in names):
+                continue
+            scores = set(int(data[name][trait][0]) for name in names)
+            if scores == {0} or scores == {4}:
+                high.append(i)
+            elif max(scores) < 2 or min(scores) > 2:
+                moderate.append(i)
+        return (high, moderate)
+    scores = score_matrix(data, names)
+    valid = (scores >= 0).all(axis=0)
+    high = valid & ((scores == 0).all(axis=0) | (scores == 4).all(axis=0))
+    moderate = (valid & ~high &
+                ((scores < 2).all(axis=0) | (scores > 2).all(axis=0)))
+    return ([int(i) for i in numpy.flatnonzero(high)],
+            [int(i) for i in numpy.flatnonzero(moderate)])
+
+
+# --------------- common summary -----------------
+# What all of a user's named profiles have in common only depends on the
+# lowest and highest score of each trait, so it is kept as two packed
+# profiles (see pack_scores) with a digest of the names they cover.
+# Naming a profile merges it in; when the names differ from the digest,
+# as after a delete, the summary is worked out again from the records.
+
+
+def names_digest(names):
+    """hash of a set of profile names"""
+    return hashlib.sha256(PAIR_SEP.join(sorted(names)).encode(
+        'utf-8')).hexdigest()[:16]
+
+
+def summarize(records, summary=None):
+    """
+    Merge `records` into a common summary, or start one.
+
+    A summary is a dict of 'low' and 'high', the lowest and highest score
+    of each trait packed by pack_scores, MISSING_CODE where any record
+    lacks the trait.
+    """
+    if summary is None:
+        lows = highs = [MISSING_CODE + 1] * len(TRAIT_LIST)
+        started = False
+    else:
+        lows = unpack_profile(summary['low'])
+        highs = unpack_profile(summary['high'])
+        started = True
+    for record in records:
+        scores = unpack_profile(pack_profile(record))
+        lows = [None if low is None or score is None else
+                (min(low, score) if started else score)
+                for low, score in zip(lows, scores)]
+        highs = [None if high is None or score is None else
+                 (max(high, score) if started else score)
+                 for high, score in zip(highs, scores)]
+        started = True
+    return {'low': pack_scores(lows), 'high': pack_scores(highs)}
+
+
+def summary_matches(summary):
+    """
+    match classes of everyone in a common summary, as group_matches
+
+    Returns:
+        tuple of lists of TRAIT_LIST indexes of high and of moderate matches
+    """
+    (high, moderate) = ([], [])
+    for i, (low, top) in enumerate(zip(unpack_profile(summary['low']),
+                                       unpack_profile(summary['high']))):
+        if low is None:
+            continue
+        if top == 0 or low == 4:
+            high.append(i)
+        elif top < 2 or low > 2:
+            moderate.append(i)
+    return (high, moderate)
+
+
+def session_common(session):
+    """COMMON_KEY summary of the session, read from storage once"""
+    attributes = session['attributes']
+    if COMMON_KEY not in attributes:
+        attributes[COMMON_KEY] = load_common(getuserId(session))
+    return attributes[COMMON_KEY]
+
+
+def common_summary(session, names):
+    """
+    Common summary of the named profiles `names`.
+
+    A lookup if the stored or session summary covers just those names;
+    otherwise they are loaded and summarized, and the summary is saved
+    at session end.
+    """
+    digest = names_digest(names)
+    summary = session_common(session)
+    if summary is None or summary['names'] != digest:
+        log_info("common summary out of date: %s names", len(names))
+        ensure_profiles(session, names)
+        data = session['attributes'][DATA_KEY]
+        summary = summarize(data[name] for name in names)
+        summary.update(names=digest, saved=False)
+        session['attributes'][COMMON_KEY] = summary
+    return summary
+
+
+def add_to_common(session, named, name):
+    """merge newly named `name` into the summary of profiles `named`"""
+    summary = session_common(session)
+    if summary is None or summary['names'] != names_digest(named):
+        return
+    record = session['attributes'][DATA_KEY][name]
+    summary = summarize([record], summary)
+    summary.update(names=names_digest(named + [name]), saved=False)
+    session['attributes'][COMMON_KEY] = summary
+
+
+# --------------- cross-user match index -----------------
+# Profiles of users who opted in, bucketed by packed profile: everyone in a
+# bucket has the same scores, so a query scores each distinct profile once.
+# Members are named by member_id, which doesn't reveal the userId.
+
+
+def member_id(userId, name):
+    """index member name for profile `name` of user"""
+    digest = hashlib.sha256(userId.encode('utf-8')).hexdigest()[:16]
+    return digest + '/' + name
+
+
+def index_profiles(session, names):
+    """add named profiles to the match index if the user opted in"""
+    index = get_match_index()
+    if index is None or not names or not is_opted_in(session):
+        return
+    ensure_profiles(session, names)
+    userId = getuserId(session)
+    data = session['attributes'][DATA_KEY]
+    for name in names:
+        if is_complete(data[name]):
+            index.add(member_id(userId, name), data[name])
+
+
+def unindex_profiles(session, names):
+    """
+    remove profiles of user from the loaded match index
+
+    Only this container's index; others drop them at the next rebuild.
+    """
+    index = get_match_index()
+    if index is None:
+        return
+    userId = getuserId(session)
+    for name in names:
+        index.remove(member_id(userId, name))
+
+
+def get_match_index():
+    """get MatchIndex loaded from GENOME_MATCH_INDEX, None if not set"""
+    global _match_index
+    path = os.environ.get(MATCH_INDEX_ENV, '')
+    if _match_index is None and path != '':
+        with _runtime_lock:
+            if _match_index is None:
+                _match_index = MatchIndex.load(path)
+    return _match_index
+
+
+class MatchIndex:
+    """
+    nearest-neighbour index of profiles over the get_comparison rules
+
+    Built offline by tools/build_match_index.py and loaded at runtime;
+    add() inserts new profiles as they are named.  A query ranks every
+    distinct profile by high, then moderate matches with one numpy take
+    per trait, so it stays in milliseconds for hundreds of thousands of
+    profiles.
+    """
+
+    # match weight, so that one score orders by high then moderate count
+    HIGH_WEIGHT = len(TRAIT_LIST) + 1
+    INITIAL_ROWS = 64
+
+    def __init__(self):
+        import numpy
+        # one row per trait, one column per distinct profile
+        self._codes = numpy.zeros((len(TRAIT_LIST), self.INITIAL_ROWS),
+                                  dtype=numpy.int8)
+        self._columns = {}      # packed profile: column of _codes
+        self._members = []      # member ids in each column
+        self._where = {}        # member id: column
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._where)
+
+    def add(self, member, record):
+        """insert `record` for `member`, moving it if already present"""
+        self.add_packed(member, pack_profile(record))
+
+    def add_packed(self, member, packed):
+        """insert packed profile for `member`"""
+        import numpy
+        with self._lock:
+            column = self._columns.get(packed)
+            if column is None:
+                column = len(self._members)
+                if column == self._codes.shape[1]:
+                    self._codes = numpy.concatenate(
+                        (self._codes, numpy.zeros_like(self._codes)), axis=1)
+                self._codes[:, column] = [
+                    MISSING_CODE if score is None else score
+                    for score in unpack_profile(packed)]
+                self._columns[packed] = column
+                self._members.append([])
+            old = self._where.get(member)
+            if old == column:
+                return
+            if old is not None:
+                self._members[old].remove(member)
+            self._members[column].append(member)
+            self._where[member] = column
+
+    def remove(self, member):
+        """take `member` out of the index, if present"""
+        with self._lock:
+            column = self._where.pop(member, None)
+            if column is not None:
+                self._members[column].remove(member)
+
+    def query(self, record, k=RANK_TOP_K, exclude_prefix=None):
+        """
+        Find the profiles that match `record` best.
+
+        Args:
+            record: profile to match
+            k: number of members to return
+            exclude_prefix: skip members starting with this, e.g. the
+                member_id(userId, '') of the user asking
+
+        Returns:
+            list of (member id, high count, moderate count), best first
+        """
+        import numpy
+        weights = (0, 1, self.HIGH_WEIGHT)
+        codes = unpack_profile(pack_profile(record))
+        # gain[i][code] is the weight of matching trait i against code
+        gain = numpy.array(
+            [[weights[MATCH_TABLE[(MISSING_CODE if a is None else a)
+                                  << SCORE_BITS | b]]
+              for b in range(SCORE_MASK + 1)] for a in codes],
+            dtype=numpy.int16)
+        with self._lock:
+            count = len(self._members)
+            if count == 0:
+                return []
+            scores = numpy.zeros(count, dtype=numpy.int16)
+            for i in range(len(TRAIT_LIST)):
+                scores += gain[i].take(self._codes[i, :count])
+            wanted = k
+            while True:
+                wanted = min(wanted, count)
+                top = numpy.argpartition(-scores, wanted - 1)[:wanted]
+                top = top[numpy.argsort(-scores[top], kind='stable')]
+                matches = [(member, int(scores[column]) // self.HIGH_WEIGHT,
+                            int(scores[column]) % self.HIGH_WEIGHT)
+                           for column in top
+                           for member in self._members[column]
+                           if not (exclude_prefix and
+                                   member.startswith(exclude_prefix))]
+                if len(matches) >= k or wanted == count:
+                    return matches[:k]
+                wanted *= 2
+
+    def save(self, path):
+        """write index to numpy .npz file `path`"""
+        import numpy
+        with self._lock:
+            count = len(self._members)
+            numpy.savez_compressed(path, codes=self._codes[:, :count],
+                                   members=numpy.array(
+                                       json.dumps(self._members)))
+
+    @classmethod
+    def load(cls, path):
+        """read index written by save"""
+        import numpy
+        index = cls()
+        with numpy.load(path) as saved:
+            codes = numpy.array(saved['codes'], dtype=numpy.int8)
+            index._members = json.loads(str(saved['members']))
+        count = len(index._members)
+        index._codes = numpy.zeros(
+            (len(TRAIT_LIST), max(count, cls.INITIAL_ROWS)),
+            dtype=numpy.int8)
+        index._codes[:, :count] = codes.reshape(len(TRAIT_LIST), count)
+        shifts = SCORE_BITS * numpy.arange(len(TRAIT_LIST), dtype=numpy.int64)
+        packed = (index._codes[:, :count].astype(numpy.int64) <<
+                  shifts[:, None]).sum(axis=0)
+        index._columns = dict(zip(packed.tolist(), range(count)))
+        index._where = {member: column
+                        for column, members in enumerate(index._members)
+                        for member in members}
+        log_info("loaded match index: %s %s", path, len(index))
+        return index
+
+
+# --------------- session data -----------------
+
+
+def pending_record(session):
+    """get downloaded but unnamed 'untitled' record, None if there is none"""
+    session = check_init_session(session)
+    ensure_profiles(session, ['untitled'])
+    return session['attributes'][DATA_KEY].get('untitled')
+
+
+def missing_traits(record):
+    """traits of TRAIT_LIST not yet in downloaded `record`"""
+    return [trait for trait in TRAIT_LIST if trait not in record]
+
+
+def is_complete(record):
+    """True if `record` has every trait; None is no record"""
+    return record is not None and not missing_traits(record)
+
+
+def check_init_session(session):
+    """make sure session has attributes with tracked DATA_KEY data"""
+    if 'attributes' not in session:
+        session['attributes'] = {}
+    if DATA_KEY not in session['attributes']:
+        session['attributes'][DATA_KEY] = {}
+    if CHANGES_KEY not in session['attributes']:
+        session['attributes'][CHANGES_KEY] = new_changes()
+    if PAIRS_KEY not in session['attributes']:
+        session['attributes'][PAIRS_KEY] = {}
+    if USED_KEY not in session['attributes']:
+        session['attributes'][USED_KEY] = {}
+    if not isinstance(session['attributes'][DATA_KEY], TrackedData):
+        session['attributes'][DATA_KEY] = TrackedData(
+            session['attributes'][DATA_KEY],
+            session['attributes'][CHANGES_KEY],
+            session['attributes'][PAIRS_KEY],
+            session['attributes'][USED_KEY])
+    return session
+
+
+def new_changes():
+    """empty change record for CHANGES_KEY"""
+    return {CHANGED: [], REMOVED: [], TOUCHED: []}
+
+
+class TrackedData(dict):
+    """
+    genome data dict that records which names were set or deleted
+
+    The change record is the CHANGES_KEY dict in session attributes, so it
+    is carried between turns with the rest of the session and
+    on_session_ended only has to write the names listed in it.
+
+    It also keeps the match_mask of each pair compared this session in
+    the PAIRS_KEY dict, so comparing a pair again is a lookup.  Setting
+    or deleting a name drops only the pairs with that name.
+
+    The USED_KEY dict has the epoch_day of each name set or used today,
+    which on_session_ended merges into the stored LAST_USED days for
+    evicting the least recently used.  Days of other names stay stored.
+    The approximate stored size of each record is kept as records are
+    set, for the budget.
+    """
+
+    def __init__(self, data, changes, pairs=None, used=None):
+        super().__init__(data)
+        self.changes = changes
+        self.changes.setdefault(TOUCHED, [])
+        self.pairs = pairs if pairs is not None else {}
+        self.used = used if used is not None else {}
+        self._packed = {}   # name: pack_profile of its record
+        self._sizes = {}    # name: profile_size of its record
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self._forget(name)
+        self.used[name] = epoch_day()
+        if name not in self.changes[CHANGED]:
+            self.changes[CHANGED].append(name)
+        for listed in (self.changes[REMOVED], self.changes[TOUCHED]):
+            if name in listed:
+                listed.remove(name)
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self._forget(name)
+        self.used.pop(name, None)
+        for listed in (self.changes[CHANGED], self.changes[TOUCHED]):
+            if name in listed:
+                listed.remove(name)
+        if name not in self.changes[REMOVED]:
+            self.changes[REMOVED].append(name)
+
+    def is_dirty(self):
+        """True if anything needs saving"""
+        return bool(self.changes[CHANGED] or self.changes[REMOVED] or
+                    self.changes[TOUCHED])
+
+    def touch(self, names):
+        """mark `names` used today, saved once a day for each name"""
+        today = epoch_day()
+        for name in names:
+            if self.used.get(name) != today:
+                self.used[name] = today
+                if name not in self.changes[CHANGED] + self.changes[TOUCHED]:
+                    self.changes[TOUCHED].append(name)
+
+    def size(self):
+        """approximate bytes of the item holding the loaded records"""
+        sizes = self._sizes
+        total = ITEM_OVERHEAD
+        for name, record in self.items():
+            if record is not None:
+                if name not in sizes:
+                    sizes[name] = profile_size(name, record)
+                total += sizes[name]
+        return total
+
+    def load(self, name, value):
+        """set data read from storage, which needs no saving"""
+        super().__setitem__(name, value)
+        self._packed.pop(name, None)
+        self._sizes.pop(name, None)
+
+    def packed(self, name):
+        """pack_profile of the record for `name`, packed once"""
+        if name not in self._packed:
+            self._packed[name] = pack_profile(self[name])
+        return self._packed[name]
+
+    def match(self, nameA, nameB):
+        """match_packed of two names, from the pair cache if compared"""
+        key = pair_key(nameA, nameB)
+        if key not in self.pairs:
+            self.pairs[key] = match_mask(*match_packed(self.packed(nameA),
+                                                       self.packed(nameB)))
+        return unpack_mask(self.pairs[key])
+
+    def _forget(self, name):
+        """drop what was derived from the old record for `name`"""
+        self._packed.pop(name, None)
+        self._sizes.pop(name, None)
+        for key in [key for key in self.pairs if name in key.split(PAIR_SEP)]:
+            del self.pairs[key]
+
+    def missing(self, names):
+        """names present but not loaded yet (profile layout)"""
+        return [name for name in names
+                if name in self and self[name] is None]
+
+
+def pair_key(nameA, nameB):
+    """PAIRS_KEY key for a pair of names, in either order"""
+    return PAIR_SEP.join(sorted((nameA, nameB)))
+
+
+def match_mask(high, moderate):
+    """pack TRAIT_LIST indexes of high and moderate matches into an int"""
+    mask = 0
+    for i in high:
+        mask |= 1 << i
+    for i in moderate:
+        mask |= 1 << (len(TRAIT_LIST) + i)
+    return mask
+
+
+def unpack_mask(mask):
+    """tuple of lists of high and moderate indexes packed by match_mask"""
+    count = len(TRAIT_LIST)
+    return ([i for i in range(count) if mask >> i & 1],
+            [i for i in range(count) if mask >> (count + i) & 1])
+
+
+@traced
+def get_options_messages(session, locale):
+    """
+    Add messages outlining current options.  Contains a lot of the logic
+    might need to factor out logic for more flexibility
+
+    Args:
+        session: current session
+        locale: current locale
+        speechmessage: message stem function will add to
+
+    Returns:
+        tuple of (output message, reprompt message, need to use linkCard)
+    """
+    resource = getresource(locale)
+    session = check_init_session(session)
+    if session['attributes'][DATA_KEY] == {}:
+        output = resource['NO_DATA_MESSAGE']
+        output += resource['LOAD_OPTION']
+        reprompt = resource['NO_DATA_REPROMPT']
+        return (output, reprompt, False)
+    else:
+        dbdata = session['attributes'][DATA_KEY]
+        # check if nameless present
+        record = pending_record(session)
+        if record is not None and not is_complete(record):
+            output = resource['INCOMPLETE_MESSAGE'].format(
+                len(missing_traits(record)))
+            output += resource['RESUME_OPTION']
+            reprompt = resource['RESUME_OPTION']
+            return (output, reprompt, False)
+        if record is not None:
+            output = resource['NAMELESS_MESSAGE']
+            output += resource['GIVE_NAME_MESSAGE']
+            reprompt = resource['GIVE_NAME_MESSAGE']
+            return (output, reprompt, False)
+        # give count
+        output = resource['DATA_COUNT_MESSAGE'].format(len(dbdata))
+        if len(dbdata) >= 2:
+            output += resource['SELECT_MESSAGE']
+            reprompt = resource['SELECT_REPROMPT']
+            return (output, reprompt, False)
+        else:
+            output += resource['MORE_DATA_MESSAGE']
+            output += resource['GENOMELINK_MESSAGE']
+            reprompt = resource['GENOMELINK_REPROMPT']
+            return (output, reprompt, True)
+
+
+def stop_response(session, locale):
+    """stop message response"""
+    resource = getresource(locale)
+    speechmessage = resource['STOP_MESSAGE']
+    return response(session['attributes'], response_tell(speechmessage))
+
+
+def repeat_response(session):
+    """repeat last speechoutput"""
+    speechmessage = session['attributes'][SPEECHOUTPUT_KEY]
+    speechreprompt = session['attributes'][REPROMPT_KEY]
+    return response(session['attributes'],
+                    response_ask(speechmessage, speechreprompt))
+
+
+def help_response(session, locale):
+    """help response"""
+    resource = getresource(locale)
+    speechmessage = resource['HELP_MESSAGE']
+    speechreprompt = resource['HELP_REPROMPT']
+    return response(session['attributes'],
+                    response_ask(speechmessage, speechreprompt))
+
+
+def on_session_ended(session):
+    """called on session end"""
+    userId = getuserId(session)
+    session = check_init_session(session)
+    summary = session['attributes'].get(COMMON_KEY)
+    if summary and not summary['saved']:
+        save_common(userId, summary)
+    data = session['attributes'][DATA_KEY]
+    if not data.is_dirty():
+        log_info("on_session_ended: no changes to save")
+        return
+    log_debug("on_session_ended changes: %s", data.changes)
+    save_dbdata(userId, data)
+    if ('untitled' in data.changes[CHANGED] and
+            session['attributes'].get(TOKEN_KEY)):
+        save_token(userId, session['attributes'][TOKEN_KEY])
+
+
+# --------------- storage budget -----------------
+# Sizes follow DynamoDB's item size rules closely enough to stay under
+# the 400 KB limit with GENOME_MAX_ITEM_BYTES: strings count their UTF-8
+# bytes, numbers about one byte per two digits, and maps and lists three
+# bytes plus one per element.
+
+
+def epoch_day():
+    """days since the epoch, the resolution of USED_KEY"""
+    return int(time.time() // DAY_SECONDS)
+
+
+def item_size(value):
+    """approximate bytes DynamoDB counts for an attribute value"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, dict):
+        return 3 + sum(1 + len(key.encode('utf-8')) + item_size(each)
+                       for key, each in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(1 + item_size(each) for each in value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    return 1 + (len(str(value)) + 1) // 2
+
+
+def profile_size(name, record):
+    """approximate bytes of `record` and its LAST_USED day in the item"""
+    name_bytes = len(name.encode('utf-8'))
+    return 1 + name_bytes + item_size(record) + 5 + name_bytes
+
+
+def enforce_budget(data, keep, id):
+    """
+    Evict least recently used named profiles until data fits the caps.
+
+    GENOME_MAX_PROFILES caps the named profiles, and in the item layout
+    GENOME_MAX_ITEM_BYTES caps the size of the item.  `keep` and the
+    'untitled' download are never evicted.  The stored days of user `id`
+    are only read when something has to go.
+
+    Returns:
+    evicted names, least recently used first
+    """
+    max_profiles = int(os.environ.get(MAX_PROFILES_ENV,
+                                      DEFAULT_MAX_PROFILES))
+    max_bytes = 0
+    if not use_profile_layout():
+        max_bytes = int(os.environ.get(MAX_ITEM_BYTES_ENV,
+                                       DEFAULT_MAX_ITEM_BYTES))
+
+    def fits(count):
+        return ((not max_profiles or count <= max_profiles) and
+                (not max_bytes or data.size() <= max_bytes))
+
+    names = [name for name in data if name != keep and name != 'untitled']
+    count = len(names) + (keep in data)
+    if fits(count):
+        return []
+    used = load_used(id)
+    used.update(data.used)
+    names.sort(key=lambda name: (used.get(name, 0), name))
+    evicted = []
+    for name in names:
+        if fits(count):
+            break
+        del data[name]
+        count -= 1
+        evicted.append(name)
+    if evicted:
+        log_info("evicted profiles: %s", evicted)
+    return evicted
+
+
+def expire_untitled(data, used):
+    """
+    delete an 'untitled' download not named in GENOME_UNTITLED_TTL days
+
+    `used` has the stored days of the loaded data.
+    """
+    if 'untitled' not in data:
+        return
+    ttl = int(os.environ.get(UNTITLED_TTL_ENV, DEFAULT_UNTITLED_TTL))
+    if not used.get('untitled'):
+        # stored before downloads were dated, so its time starts now
+        data.touch(['untitled'])
+    elif ttl and used['untitled'] + ttl <= epoch_day():
+        log_info("expired untitled download of day %s", used['untitled'])
+        del data['untitled']
+
+
+# --------------- logging -----------------
+# Log lines are JSON with the level, the function logging and the
+# message.  Values are only turned into text when their level is enabled,
+# by a reprlib.Repr bounded in depth and length, so logging a session
+# costs the same however much data it holds.
+
+
+class JsonFormatter(logging.Formatter):
+    """one JSON object per log record"""
+
+    def format(self, record):
+        return json.dumps({'level': record.levelname,
+                           'function': record.funcName,
+                           'message': record.getMessage()})
+
+
+class StdoutHandler(logging.StreamHandler):
+    """StreamHandler writing to whatever sys.stdout is when it emits"""
+
+    def emit(self, record):
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+class LogField:
+    """a logged value, made into text of bounded size only if logged"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        get_logger()    # sets _log_repr and _log_field_limit
+        if isinstance(self.value, str):
+            text = self.value
+        else:
+            text = _log_repr.repr(self.value)
+        if len(text) > _log_field_limit:
+            return text[:_log_field_limit] + '...'
+        return text
+
+
+def get_logger():
+    """get the module logger, configured from the environment"""
+    global _logger, _log_field_limit, _log_repr
+    if _logger is None:
+        logger = logging.getLogger(LOGGER_NAME)
+        handler = StdoutHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+        name = os.environ.get(LOG_LEVEL_ENV, DEFAULT_LOG_LEVEL).upper()
+        level = logging.getLevelName(name)
+        known = isinstance(level, int)
+        if not known:
+            level = logging.getLevelName(DEFAULT_LOG_LEVEL)
+        logger.setLevel(level)
+        _log_field_limit = int(os.environ.get(LOG_FIELD_LIMIT_ENV,
+                                              DEFAULT_LOG_FIELD_LIMIT))
+        _log_repr = reprlib.Repr()
+        _log_repr.maxlevel = 3
+        _log_repr.maxdict = _log_repr.maxlist = 12
+        _log_repr.maxstring = _log_repr.maxother = _log_field_limit
+        _logger = logger
+        if not known:
+            log_warning("unknown %s %s, logging at %s", LOG_LEVEL_ENV, name,
+                        DEFAULT_LOG_LEVEL)
+    return _logger
+
+
+def log(level, message, *fields):
+    """log `message` % `fields` at `level`, if that level is enabled"""
+    logger = get_logger()
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *[LogField(field) for field in fields],
+                   stacklevel=3)
+
+
+def log_debug(message, *fields):
+    """log at DEBUG, for payloads like sessions and data"""
+    log(logging.DEBUG, message, *fields)
+
+
+def log_info(message, *fields):
+    """log at INFO, for what was done"""
+    log(logging.INFO, message, *fields)
+
+
+def log_warning(message, *fields):
+    """log at WARNING, for failures the skill recovers from"""
+    log(logging.WARNING, message, *fields)
+
+
+def log_error(message, *fields):
+    """log at ERROR, for failed storage calls and bad requests"""
+    log(logging.ERROR, message, *fields)
+
+
+# --------------- request helpers -----------------
 
 
 def getresource(locale):
@@ -590,18 +2568,50 @@ def getlocale(request):
     locale = request['locale']
     if locale == "":
         locale = 'en-US'
-    print("locale: ", locale)
+    log_debug("locale: %s", locale)
     return locale
 
 
 def getuserId(session):
     """get userId from session"""
     userId = session['user']['userId']
-    print("userId: ", userId)
+    log_debug("userId: %s", userId)
     return userId
 
 
-def clean_phrase(trait, phrase):
+# --------------- phrase rules -----------------
+# clean_phrase turns a GenomeLink summary into a verb phrase by applying
+# PHRASE_RULES in order.  Each rule is (traits, pattern, replacement),
+# with traits None for every trait, and replaces at most one match.  The
+# prefix patterns are capitalized and their replacements aren't, so at
+# most one of them applies to a summary.  A locale can add rules, applied
+# after these, as 'PHRASE_RULES' in its translation or in the JSON file
+# named by GENOME_PHRASE_RULES, {locale: [[traits, pattern, replacement]]}.
+# {trait} in a replacement is the trait name as words.
+
+SIZE_TRAITS = ('bmi', 'body-fat-mass', 'breast-size', 'mathematical-ability',
+               'hippocampal-volume', 'reading-and-spelling-ability')
+PHRASE_RULES = [
+    (SIZE_TRAITS, r'^(.*)$', r'tend to have a \g<1>{trait}'),
+    (('openness',), r'^(?!.*not to be).*$', 'tend to be open to experience. '),
+    (('openness',), r'^.*not to be.*$', 'tend not to be open to experience. '),
+    (None, r', slightly$', ''),
+    (None, r'^Weak', 'have low'),
+    (None, r'^Does not show', 'have low'),
+    (None, r'^Somewhat prone', 'are somewhat prone'),
+    (None, r'^Not easily', 'are not easily'),
+    (None, r'^Easily', 'are easily'),
+    (None, r'^Stronger tendency', 'have a strong tendency'),
+    (None, r'^Slight tendency', 'have a tendency'),
+    (None, r'^Strong', 'have high'),
+]
+PHRASE_RULES_ENV = 'GENOME_PHRASE_RULES'
+PHRASE_CACHE_SIZE = 1024    # (trait, summary, locale) phrases remembered
+
+_phrase_rules = {}      # locale: compiled rules
+
+
+def clean_phrase(trait, phrase, locale='en-US'):
     """
     clean phrase
 
@@ -609,26 +2619,41 @@ def clean_phrase(trait, phrase):
     note that some traits included for the future
     no cleaning of 'Intermediate' values (2), since never used currently
     """
-    if (trait == 'bmi' or trait == 'body-fat-mass' or trait == 'breast-size'
-       or trait == 'mathematical-ability' or trait == 'hippocampal-volume'
-       or trait == 'reading-and-spelling-ability'):
-        phrase = 'tend to have a ' + phrase + trait.replace('-', ' ')
-    if trait == 'openness':
-        if phrase.find('not to be'):
-            phrase = 'tend not to be open to experience. '
-        else:
-            phrase = 'tend to be open to experience. '
-    phrase = re.sub(r', slightly$', '', phrase)
-    phrase = re.sub(r'^Weak', 'have low', phrase)
-    phrase = re.sub(r'^Does not show', 'have low', phrase)
-    phrase = re.sub(r'^Somewhat prone', 'are somewhat prone', phrase)
-    phrase = re.sub(r'^Not easily', 'are not easily', phrase)
-    phrase = re.sub(r'^Easily', 'are easily', phrase)
-    phrase = re.sub(r'^Stronger tendency', 'have a strong tendency', phrase)
-    phrase = re.sub(r'^Slight tendency', 'have a tendency', phrase)
-    phrase = re.sub(r'^Strong', 'have high', phrase)
-    phrase = re.sub(r'^Does not show', 'Have low', phrase)
-    return "They " + phrase
+    return "They " + rewrite_phrase(trait, phrase, locale)
+
+
+@lru_cache(maxsize=PHRASE_CACHE_SIZE)
+def rewrite_phrase(trait, phrase, locale):
+    """apply the phrase rules of `locale` for `trait` to `phrase`"""
+    for (traits, pattern, replacement) in get_phrase_rules(locale):
+        if traits is None or trait in traits:
+            phrase = pattern.sub(
+                replacement.replace('{trait}', trait.replace('-', ' ')),
+                phrase, count=1)
+    return phrase
+
+
+def get_phrase_rules(locale):
+    """PHRASE_RULES and the extra rules of `locale`, compiled"""
+    if locale not in _phrase_rules:
+        extra = (languageSupport.get(locale, {}).get('translation', {})
+                 .get('PHRASE_RULES', []))
+        path = os.environ.get(PHRASE_RULES_ENV)
+        if path:
+            with open(path) as rules_file:
+                extra = extra + json.load(rules_file).get(locale, [])
+        _phrase_rules[locale] = [
+            (traits, re.compile(pattern), replacement)
+            for (traits, pattern, replacement) in PHRASE_RULES + extra]
+    return _phrase_rules[locale]
+
+
+def add_phrase_rules(locale, rules):
+    """add (traits, pattern, replacement) rules for `locale`"""
+    compiled = [(traits, re.compile(pattern), replacement)
+                for (traits, pattern, replacement) in rules]
+    _phrase_rules[locale] = get_phrase_rules(locale) + compiled
+    rewrite_phrase.cache_clear()
 
 
 def get_accessToken(session):
@@ -647,10 +2672,26 @@ def get_accessToken(session):
         if 'testUser' in session['attributes']:
             accessToken = ('GENOMELINKTEST00' +
                            str(session['attributes']['testUser']))
-    print("DEBUG in get_accessToken: ", accessToken[0:PRINT_LIMIT])
+    log_debug("in get_accessToken: %s", accessToken[0:PRINT_LIMIT])
     return accessToken
 
 
+def token_digest(token):
+    """hash of an accessToken, to store and compare instead of the token"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def pending_token(session):
+    """
+    token_digest of the account the 'untitled' record came from
+
+    Read from storage once per session; None if it was never saved.
+    """
+    if TOKEN_KEY not in session['attributes']:
+        session['attributes'][TOKEN_KEY] = load_token(getuserId(session))
+    return session['attributes'][TOKEN_KEY]
+
+
 def fetch_accessToken(session):
     """get accessToken from Internet
 
@@ -662,10 +2703,10 @@ def fetch_accessToken(session):
         accessToken = ('GENOMELINKTEST00' +
                        str(session['attributes']['testUser']))
     else:
-        print("ERROR: tried to fetch_accessToken with no testUser attribute")
+        log_error("tried to fetch_accessToken with no testUser attribute")
         # make a default
         accessToken = 'GENOMELINKTEST001'
-    print("DEBUG in fetch_accessToken: ", accessToken[0:PRINT_LIMIT])
+    log_debug("in fetch_accessToken: %s", accessToken[0:PRINT_LIMIT])
     return accessToken
 
 
@@ -678,70 +2719,821 @@ def clearaccessToken(session):
     if 'testUser' in session['attributes']:
         if session['attributes']['testUser'] < 9:
             session['attributes']['testUser'] += 1
-        print("DEBUG testing inc testUser:", session['attributes']['testUser'])
+        log_debug("testing inc testUser: %s",
+                  session['attributes']['testUser'])
     return session
 
 
+def is_opted_in(session):
+    """True if user agreed to cross-user matching; read once per session"""
+    if OPT_IN_KEY not in session['attributes']:
+        session['attributes'][OPT_IN_KEY] = get_opt_in(get_store(),
+                                                       getuserId(session))
+    return session['attributes'][OPT_IN_KEY]
+
+
 def getapiAccessToken(context):
     """get apiAccessToken from context"""
     if 'apiAccessToken' in context['System']:
         apiAccessToken = context['System']['apiAccessToken']
     else:
         apiAccessToken = ""
-    print("apiAccessToken: ", apiAccessToken[0:PRINT_LIMIT])
+    log_debug("apiAccessToken: %s", apiAccessToken[0:PRINT_LIMIT])
     return apiAccessToken
 
 
-def get_dbdata(table, id):
+def getapiEndpoint(context):
+    """get apiEndpoint from context"""
+    return context['System'].get('apiEndpoint', '')
+
+
+def get_dynamodb():
+    """
+    get DynamoDB resource, creating the client on first use
+
+    boto3 is imported here so requests that never touch the database
+    don't pay for it on a cold start.  Configured from the environment:
+    GENOME_DB_REGION and GENOME_DB_ENDPOINT
+    """
+    global _dynamodb
+    if _dynamodb is None:
+        import boto3
+        options = {'region_name': os.environ.get(DB_REGION_ENV,
+                                                 DEFAULT_DB_REGION)}
+        endpoint = os.environ.get(DB_ENDPOINT_ENV, '')
+        if endpoint != '':
+            options['endpoint_url'] = endpoint
+        _dynamodb = boto3.resource('dynamodb', **options)
+    return _dynamodb
+
+
+def get_db_table():
+    """get table keyed on userId, name from GENOME_DB_TABLE"""
+    global _db_table
+    if _db_table is None:
+        _db_table = get_dynamodb().Table(os.environ.get(DB_TABLE_ENV,
+                                                        DEFAULT_DB_TABLE))
+    return _db_table
+
+
+def get_profile_table():
+    """
+    get table keyed on userId and profile, name from
+    GENOME_DB_PROFILE_TABLE
+    """
+    global _profile_table
+    if _profile_table is None:
+        _profile_table = get_dynamodb().Table(
+            os.environ.get(DB_PROFILE_TABLE_ENV, DEFAULT_DB_PROFILE_TABLE))
+    return _profile_table
+
+
+def get_store():
     """
-    Fetch data for user.
+    get storage engine for userId items, made on first use
+
+    Configured from the environment: GENOME_DB_ENGINE, GENOME_DB_PATH,
+    GENOME_DB_CACHE_SIZE and GENOME_DB_CACHE_TTL
+    """
+    global _store
+    if _store is None:
+        engine = os.environ.get(DB_ENGINE_ENV, ENGINE_DYNAMODB)
+        if engine == ENGINE_SQLITE:
+            store = SqliteStore(os.environ.get(DB_PATH_ENV, DEFAULT_DB_PATH))
+        elif engine == ENGINE_MEMORY:
+            store = MemoryStore()
+        else:
+            store = DynamoStore()
+        size = int(os.environ.get(DB_CACHE_SIZE_ENV, DEFAULT_DB_CACHE_SIZE))
+        if size > 0 and engine != ENGINE_MEMORY:
+            store = MemoryStore(store, size, int(os.environ.get(
+                DB_CACHE_TTL_ENV, DEFAULT_DB_CACHE_TTL)))
+        _store = store
+    return _store
+
+
+def use_profile_layout():
+    """True if GENOME_DB_LAYOUT selects one item per profile"""
+    return os.environ.get(DB_LAYOUT_ENV, LAYOUT_ITEM) == LAYOUT_PROFILE
+
+
+def load_dbdata(id):
+    """
+    Load data for user in the configured layout.
+
+    With the profile layout only the names are read; each maps to None
+    until ensure_profiles loads it.
+
+    Returns:
+    tuple of data, None if there is none, and dict of name: epoch_day
+    last used
+    """
+    if not use_profile_layout():
+        item = get_dbdata(get_store(), id)
+        return (item.get(DATA), {name: int(day) for name, day
+                                 in item.get(LAST_USED, {}).items()})
+    used = get_profile_names(get_profile_table(), id)
+    if not used:
+        used = migrate_dbdata(id)
+    if not used:
+        return (None, {})
+    return ({name: None for name in used}, used)
+
+
+def load_used(id):
+    """dict of name: stored epoch_day last used for user"""
+    if use_profile_layout():
+        return get_profile_names(get_profile_table(), id)
+    item = get_store().get(id, [LAST_USED])
+    return {name: int(day) for name, day in item.get(LAST_USED, {}).items()}
+
+
+@traced
+def load_token(id):
+    """TOKEN of user's stored 'untitled' record, or None"""
+    from botocore.exceptions import ClientError
+    if not use_profile_layout():
+        return get_store().get(id, [TOKEN]).get(TOKEN)
+    try:
+        response = get_profile_table().get_item(
+            Key={USERID: id, PROFILE: 'untitled'},
+            ProjectionExpression='#k', ExpressionAttributeNames={'#k': TOKEN})
+    except ClientError as e:
+        log_error("%s", e.response['Error']['Message'])
+        return None
+    return response.get('Item', {}).get(TOKEN)
+
+
+@traced
+def save_token(id, digest):
+    """
+    Save TOKEN of user's 'untitled' record after it is saved.
+
+    In the item layout it is a top-level attribute, left until the next
+    download replaces it; in the profile layout it is on the 'untitled'
+    item and goes with it.
+    """
+    from botocore.exceptions import ClientError
+    if not use_profile_layout():
+        return get_store().set_attribute(id, TOKEN, digest)
+    try:
+        get_profile_table().update_item(
+            Key={USERID: id, PROFILE: 'untitled'},
+            UpdateExpression='SET #k = :k',
+            ConditionExpression='attribute_exists(#d)',
+            ExpressionAttributeNames={'#k': TOKEN, '#d': DATA},
+            ExpressionAttributeValues={':k': digest})
+    except ClientError as e:
+        log_error("%s", e.response['Error']['Message'])
+        return False
+    return True
+
+
+def save_dbdata(id, data):
+    """Save changes in TrackedData `data` for user in configured layout"""
+    if use_profile_layout():
+        return put_profiles(get_profile_table(), id, data)
+    return update_dbdata(get_store(), id, data)
+
+
+def ensure_profiles(session, names):
+    """load data for `names` not yet read from the profile table"""
+    data = session['attributes'][DATA_KEY]
+    missing = data.missing(names)
+    if missing:
+        for name, value in get_profiles(get_profile_table(),
+                                        getuserId(session), missing).items():
+            data.load(name, value)
+
+
+@traced
+def get_profile_names(table, id):
+    """
+    Fetch just the profile names for user from the profile table, with
+    the day each was last used.
 
     Args:
-    table -- dynamodb table
+    table -- dynamodb table keyed on userId and profile
     id -- userId to fetch
+
+    Returns:
+    dict of name: epoch_day last used, 0 if never recorded
     """
+    from botocore.exceptions import ClientError
+    options = {
+        'KeyConditionExpression': '#u = :u',
+        'ProjectionExpression': '#p, #l',
+        'ExpressionAttributeNames': {'#u': USERID, '#p': PROFILE,
+                                     '#l': LAST_USED},
+        'ExpressionAttributeValues': {':u': id}
+    }
+    names = {}
     try:
-        response = table.get_item(
-            Key={
-                'userId': id
-            }
-        )
+        while True:
+            response = table.query(**options)
+            names.update((item[PROFILE], int(item.get(LAST_USED, 0)))
+                         for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            options['ExclusiveStartKey'] = response['LastEvaluatedKey']
     except ClientError as e:
-        print(e.response['Error']['Message'])
-        item = {}
-    else:
-        if 'Item' in response:
-            item = response['Item']
-            print("GetItem succeeded:", json.dumps(item, indent=4))
-        else:
-            item = {}
-    return item
+        log_error("%s", e.response['Error']['Message'])
+    return names
 
 
-def put_dbdata(table, id, data):
+@traced
+def get_profiles(table, id, names):
     """
-    Save data for user.
+    Fetch data of the named profiles for user with BatchGetItem.
 
     Args:
-    table -- dynamodb table
-    id -- userId to save to
+    table -- dynamodb table keyed on userId and profile
+    id -- userId to fetch
+    names -- profile names to fetch
 
     Returns:
-    response
+    dict of name: data for the profiles found
     """
+    from botocore.exceptions import ClientError
+    profiles = {}
+    for start in range(0, len(names), BATCH_GET_LIMIT):
+        request = {table.name: {
+            'Keys': [{USERID: id, PROFILE: name}
+                     for name in names[start:start + BATCH_GET_LIMIT]],
+            'ProjectionExpression': '#p, #d',
+            'ExpressionAttributeNames': {'#p': PROFILE, '#d': DATA}
+        }}
+        try:
+            while request:
+                response = get_dynamodb().batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(table.name, []):
+                    profiles[item[PROFILE]] = item[DATA]
+                request = response.get('UnprocessedKeys')
+        except ClientError as e:
+            log_error("%s", e.response['Error']['Message'])
+    log_debug("BatchGetItem got: %s", list(profiles))
+    return profiles
+
+
+@traced
+def put_profiles(table, id, data):
+    """
+    Save changed profiles of TrackedData `data` for user, one item each.
+
+    Args:
+    table -- dynamodb table keyed on userId and profile
+    id -- userId to save to
+    data -- TrackedData for user
+    """
+    from botocore.exceptions import ClientError
+    # names touched without being loaded only need their day saved
+    names = data.changes[CHANGED] + [name for name in data.changes[TOUCHED]
+                                     if data.get(name) is not None]
+    days = [name for name in data.changes[TOUCHED]
+            if data.get(name) is None]
     try:
-        response = table.put_item(
-            Item={
-                USERID: id,
-                DATA: data
-            }
-        )
+        with table.batch_writer() as batch:
+            for name in names:
+                item = {USERID: id, PROFILE: name, DATA: data[name],
+                        LAST_USED: data.used.get(name, epoch_day())}
+                if name == 'untitled' and untitled_expires(item[LAST_USED]):
+                    item[EXPIRES] = untitled_expires(item[LAST_USED])
+                batch.put_item(Item=item)
+            for name in data.changes[REMOVED]:
+                batch.delete_item(Key={USERID: id, PROFILE: name})
     except ClientError as e:
-        print(e.response['Error']['Message'])
-        return response
+        log_error("%s", e.response['Error']['Message'])
     else:
-        print("PutItem succeeded:" + id[0:PRINT_LIMIT])
-        return response
+        log_info("BatchWriteItem succeeded: %s", id[0:PRINT_LIMIT])
+    for name in days:
+        put_profile_day(table, id, name, data.used.get(name, epoch_day()))
+
+
+@traced
+def put_profile_day(table, id, name, day):
+    """set the LAST_USED day of a stored profile with UpdateItem"""
+    from botocore.exceptions import ClientError
+    options = {
+        'Key': {USERID: id, PROFILE: name},
+        'UpdateExpression': 'SET #l = :l',
+        'ExpressionAttributeNames': {'#l': LAST_USED, '#d': DATA},
+        'ExpressionAttributeValues': {':l': day},
+        # not for a profile deleted since it was listed
+        'ConditionExpression': 'attribute_exists(#d)'
+    }
+    if name == 'untitled' and untitled_expires(day):
+        options['UpdateExpression'] += ', #e = :e'
+        options['ExpressionAttributeNames']['#e'] = EXPIRES
+        options['ExpressionAttributeValues'][':e'] = untitled_expires(day)
+    try:
+        table.update_item(**options)
+    except ClientError as e:
+        log_error("%s", e.response['Error']['Message'])
+
+
+def untitled_expires(day):
+    """
+    EXPIRES of an 'untitled' item used on epoch `day`, for DynamoDB TTL
+
+    DynamoDB deletes it some time after; expire_untitled deletes it on
+    launch if it is still there.
+    """
+    ttl = int(os.environ.get(UNTITLED_TTL_ENV, DEFAULT_UNTITLED_TTL))
+    if not ttl:
+        return None
+    return (day + ttl) * DAY_SECONDS
+
+
+@traced
+def migrate_dbdata(id):
+    """
+    Move a user's single-item data into the profile table.
+
+    Copies each profile of the userId item in GENOME_DB_TABLE to its own
+    item, then removes the data from the old item.
+
+    Returns:
+    dict of migrated profile name: epoch_day last used
+    """
+    from botocore.exceptions import ClientError
+    item = get_dbdata(get_store(), id)
+    legacy = item.get(DATA)
+    if not legacy:
+        return {}
+    used = {name: int(item.get(LAST_USED, {}).get(name, 0))
+            for name in legacy}
+    try:
+        with get_profile_table().batch_writer() as batch:
+            for name, value in legacy.items():
+                batch.put_item(Item={USERID: id, PROFILE: name, DATA: value,
+                                     LAST_USED: used[name]})
+    except ClientError as e:
+        log_error("%s", e.response['Error']['Message'])
+        return {}
+    # keep the item for other user attributes like OPT_IN
+    if not (get_store().remove_attribute(id, DATA) and
+            get_store().remove_attribute(id, LAST_USED)):
+        return {}
+    log_info("migrated profiles: %s %s", id[0:PRINT_LIMIT], len(legacy))
+    return used
+
+
+@traced
+def get_opt_in(store, id):
+    """
+    Fetch just the OPT_IN flag for user.
+
+    Args:
+    store -- storage engine from get_store
+    id -- userId to fetch
+    """
+    return bool(store.get(id, [OPT_IN]).get(OPT_IN, False))
+
+
+@traced
+def set_opt_in(store, id):
+    """
+    Set the OPT_IN flag for user.
+
+    Args:
+    store -- storage engine from get_store
+    id -- userId to save to
+    """
+    store.set_attribute(id, OPT_IN, True)
+
+
+@traced
+def load_common(id):
+    """stored common summary of user, or None"""
+    summary = get_store().get(id, [COMMON]).get(COMMON)
+    if not summary:
+        return None
+    return {'names': summary['names'], 'low': int(summary['low']),
+            'high': int(summary['high']), 'saved': True}
+
+
+@traced
+def save_common(id, summary):
+    """store common summary of user on the userId item, like OPT_IN"""
+    if get_store().set_attribute(id, COMMON, {
+            'names': summary['names'], 'low': summary['low'],
+            'high': summary['high']}):
+        summary['saved'] = True
+
+
+@traced
+def clear_opt_in(store, id):
+    """
+    Remove the OPT_IN flag of user.
+
+    Args:
+    store -- storage engine from get_store
+    id -- userId to save to
+    """
+    store.remove_attribute(id, OPT_IN)
+
+
+@traced
+def get_dbdata(store, id):
+    """
+    Fetch item for user.
+
+    Args:
+    store -- storage engine from get_store
+    id -- userId to fetch
+    """
+    return store.get(id)
+
+
+@traced
+def put_dbdata(store, id, data):
+    """
+    Save data for user, replacing the item.
+
+    Args:
+    store -- storage engine from get_store
+    id -- userId to save to
+
+    Returns:
+    True if saved
+    """
+    return store.put(id, data)
+
+
+@traced
+def update_dbdata(store, id, data):
+    """
+    Save only the changed names of data for user.
+
+    Args:
+    store -- storage engine from get_store
+    id -- userId to save to
+    data -- TrackedData for user
+
+    Returns:
+    True if saved
+    """
+    return store.update(id, data)
+
+
+# --------------- storage engines -----------------
+# Each engine keeps the userId items of the item layout and has the same
+# methods: get, put, update, set_attribute and remove_attribute.  Errors
+# are logged and reported as an empty item or a False result.
+
+
+class DynamoStore:
+    """userId items in the GENOME_DB_TABLE DynamoDB table"""
+
+    def get(self, id, attributes=None):
+        """item for user, or {}; with only `attributes` if given"""
+        from botocore.exceptions import ClientError
+        options = {'Key': {USERID: id}}
+        if attributes:
+            names = {'#a' + str(i): name
+                     for i, name in enumerate(attributes)}
+            options['ProjectionExpression'] = ', '.join(names)
+            options['ExpressionAttributeNames'] = names
+        try:
+            response = get_db_table().get_item(**options)
+        except ClientError as e:
+            log_error("%s", e.response['Error']['Message'])
+            return {}
+        if 'Item' not in response:
+            return {}
+        log_debug("GetItem succeeded: %s", response['Item'])
+        return response['Item']
+
+    def put(self, id, data):
+        """replace the item of user with one holding `data`"""
+        from botocore.exceptions import ClientError
+        try:
+            get_db_table().put_item(Item={USERID: id, DATA: data})
+        except ClientError as e:
+            log_error("%s", e.response['Error']['Message'])
+            return False
+        log_info("PutItem succeeded: %s", id[0:PRINT_LIMIT])
+        return True
+
+    def update(self, id, data):
+        """
+        save the changes of TrackedData `data` for user
+
+        Sets each name in data.changes[CHANGED] and removes each name in
+        data.changes[REMOVED] with one UpdateItem, which also sets the
+        LAST_USED day of each name changed or touched.  DynamoDB can't
+        update paths inside maps the user doesn't have yet, so the
+        update is conditional on them; if that fails the missing maps are
+        added empty, keeping attributes like OPT_IN, and the update is
+        made again.
+        """
+        from botocore.exceptions import ClientError
+        names = {}
+        values = {}
+        sets = []
+        removes = []
+        for i, name in enumerate(data.changes[CHANGED]):
+            names['#n' + str(i)] = name
+            values[':v' + str(i)] = data[name]
+            sets.append('#data.#n{0} = :v{0}'.format(i))
+        for i, name in enumerate(data.changes[CHANGED] +
+                                 data.changes[TOUCHED]):
+            names['#t' + str(i)] = name
+            values[':t' + str(i)] = data.used.get(name, epoch_day())
+            sets.append('#used.#t{0} = :t{0}'.format(i))
+        for i, name in enumerate(data.changes[REMOVED]):
+            names['#r' + str(i)] = name
+            removes.append('#data.#r{0}'.format(i))
+            removes.append('#used.#r{0}'.format(i))
+        expression = ' '.join(
+            action + ' ' + ', '.join(paths)
+            for action, paths in (('SET', sets), ('REMOVE', removes))
+            if paths)
+        # DynamoDB rejects names the expressions don't use
+        maps = [('#data', DATA), ('#used', LAST_USED)]
+        maps = [(key, name) for key, name in maps if key + '.' in expression]
+        names.update(maps)
+        options = {
+            'Key': {USERID: id},
+            'UpdateExpression': expression,
+            'ExpressionAttributeNames': names,
+            'ConditionExpression': ' AND '.join(
+                'attribute_exists({0})'.format(key) for key, name in maps)
+        }
+        if values:
+            options['ExpressionAttributeValues'] = values
+        table = get_db_table()
+        try:
+            try:
+                table.update_item(**options)
+            except ClientError as e:
+                if (e.response['Error']['Code'] !=
+                        'ConditionalCheckFailedException'):
+                    raise
+                table.update_item(
+                    Key={USERID: id},
+                    UpdateExpression='SET ' + ', '.join(
+                        '{0} = if_not_exists({0}, :e)'.format(key)
+                        for key, name in maps),
+                    ExpressionAttributeNames=dict(maps),
+                    ExpressionAttributeValues={':e': {}})
+                del options['ConditionExpression']
+                table.update_item(**options)
+        except ClientError as e:
+            log_error("%s", e.response['Error']['Message'])
+            return False
+        log_info("UpdateItem succeeded: %s", id[0:PRINT_LIMIT])
+        return True
+
+    def set_attribute(self, id, name, value):
+        """set one top-level attribute of the item of user"""
+        return self._update(id, 'SET #a = :v', {'#a': name}, {':v': value})
+
+    def remove_attribute(self, id, name):
+        """remove one top-level attribute of the item of user"""
+        return self._update(id, 'REMOVE #a', {'#a': name})
+
+    def _update(self, id, expression, names, values=None):
+        """UpdateItem of the item of user"""
+        from botocore.exceptions import ClientError
+        options = {'Key': {USERID: id}, 'UpdateExpression': expression,
+                   'ExpressionAttributeNames': names}
+        if values:
+            options['ExpressionAttributeValues'] = values
+        try:
+            get_db_table().update_item(**options)
+        except ClientError as e:
+            log_error("%s", e.response['Error']['Message'])
+            return False
+        return True
+
+
+class MemoryStore:
+    """
+    userId items held in this process, least recently used first
+
+    On its own it is the whole store, for local runs, and keeps every
+    item.  In front of a `backing` engine it is a read-through and
+    write-through cache of at most `size` items, each trusted for `ttl`
+    seconds since other containers may write the same user, so a repeat
+    launch in a warm container skips the read.  Items are copied in and
+    out, as session data is changed in place.
+    """
+
+    def __init__(self, backing=None, size=0, ttl=DEFAULT_DB_CACHE_TTL):
+        self.backing = backing
+        self.size = size
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0}
+        self._items = OrderedDict()     # id: (expires, item)
+        self._lock = threading.Lock()
+
+    def get(self, id, attributes=None):
+        """item for user, or {}; with only `attributes` if given"""
+        with self._lock:
+            item = self._cached(id)
+            if item is not None or self.backing is None:
+                self.stats['hits'] += item is not None
+                return copy_item(project_item(item or {}, attributes))
+            self.stats['misses'] += 1
+        item = self.backing.get(id, attributes)
+        # partial items and failed reads aren't kept
+        if item and not attributes:
+            with self._lock:
+                self._remember(id, copy_item(item))
+        return item
+
+    def put(self, id, data):
+        """replace the item of user with one holding `data`"""
+        if self.backing is not None and not self.backing.put(id, data):
+            return self._drop(id)
+        with self._lock:
+            self._remember(id, {USERID: id, DATA: copy_item(data)})
+        return True
+
+    def update(self, id, data):
+        """save the changes of TrackedData `data` for user"""
+        if self.backing is not None and not self.backing.update(id, data):
+            return self._drop(id)
+        return self._change(id, lambda item: apply_changes(item, data))
+
+    def set_attribute(self, id, name, value):
+        """set one top-level attribute of the item of user"""
+        if (self.backing is not None and
+                not self.backing.set_attribute(id, name, value)):
+            return self._drop(id)
+        return self._change(id, lambda item: item.update(
+            {name: copy_item(value)}))
+
+    def remove_attribute(self, id, name):
+        """remove one top-level attribute of the item of user"""
+        if (self.backing is not None and
+                not self.backing.remove_attribute(id, name)):
+            return self._drop(id)
+        return self._change(id, lambda item: item.pop(name, None))
+
+    def clear(self):
+        """drop every item and reset counters"""
+        with self._lock:
+            self._items.clear()
+            for name in self.stats:
+                self.stats[name] = 0
+
+    def _change(self, id, change):
+        """
+        apply `change` to the item of user as saved
+
+        A cache only changes an item it holds; the whole store makes it.
+        """
+        with self._lock:
+            item = self._cached(id)
+            if item is None:
+                if self.backing is not None:
+                    return True
+                item = {USERID: id}
+                self._remember(id, item)
+            change(item)
+        return True
+
+    def _drop(self, id):
+        """forget user after a failed write, which may have half landed"""
+        with self._lock:
+            self._items.pop(id, None)
+        return False
+
+    def _cached(self, id):
+        """the unexpired item held for user, or None; locked"""
+        entry = self._items.get(id)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.time():
+            del self._items[id]
+            return None
+        self._items.move_to_end(id)
+        return entry[1]
+
+    def _remember(self, id, item):
+        """hold `item`, evicting least recently used; locked"""
+        expires = None if self.backing is None else time.time() + self.ttl
+        self._items[id] = (expires, item)
+        self._items.move_to_end(id)
+        while self.size and len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+
+class SqliteStore:
+    """
+    userId items as JSON in a SQLite file, for local runs and tests
+
+    One connection is shared by all threads under a lock.  Changes read
+    and write back the item in one IMMEDIATE transaction, so processes
+    sharing the file don't lose each other's writes.
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS items '
+                                 '(userId TEXT PRIMARY KEY, item TEXT)')
+
+    def get(self, id, attributes=None):
+        """item for user, or {}; with only `attributes` if given"""
+        import sqlite3
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    'SELECT item FROM items WHERE userId = ?',
+                    (id,)).fetchone()
+        except sqlite3.Error as e:
+            log_error("%s", e)
+            return {}
+        if row is None:
+            return {}
+        return project_item(json.loads(row[0]), attributes)
+
+    def put(self, id, data):
+        """replace the item of user with one holding `data`"""
+        import sqlite3
+        try:
+            with self._lock:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO items VALUES (?, ?)',
+                    (id, json.dumps({USERID: id, DATA: data})))
+        except sqlite3.Error as e:
+            log_error("%s", e)
+            return False
+        return True
+
+    def update(self, id, data):
+        """save the changes of TrackedData `data` for user"""
+        return self._change(id, lambda item: apply_changes(item, data))
+
+    def set_attribute(self, id, name, value):
+        """set one top-level attribute of the item of user"""
+        return self._change(id, lambda item: item.update({name: value}))
+
+    def remove_attribute(self, id, name):
+        """remove one top-level attribute of the item of user"""
+        return self._change(id, lambda item: item.pop(name, None))
+
+    def _change(self, id, change):
+        """apply `change` to the item of user in one transaction"""
+        import sqlite3
+        try:
+            with self._lock:
+                connection = self._connection
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    row = connection.execute(
+                        'SELECT item FROM items WHERE userId = ?',
+                        (id,)).fetchone()
+                    item = json.loads(row[0]) if row else {USERID: id}
+                    change(item)
+                    connection.execute(
+                        'INSERT OR REPLACE INTO items VALUES (?, ?)',
+                        (id, json.dumps(item)))
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+                connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            log_error("%s", e)
+            return False
+        return True
+
+
+def apply_changes(item, data):
+    """apply the changes of TrackedData `data` to a stored item in place"""
+    item.setdefault(DATA, {})
+    item.setdefault(LAST_USED, {})
+    for name in data.changes[CHANGED]:
+        item[DATA][name] = copy_item(data[name])
+    for name in data.changes[CHANGED] + data.changes[TOUCHED]:
+        item[LAST_USED][name] = data.used.get(name, epoch_day())
+    for name in data.changes[REMOVED]:
+        item[DATA].pop(name, None)
+        item[LAST_USED].pop(name, None)
+
+
+def copy_item(value):
+    """copy of the dicts and lists of a stored item; other values shared"""
+    if isinstance(value, dict):
+        return {key: copy_item(each) for key, each in value.items()}
+    if isinstance(value, list):
+        return [copy_item(each) for each in value]
+    return value
+
+
+def project_item(item, attributes):
+    """`item` with only `attributes`, or all of it if None"""
+    if not attributes:
+        return item
+    return {name: item[name] for name in attributes if name in item}
 
 
 # --------------- speech response handlers -----------------
@@ -813,12 +3605,195 @@ def response_ask_link_card(output, reprompt):
     }
 
 
+@traced
 def response(attributes, speech_response):
     """create a simple json response
     uses one of the speech_responses from above
     """
     return {
         'version': '1.0',
-        'sessionAttributes': attributes,
+        'sessionAttributes': encode_attributes(attributes),
         'response': speech_response
     }
+
+
+# --------------- session codec -----------------
+# DATA_KEY goes back and forth in sessionAttributes on every turn.  Each
+# profile is sent as a string of its TRAIT_LIST scores, and the phrases are
+# sent once in a table by trait and score, which has at most 5 entries per
+# trait however many profiles there are.
+
+
+def encode_attributes(attributes):
+    """copy of `attributes` with DATA_KEY packed for sessionAttributes"""
+    if DATA_KEY not in attributes:
+        return attributes
+    encoded = dict(attributes)
+    (encoded[DATA_KEY],
+     encoded[PHRASES_KEY]) = encode_data(attributes[DATA_KEY])
+    return encoded
+
+
+@traced
+def decode_attributes(attributes):
+    """unpack DATA_KEY in `attributes` from sessionAttributes in place"""
+    if PHRASES_KEY in attributes:
+        attributes[DATA_KEY] = decode_data(attributes.get(DATA_KEY, {}),
+                                           attributes.pop(PHRASES_KEY))
+    return attributes
+
+
+def encode_data(data):
+    """
+    Pack genome data.
+
+    Args:
+        data: data as stored in DATA_KEY attribute
+
+    Returns:
+        tuple of dict of name: score string, or None if not loaded, and
+        dict of trait: {score: phrase}
+    """
+    packed = {}
+    phrases = {}
+    for name, record in data.items():
+        if record is None:
+            packed[name] = None
+            continue
+        scores = []
+        for trait in TRAIT_LIST:
+            if trait in record:
+                score = str(int(record[trait][0]))
+                scores.append(score)
+                phrases.setdefault(trait, {})[score] = record[trait][1]
+            else:
+                scores.append(NO_SCORE)
+        packed[name] = ''.join(scores)
+    return (packed, phrases)
+
+
+def decode_data(packed, phrases):
+    """
+    Unpack genome data packed by encode_data.
+
+    Returns:
+        data as stored in DATA_KEY attribute
+    """
+    data = {}
+    for name, scores in packed.items():
+        if not isinstance(scores, str):
+            # not loaded, or not packed
+            data[name] = scores
+            continue
+        record = {}
+        for trait, score in zip(TRAIT_LIST, scores):
+            if score != NO_SCORE:
+                record[trait] = (int(score), phrases[trait][score])
+        data[name] = record
+    return data
+
+
+# --------------- handler metrics -----------------
+# Each request handled writes one CloudWatch Embedded Metric Format line
+# to stdout, which CloudWatch Logs turns into Latency and Errors metrics
+# with a Handler dimension, without any API calls from the Lambda.
+# GENOME_METRICS=off stops them.
+
+METRICS_ENV = 'GENOME_METRICS'
+METRICS_NAMESPACE_ENV = 'GENOME_METRICS_NAMESPACE'
+DEFAULT_METRICS_NAMESPACE = 'GenomeMatch'
+
+
+def timed(name, entry, args):
+    """
+    call a REQUEST_HANDLERS or INTENT_HANDLERS entry, recording its metrics
+
+    Args:
+        name: Handler dimension of the metrics
+        entry: (handler, names of the args it takes)
+        args: dict of every arg a handler can take
+
+    Returns:
+        what the handler returns; its exceptions are recorded and raised
+    """
+    start = time.perf_counter()
+    errors = 1
+    try:
+        result = call_handler(entry, args)
+        errors = 0
+        return result
+    finally:
+        emit_metrics(name, (time.perf_counter() - start) * 1000, errors)
+
+
+def call_handler(entry, args):
+    """call (handler, names of the args it takes) with those of `args`"""
+    (handler, params) = entry
+    return handler(*[args[param] for param in params])
+
+
+def emit_metrics(name, latency, errors):
+    """write one EMF line with the latency in ms and error count"""
+    if os.environ.get(METRICS_ENV, 'on').lower() in ('off', '0', 'false'):
+        return
+    line = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': os.environ.get(METRICS_NAMESPACE_ENV,
+                                            DEFAULT_METRICS_NAMESPACE),
+                'Dimensions': [['Handler']],
+                'Metrics': [{'Name': 'Latency', 'Unit': 'Milliseconds'},
+                            {'Name': 'Errors', 'Unit': 'Count'}],
+            }],
+        },
+        'Handler': name,
+        'Latency': round(latency, 3),
+        'Errors': errors,
+    }
+    sys.stdout.write(json.dumps(line) + '\n')
+
+
+def handler_name(request):
+    """Handler dimension for a request: intent name or request type"""
+    if request['type'] != 'IntentRequest':
+        return request['type']
+    if request['intent']['name'] in INTENT_HANDLERS:
+        return request['intent']['name']
+    return HELP_INTENT
+
+
+# --------------- handler registry -----------------
+# Handlers by request type and by intent name, each with the names of the
+# args it takes: request, session, locale, context (Lambda) and
+# event_context (Alexa).  Defined last so every handler exists.
+
+HELP_INTENT = 'AMAZON.HelpIntent'
+# intents that keep the pages left in PAGES_KEY
+PAGE_INTENTS = ('AMAZON.NextIntent', 'AMAZON.MoreIntent',
+                'AMAZON.RepeatIntent')
+REQUEST_HANDLERS = {
+    'LaunchRequest': (on_launch, ('request', 'session')),
+    'IntentRequest': (on_intent, ('request', 'session', 'context',
+                                  'event_context')),
+    'SessionEndedRequest': (on_session_ended, ('session',)),
+}
+INTENT_HANDLERS = {
+    'LoadIntent': (load_data, ('request', 'session', 'locale', 'context',
+                               'event_context')),
+    'NameIntent': (set_name, ('request', 'session', 'locale')),
+    'ListIntent': (get_list, ('session', 'locale')),
+    'CompareIntent': (compare_data, ('request', 'session', 'locale')),
+    'GroupIntent': (compare_group, ('request', 'session', 'locale')),
+    'CommonIntent': (compare_group, ('request', 'session', 'locale')),
+    'RankIntent': (rank_data, ('request', 'session', 'locale')),
+    'OptInIntent': (opt_in, ('session', 'locale')),
+    'OptOutIntent': (opt_out, ('session', 'locale')),
+    'SimilarIntent': (find_similar, ('request', 'session', 'locale')),
+    'AMAZON.NextIntent': (next_page, ('session', 'locale')),
+    'AMAZON.MoreIntent': (next_page, ('session', 'locale')),
+    'AMAZON.RepeatIntent': (repeat_response, ('session',)),
+    'AMAZON.CancelIntent': (stop_response, ('session', 'locale')),
+    'AMAZON.StopIntent': (stop_response, ('session', 'locale')),
+    HELP_INTENT: (help_response, ('session', 'locale')),
+}
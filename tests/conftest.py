@@ -0,0 +1,39 @@
+"""
+conftest.py: shared fixtures of the genomeMatch tests
+
+Tests run against the in-memory DynamoDB of benchmarks/backends.py, so
+they need no AWS account or network.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import genomeMatch  # noqa: E402
+
+# the GENOME_ settings, so the tests choose their own
+ENVIRONMENT = [value for (name, value) in vars(genomeMatch).items()
+               if name.endswith('_ENV')]
+# module globals made on first use, reset around each test
+GLOBALS = ['_dynamodb', '_db_table', '_profile_table', '_store',
+           '_report_cache', '_match_index']
+
+
+@pytest.fixture(autouse=True)
+def fresh_module(monkeypatch):
+    """clear the environment and module globals a test may set"""
+    for name in ENVIRONMENT:
+        monkeypatch.delenv(name, raising=False)
+    for name in GLOBALS:
+        monkeypatch.setattr(genomeMatch, name, None)
+
+
+@pytest.fixture
+def dynamodb():
+    """the MemoryDynamoDB in place of genomeMatch's DynamoDB resource"""
+    pytest.importorskip('botocore')
+    import backends
+    return backends.install_dynamodb()
@@ -0,0 +1,52 @@
+"""
+test_logging.py: logger settings from the environment
+"""
+import json
+import logging
+
+import pytest
+
+import genomeMatch
+
+
+@pytest.fixture
+def new_logger(monkeypatch):
+    """get_logger configures a new logger, removed after the test"""
+    logger = logging.getLogger(genomeMatch.LOGGER_NAME)
+    monkeypatch.setattr(genomeMatch, '_logger', None)
+    monkeypatch.setattr(logger, 'handlers', [])
+    monkeypatch.setattr(logger, 'level', logger.level)
+    return logger
+
+
+def lines(capsys):
+    """JSON log lines written to stdout"""
+    return [json.loads(line) for line in
+            capsys.readouterr().out.splitlines()]
+
+
+def test_log_level(new_logger, monkeypatch, capsys):
+    monkeypatch.setenv(genomeMatch.LOG_LEVEL_ENV, 'warning')
+    genomeMatch.log_info('not logged')
+    genomeMatch.log_warning('logged')
+    assert new_logger.level == logging.WARNING
+    assert [line['message'] for line in lines(capsys)] == ['logged']
+
+
+def test_unknown_log_level(new_logger, monkeypatch, capsys):
+    monkeypatch.setenv(genomeMatch.LOG_LEVEL_ENV, 'verbose')
+    genomeMatch.log_info('logged')
+    assert new_logger.level == logging.INFO
+    logged = lines(capsys)
+    assert logged[0]['level'] == 'WARNING'
+    assert 'VERBOSE' in logged[0]['message']
+    assert logged[1]['message'] == 'logged'
+
+
+def test_field_limit(new_logger, monkeypatch, capsys):
+    monkeypatch.setenv(genomeMatch.LOG_FIELD_LIMIT_ENV, '10')
+    genomeMatch.log_info('%s %s', 'x' * 20, list(range(20)))
+    (line,) = lines(capsys)
+    (text, values) = line['message'].split(' ', 1)
+    assert text == 'x' * 10 + '...'
+    assert len(values) <= 13
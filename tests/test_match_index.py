@@ -0,0 +1,134 @@
+"""
+test_match_index.py: the cross-user match index and opting in and out
+"""
+import random
+
+import pytest
+
+import backends
+import events
+import genomeMatch
+
+OTHER_USER = 'amzn1.ask.account.OTHER'
+
+
+def profiles(count, seed=0):
+    """list of random complete profiles"""
+    rng = random.Random(seed)
+    return [backends.random_profile(rng) for _ in range(count)]
+
+
+def best(record, records):
+    """(high, moderate) count of the best match of `record` in `records`"""
+    return max(tuple(len(each) for each in
+                     genomeMatch.match_records(record, other))
+               for other in records)
+
+
+def test_query():
+    pytest.importorskip('numpy')
+    records = profiles(50)
+    index = genomeMatch.MatchIndex()
+    for (i, record) in enumerate(records):
+        index.add('member{0}'.format(i), record)
+    assert len(index) == 50
+    for record in profiles(5, seed=1):
+        ((member, high, moderate),) = index.query(record, 1)
+        assert (high, moderate) == best(record, records)
+    # best first, by high then moderate matches
+    counts = [(high, moderate)
+              for (member, high, moderate) in index.query(records[7], 10)]
+    assert counts == sorted(counts, reverse=True)
+
+
+def test_exclude_and_remove():
+    pytest.importorskip('numpy')
+    record = profiles(1)[0]
+    index = genomeMatch.MatchIndex()
+    index.add('me/a', record)
+    index.add('you/a', record)
+    assert [each[0] for each in index.query(record, 5, 'me/')] == ['you/a']
+    index.remove('you/a')
+    index.remove('nobody')
+    assert index.query(record, 5, 'me/') == []
+    assert len(index) == 1
+
+
+def test_save_and_load(tmp_path):
+    pytest.importorskip('numpy')
+    records = profiles(100)
+    index = genomeMatch.MatchIndex()
+    for (i, record) in enumerate(records):
+        index.add('member{0}'.format(i), record)
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    loaded = genomeMatch.MatchIndex.load(path)
+    assert len(loaded) == len(index)
+    for record in profiles(5, seed=2):
+        assert loaded.query(record, 3) == index.query(record, 3)
+
+
+@pytest.fixture
+def index(dynamodb, monkeypatch, tmp_path):
+    """GENOME_MATCH_INDEX with one profile of another user"""
+    pytest.importorskip('numpy')
+    built = genomeMatch.MatchIndex()
+    built.add(genomeMatch.member_id(OTHER_USER, 'friend'), profiles(1)[0])
+    path = str(tmp_path / 'index.npz')
+    built.save(path)
+    monkeypatch.setenv(genomeMatch.MATCH_INDEX_ENV, path)
+    backends.seed_user(dynamodb, events.USER_ID, 2)
+    return genomeMatch.get_match_index()
+
+
+def similar(reply):
+    """SimilarIntent for profile0 in answer to `reply`"""
+    return genomeMatch.lambda_handler(events.intent_request(
+        'SimilarIntent', {genomeMatch.NAME_SLOT: 'profile0'},
+        reply['sessionAttributes']), None)
+
+
+def speech(reply):
+    """SSML said by a reply"""
+    return reply['response']['outputSpeech']['ssml']
+
+
+def intent(name, reply):
+    """intent `name` in answer to `reply`"""
+    return genomeMatch.lambda_handler(events.intent_request(
+        name, attributes=reply['sessionAttributes']), None)
+
+
+def test_opt_in_and_out(index):
+    reply = genomeMatch.lambda_handler(events.launch_request(), None)
+    assert "first say share my data" in speech(similar(reply))
+    reply = intent('OptInIntent', reply)
+    assert genomeMatch.get_opt_in(genomeMatch.get_store(), events.USER_ID)
+    assert len(index) == 3
+    # matched only with other users' profiles
+    assert "the closest to profile0 shares" in speech(similar(reply))
+    reply = intent('OptOutIntent', reply)
+    assert not genomeMatch.get_opt_in(genomeMatch.get_store(),
+                                      events.USER_ID)
+    assert len(index) == 1
+    assert [each[0] for each in index.query(profiles(1)[0], 5)] == [
+        genomeMatch.member_id(OTHER_USER, 'friend')]
+    assert "first say share my data" in speech(similar(reply))
+
+
+def test_named_profile_indexed(index):
+    genomeMatch.get_store().set_attribute(events.USER_ID, genomeMatch.OPT_IN,
+                                          True)
+    reply = genomeMatch.lambda_handler(events.launch_request(), None)
+    attributes = genomeMatch.decode_attributes(reply['sessionAttributes'])
+    record = profiles(1, seed=3)[0]
+    attributes[genomeMatch.DATA_KEY]['untitled'] = record
+    reply = genomeMatch.lambda_handler(events.intent_request(
+        'NameIntent', {genomeMatch.NAME_SLOT: 'newbie'},
+        genomeMatch.encode_attributes(attributes)), None)
+    assert 'newbie' in reply['sessionAttributes'][genomeMatch.DATA_KEY]
+    # only the profile named since opting in, next to the other user's
+    assert len(index) == 2
+    assert [member for (member, high, moderate)
+            in index.query(record, 2, genomeMatch.member_id(OTHER_USER, ''))
+            ] == [genomeMatch.member_id(events.USER_ID, 'newbie')]
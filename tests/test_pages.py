@@ -0,0 +1,95 @@
+"""
+test_pages.py: paginated speech and the NextIntent cursor
+"""
+import re
+
+import backends
+import events
+import genomeMatch
+
+NEXT = "Say next to hear more. "
+
+
+def speech(reply):
+    """text said by a reply, without the SSML tags"""
+    ssml = reply['response']['outputSpeech']['ssml']
+    return ssml[len('<speak>'):-len('</speak>')]
+
+
+def test_paginate():
+    words = ['w{0}'.format(i) for i in range(7)]
+    assert genomeMatch.paginate([('Intro ', words)], 'en-US', 3) == [
+        'Intro w0, w1, w2. ', 'w3, w4, w5. ', 'w6. ']
+    assert genomeMatch.paginate([('Intro ', words[:3])], 'en-US', 3) == [
+        'Intro w0, w1, and w2. ']
+
+
+def test_paginate_sections():
+    sections = [('First ', ['a', 'b']), ('Second ', ['c', 'd', 'e'])]
+    # an intro goes with its first word, on the next page if this is full
+    assert genomeMatch.paginate(sections, 'en-US', 2) == [
+        'First a, and b. ', 'Second c, d. ', 'e. ']
+    assert genomeMatch.paginate(sections, 'en-US', 3) == [
+        'First a, and b. Second c. ', 'd, and e. ']
+
+
+def test_paginate_empty():
+    assert genomeMatch.paginate([('Nothing. ', [])], 'en-US', 3) == [
+        'Nothing. ']
+
+
+def session_pages(dynamodb, count):
+    """launch with `count` profiles and ask for the list"""
+    backends.seed_user(dynamodb, events.USER_ID, count)
+    reply = genomeMatch.lambda_handler(events.launch_request(), None)
+    return genomeMatch.lambda_handler(events.intent_request(
+        'ListIntent', attributes=reply['sessionAttributes']), None)
+
+
+def ask(name, reply):
+    """answer `reply` with intent `name`"""
+    return genomeMatch.lambda_handler(events.intent_request(
+        name, attributes=reply['sessionAttributes']), None)
+
+
+def test_next_page(dynamodb):
+    count = genomeMatch.LIST_PAGE_NAMES * 2 + 1
+    reply = session_pages(dynamodb, count)
+    said = [speech(reply)]
+    while speech(reply).endswith(NEXT):
+        reply = ask('AMAZON.NextIntent', reply)
+        said.append(speech(reply))
+    assert len(said) == 3
+    assert all(text.endswith(NEXT) for text in said[:-1])
+    # every name once, in order
+    assert re.findall(r'profile\d+', ' '.join(said)) == [
+        'profile{0}'.format(i) for i in range(count)]
+    # the options come after the last page, and the cursor is gone
+    assert genomeMatch.PAGES_KEY not in reply['sessionAttributes']
+    assert not said[-1].endswith(NEXT)
+    reply = ask('AMAZON.NextIntent', reply)
+    assert speech(reply).startswith("There is no more to hear. ")
+
+
+def test_repeat_keeps_cursor(dynamodb):
+    reply = session_pages(dynamodb, genomeMatch.LIST_PAGE_NAMES + 1)
+    repeated = ask('AMAZON.RepeatIntent', reply)
+    assert speech(repeated) == speech(reply)
+    assert (repeated['sessionAttributes'][genomeMatch.PAGES_KEY] ==
+            reply['sessionAttributes'][genomeMatch.PAGES_KEY])
+    last = ask('AMAZON.MoreIntent', repeated)
+    assert 'profile10' in speech(last)
+
+
+def test_other_intent_drops_cursor(dynamodb):
+    reply = session_pages(dynamodb, genomeMatch.LIST_PAGE_NAMES + 1)
+    helped = ask('AMAZON.HelpIntent', reply)
+    assert genomeMatch.PAGES_KEY not in helped['sessionAttributes']
+    assert speech(ask('AMAZON.NextIntent', helped)).startswith(
+        "There is no more to hear. ")
+
+
+def test_one_page_has_no_cursor(dynamodb):
+    reply = session_pages(dynamodb, 3)
+    assert not speech(reply).endswith(NEXT)
+    assert genomeMatch.PAGES_KEY not in reply['sessionAttributes']
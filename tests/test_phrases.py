@@ -0,0 +1,67 @@
+"""
+test_phrases.py: golden phrases of clean_phrase
+
+GOLDEN has the phrase expected for each form of GenomeLink summary the
+rules handle.  Add a line for each summary text of a new trait before
+adding its rules; benchmarks/phrases.py times the same table.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomeMatch  # noqa: E402
+
+# (trait, summary text, phrase clean_phrase makes of it)
+GOLDEN = [
+    ('agreeableness', 'Weak tendency to be agreeable',
+     'They have low tendency to be agreeable'),
+    ('agreeableness', 'Slight tendency to be agreeable',
+     'They have a tendency to be agreeable'),
+    ('agreeableness', 'Stronger tendency to be agreeable',
+     'They have a strong tendency to be agreeable'),
+    ('agreeableness', 'Strong tendency to be agreeable',
+     'They have high tendency to be agreeable'),
+    ('anger', 'Not easily angered', 'They are not easily angered'),
+    ('anger', 'Not easily angered, slightly',
+     'They are not easily angered'),
+    ('anger', 'Easily angered, slightly', 'They are easily angered'),
+    ('anger', 'Easily angered', 'They are easily angered'),
+    ('conscientiousness', 'Weak conscientiousness',
+     'They have low conscientiousness'),
+    ('conscientiousness', 'Strong conscientiousness',
+     'They have high conscientiousness'),
+    ('depression', 'Does not show tendency to depression',
+     'They have low tendency to depression'),
+    ('depression', 'Somewhat prone to depression',
+     'They are somewhat prone to depression'),
+    ('extraversion', 'Slight tendency to be extraverted',
+     'They have a tendency to be extraverted'),
+    ('gambling', 'Stronger tendency to gamble',
+     'They have a strong tendency to gamble'),
+    ('harm-avoidance', 'Does not show tendency to avoid harm',
+     'They have low tendency to avoid harm'),
+    ('neuroticism', 'Somewhat prone to neuroticism, slightly',
+     'They are somewhat prone to neuroticism'),
+    ('openness', 'Tend to be open to experience',
+     'They tend to be open to experience. '),
+    ('openness', 'Tend not to be open to experience',
+     'They tend not to be open to experience. '),
+    ('novelty-seeking', 'Weak tendency to seek novelty',
+     'They have low tendency to seek novelty'),
+    ('reward-dependence', 'Strong reward dependence',
+     'They have high reward dependence'),
+    ('reward-dependence', 'Intermediate', 'They Intermediate'),
+    ('bmi', 'Slightly higher ', 'They tend to have a Slightly higher bmi'),
+    ('body-fat-mass', 'Lower ', 'They tend to have a Lower body fat mass'),
+]
+
+
+def test_clean_phrase():
+    for (trait, text, expected) in GOLDEN:
+        assert genomeMatch.clean_phrase(trait, text) == expected, text
+
+
+def test_clean_phrase_memoized():
+    genomeMatch.rewrite_phrase.cache_clear()
+    for (trait, text, expected) in GOLDEN + GOLDEN:
+        assert genomeMatch.clean_phrase(trait, text) == expected, text
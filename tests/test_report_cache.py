@@ -0,0 +1,48 @@
+"""
+test_report_cache.py: the two tiers of ReportCache in fetch_reports
+"""
+import backends
+import genomeMatch
+
+TOKEN = 'token'
+
+
+def fetch(session):
+    """run fetch_reports for `session` in a trace, (result, span names)"""
+    trace = genomeMatch.Trace('test')
+    context = genomeMatch._current_trace.set(trace)
+    try:
+        result = genomeMatch.get_event_loop().run_until_complete(
+            genomeMatch.fetch_reports(session))
+    finally:
+        genomeMatch._current_trace.reset(context)
+    return (result, [each.name for each in trace.spans])
+
+
+def test_shared_tier_span(dynamodb, monkeypatch):
+    monkeypatch.setenv(genomeMatch.CACHE_TABLE_ENV, backends.CACHE_TABLE)
+    monkeypatch.setenv(genomeMatch.CACHE_SIZE_ENV, '0')
+    summaries = {name: {'score': 2, 'text': 'Intermediate'}
+                 for name in genomeMatch.TRAIT_LIST}
+    genomeMatch.get_report_cache().put_many(TOKEN, summaries,
+                                            genomeMatch.POPULATION)
+    session = {'user': {'accessToken': TOKEN}, 'attributes': {}}
+    (result, names) = fetch(session)
+    assert sorted(result.records) == sorted(genomeMatch.TRAIT_LIST)
+    # the shared read runs in the executor, still under fetch_reports
+    assert '_get_shared' in names
+    assert genomeMatch.get_report_cache().stats['shared_hits'] == len(
+        genomeMatch.TRAIT_LIST)
+
+
+def test_memory_tier():
+    summaries = {name: {'score': 0, 'text': 'Intermediate'}
+                 for name in genomeMatch.TRAIT_LIST}
+    genomeMatch.get_report_cache().put_many(TOKEN, summaries,
+                                            genomeMatch.POPULATION)
+    session = {'user': {'accessToken': TOKEN}, 'attributes': {}}
+    (result, names) = fetch(session)
+    assert sorted(result.records) == sorted(genomeMatch.TRAIT_LIST)
+    assert '_get_shared' not in names
+    assert genomeMatch.get_report_cache().stats['memory_hits'] == len(
+        genomeMatch.TRAIT_LIST)
@@ -0,0 +1,87 @@
+"""
+test_routing.py: handler tables, metrics lines and the session codec
+"""
+import json
+import random
+
+import pytest
+
+import backends
+import events
+import genomeMatch
+
+
+def metrics(capsys):
+    """(Handler, Errors) of the EMF lines written to stdout"""
+    lines = [json.loads(line)
+             for line in capsys.readouterr().out.splitlines()]
+    return [(line['Handler'], line['Errors']) for line in lines
+            if '_aws' in line]
+
+
+def test_metrics_by_handler(capsys):
+    help = genomeMatch.lambda_handler(
+        events.intent_request('AMAZON.HelpIntent'), None)
+    unknown = genomeMatch.lambda_handler(
+        events.intent_request('NoSuchIntent'), None)
+    # unknown intents get help, under the help dimension
+    assert unknown['response'] == help['response']
+    genomeMatch.lambda_handler(events.intent_request('AMAZON.StopIntent'),
+                               None)
+    assert metrics(capsys) == [('AMAZON.HelpIntent', 0),
+                               ('AMAZON.HelpIntent', 0),
+                               ('AMAZON.StopIntent', 0)]
+
+
+def test_unknown_request_type(capsys):
+    event = events.launch_request()
+    event['request']['type'] = 'CanFulfillIntentRequest'
+    assert genomeMatch.lambda_handler(event, None) is None
+    assert metrics(capsys) == []
+
+
+def test_error_metric(capsys, monkeypatch):
+    def fail(session, locale):
+        raise RuntimeError('handler failed')
+    monkeypatch.setitem(genomeMatch.INTENT_HANDLERS, 'ListIntent',
+                        (fail, ('session', 'locale')))
+    with pytest.raises(RuntimeError):
+        genomeMatch.lambda_handler(events.intent_request('ListIntent'),
+                                   None)
+    assert metrics(capsys) == [('ListIntent', 1)]
+
+
+def test_metrics_off(capsys, monkeypatch):
+    monkeypatch.setenv(genomeMatch.METRICS_ENV, 'off')
+    genomeMatch.lambda_handler(events.intent_request('AMAZON.HelpIntent'),
+                               None)
+    assert metrics(capsys) == []
+
+
+def test_codec_round_trip():
+    rng = random.Random(0)
+    data = {'profile{0}'.format(i): backends.random_profile(rng)
+            for i in range(20)}
+    del data['profile3']['anger']
+    data['untitled'] = {'openness': data['profile0']['openness']}
+    data['unloaded'] = None
+    attributes = {genomeMatch.DATA_KEY: data, 'other': 1}
+    encoded = genomeMatch.encode_attributes(attributes)
+    # json as Alexa carries it, which makes tuples lists
+    decoded = genomeMatch.decode_attributes(json.loads(json.dumps(encoded)))
+    assert genomeMatch.PHRASES_KEY not in decoded
+    assert decoded['other'] == 1
+    assert {name: record and {trait: tuple(value)
+                              for trait, value in record.items()}
+            for name, record in decoded[genomeMatch.DATA_KEY].items()
+            } == data
+    # the phrases go once for each trait and score, not per profile
+    phrases = encoded[genomeMatch.PHRASES_KEY]
+    assert sum(len(each) for each in phrases.values()) <= (
+        len(genomeMatch.TRAIT_LIST) * 5)
+
+
+def test_codec_without_data():
+    attributes = {genomeMatch.SPEECHOUTPUT_KEY: 'hello'}
+    assert genomeMatch.encode_attributes(attributes) == attributes
+    assert genomeMatch.decode_attributes(dict(attributes)) == attributes
@@ -0,0 +1,191 @@
+"""
+test_storage.py: storage engines and the storage budget
+"""
+import random
+
+import pytest
+
+import backends
+import events
+import genomeMatch
+
+USER = events.USER_ID
+
+
+def profiles(count, seed=0):
+    """dict of name: random complete profile"""
+    rng = random.Random(seed)
+    return {'profile{0}'.format(i): backends.random_profile(rng)
+            for i in range(count)}
+
+
+def as_lists(record):
+    """`record` with lists for (score, phrase), as SQLite's JSON has"""
+    return {trait: list(value) for trait, value in record.items()}
+
+
+def record_updates(table, monkeypatch):
+    """list to which each update_item call on `table` adds its options"""
+    calls = []
+    update_item = table.update_item
+
+    def record(**options):
+        calls.append(options)
+        return update_item(**options)
+    monkeypatch.setattr(table, 'update_item', record)
+    return calls
+
+
+def change_profiles(data, stored):
+    """set, replace, delete and touch a profile each"""
+    data['new'] = stored['profile0']
+    data['profile1'] = stored['profile2']
+    del data['profile2']
+    data.touch(['profile3'])
+
+
+@pytest.fixture(params=['dynamodb', 'sqlite', 'memory', 'cached'])
+def store(request, tmp_path):
+    """each storage engine, and a MemoryStore in front of DynamoStore"""
+    if request.param == 'sqlite':
+        return genomeMatch.SqliteStore(str(tmp_path / 'genome.db'))
+    if request.param == 'memory':
+        return genomeMatch.MemoryStore()
+    request.getfixturevalue('dynamodb')
+    if request.param == 'cached':
+        return genomeMatch.MemoryStore(genomeMatch.DynamoStore(), 10)
+    return genomeMatch.DynamoStore()
+
+
+def test_update(store):
+    stored = profiles(4)
+    assert store.put(USER, stored)
+    assert store.set_attribute(USER, genomeMatch.OPT_IN, True)
+    data = genomeMatch.TrackedData(dict(stored), genomeMatch.new_changes())
+    change_profiles(data, stored)
+    assert store.update(USER, data)
+    item = store.get(USER)
+    today = genomeMatch.epoch_day()
+    assert sorted(item[genomeMatch.DATA]) == ['new', 'profile0',
+                                              'profile1', 'profile3']
+    assert as_lists(item[genomeMatch.DATA]['profile1']) == as_lists(
+        stored['profile2'])
+    assert item[genomeMatch.LAST_USED] == {'new': today, 'profile1': today,
+                                           'profile3': today}
+    assert item[genomeMatch.OPT_IN]
+    assert store.get(USER, [genomeMatch.OPT_IN]) == {genomeMatch.OPT_IN:
+                                                     True}
+    assert store.remove_attribute(USER, genomeMatch.OPT_IN)
+    assert genomeMatch.OPT_IN not in store.get(USER)
+
+
+def test_update_new_user(store):
+    # only OPT_IN stored, so there are no maps to update paths in yet
+    assert store.set_attribute(USER, genomeMatch.OPT_IN, True)
+    data = genomeMatch.TrackedData({}, genomeMatch.new_changes())
+    data['new'] = profiles(1)['profile0']
+    assert store.update(USER, data)
+    item = store.get(USER)
+    assert list(item[genomeMatch.DATA]) == ['new']
+    assert item[genomeMatch.OPT_IN]
+
+
+def test_update_diff(dynamodb, monkeypatch):
+    stored = profiles(4)
+    store = genomeMatch.DynamoStore()
+    store.put(USER, stored)
+    store.set_attribute(USER, genomeMatch.LAST_USED, {})
+    calls = record_updates(genomeMatch.get_db_table(), monkeypatch)
+    data = genomeMatch.TrackedData(dict(stored), genomeMatch.new_changes())
+    change_profiles(data, stored)
+    store.update(USER, data)
+    # one UpdateItem of just the changed names
+    (options,) = calls
+    assert options['UpdateExpression'] == (
+        'SET #data.#n0 = :v0, #data.#n1 = :v1, #used.#t0 = :t0, '
+        '#used.#t1 = :t1, #used.#t2 = :t2 '
+        'REMOVE #data.#r0, #used.#r0')
+    assert [options['ExpressionAttributeNames'][key]
+            for key in ('#n0', '#n1', '#t2', '#r0')] == [
+                'new', 'profile1', 'profile3', 'profile2']
+    assert options['ConditionExpression'] == (
+        'attribute_exists(#data) AND attribute_exists(#used)')
+
+
+def test_update_touched_only(dynamodb, monkeypatch):
+    store = genomeMatch.DynamoStore()
+    store.put(USER, profiles(2))
+    calls = record_updates(genomeMatch.get_db_table(), monkeypatch)
+    data = genomeMatch.TrackedData(profiles(2), genomeMatch.new_changes())
+    data.touch(['profile1'])
+    assert store.update(USER, data)
+    # no #data name, which DynamoDB would reject as unused; the missing
+    # LAST_USED map is added and the update made again
+    assert [options['UpdateExpression'] for options in calls] == [
+        'SET #used.#t0 = :t0', 'SET #used = if_not_exists(#used, :e)',
+        'SET #used.#t0 = :t0']
+    assert store.get(USER)[genomeMatch.LAST_USED] == {
+        'profile1': genomeMatch.epoch_day()}
+
+
+def test_sqlite_shared_file(tmp_path):
+    path = str(tmp_path / 'genome.db')
+    first = genomeMatch.SqliteStore(path)
+    second = genomeMatch.SqliteStore(path)
+    first.put(USER, profiles(1))
+    second.set_attribute(USER, genomeMatch.OPT_IN, True)
+    item = first.get(USER)
+    assert list(item[genomeMatch.DATA]) == ['profile0']
+    assert item[genomeMatch.OPT_IN]
+    assert first.get('nobody') == {}
+
+
+def test_cache_reads(dynamodb):
+    backing = genomeMatch.DynamoStore()
+    backing.put(USER, profiles(1))
+    store = genomeMatch.MemoryStore(backing, 10)
+    for _ in range(3):
+        store.get(USER)
+    assert store.stats == {'hits': 2, 'misses': 1}
+    # items are copied out, so changing one doesn't change the cache
+    store.get(USER)[genomeMatch.DATA].clear()
+    assert list(store.get(USER)[genomeMatch.DATA]) == ['profile0']
+
+
+def test_budget_evicts_least_recently_used(dynamodb, monkeypatch):
+    monkeypatch.setenv(genomeMatch.MAX_PROFILES_ENV, '3')
+    stored = profiles(5)
+    store = genomeMatch.get_store()
+    store.put(USER, stored)
+    today = genomeMatch.epoch_day()
+    store.set_attribute(USER, genomeMatch.LAST_USED, {
+        'profile0': today - 1, 'profile1': today - 9, 'profile2': today - 3,
+        'profile4': today - 2})
+    data = genomeMatch.TrackedData(dict(stored), genomeMatch.new_changes(),
+                                   used={'profile1': today})
+    data['untitled'] = stored['profile0']
+    # oldest first, by the session's day where there is one; the kept
+    # name and 'untitled' stay
+    evicted = genomeMatch.enforce_budget(data, 'profile3', USER)
+    assert evicted == ['profile2', 'profile4']
+    assert sorted(data) == ['profile0', 'profile1', 'profile3', 'untitled']
+    assert data.changes[genomeMatch.REMOVED] == evicted
+
+
+def test_budget_reads_days_only_when_over(monkeypatch):
+    monkeypatch.setenv(genomeMatch.MAX_PROFILES_ENV, '5')
+    calls = []
+    monkeypatch.setattr(genomeMatch, 'load_used', calls.append)
+    data = genomeMatch.TrackedData(profiles(5), genomeMatch.new_changes())
+    assert genomeMatch.enforce_budget(data, 'profile0', USER) == []
+    assert calls == []
+
+
+def test_budget_item_bytes(dynamodb, monkeypatch):
+    stored = profiles(10)
+    data = genomeMatch.TrackedData(dict(stored), genomeMatch.new_changes())
+    size = data.size()
+    monkeypatch.setenv(genomeMatch.MAX_ITEM_BYTES_ENV, str(size - 1))
+    evicted = genomeMatch.enforce_budget(data, 'profile9', USER)
+    assert len(evicted) == 1
+    assert data.size() <= size - 1
@@ -0,0 +1,122 @@
+"""
+test_tracked_data.py: change tracking, the pair cache and common summary
+"""
+import random
+
+import backends
+import events
+import genomeMatch
+
+
+def profiles(count, seed=0):
+    """dict of name: random complete profile"""
+    rng = random.Random(seed)
+    return {'profile{0}'.format(i): backends.random_profile(rng)
+            for i in range(count)}
+
+
+def tracked(data):
+    """TrackedData of `data` with a new change record"""
+    return genomeMatch.TrackedData(data, genomeMatch.new_changes())
+
+
+def test_changes():
+    stored = profiles(3)
+    data = tracked(stored)
+    assert not data.is_dirty()
+    data['new'] = stored['profile0']
+    data['profile1'] = stored['profile2']
+    del data['profile2']
+    data.touch(['profile0', 'new'])
+    assert data.changes == {genomeMatch.CHANGED: ['new', 'profile1'],
+                            genomeMatch.REMOVED: ['profile2'],
+                            genomeMatch.TOUCHED: ['profile0']}
+    # setting a removed name again is a change, not a removal
+    data['profile2'] = stored['profile2']
+    del data['profile0']
+    assert data.changes == {genomeMatch.CHANGED: ['new', 'profile1',
+                                                  'profile2'],
+                            genomeMatch.REMOVED: ['profile0'],
+                            genomeMatch.TOUCHED: []}
+    today = genomeMatch.epoch_day()
+    assert data.used == {'new': today, 'profile1': today,
+                         'profile2': today}
+
+
+def test_touch_once_a_day():
+    today = genomeMatch.epoch_day()
+    data = genomeMatch.TrackedData(profiles(2), genomeMatch.new_changes(),
+                                   used={'profile0': today})
+    data.touch(['profile0', 'profile1'])
+    data.touch(['profile1'])
+    assert data.changes[genomeMatch.TOUCHED] == ['profile1']
+
+
+def test_load_is_not_a_change():
+    data = tracked({'profile0': None})
+    assert data.missing(['profile0', 'other']) == ['profile0']
+    data.load('profile0', profiles(1)['profile0'])
+    assert data.missing(['profile0']) == []
+    assert not data.is_dirty()
+
+
+def test_pair_cache():
+    stored = profiles(3)
+    data = tracked(stored)
+    for (a, b) in [('profile0', 'profile1'), ('profile1', 'profile2')]:
+        assert data.match(a, b) == genomeMatch.match_records(stored[a],
+                                                             stored[b])
+    assert data.match('profile1', 'profile0') == data.match('profile0',
+                                                            'profile1')
+    assert sorted(data.pairs) == [
+        genomeMatch.pair_key('profile0', 'profile1'),
+        genomeMatch.pair_key('profile1', 'profile2')]
+    # a new record drops only the pairs it was in
+    data['profile2'] = stored['profile0']
+    assert list(data.pairs) == [genomeMatch.pair_key('profile0',
+                                                     'profile1')]
+    assert data.match('profile1', 'profile2') == data.match('profile0',
+                                                            'profile1')
+
+
+def test_summary_matches_group():
+    stored = profiles(6, seed=1)
+    names = sorted(stored)
+    for count in range(2, len(names) + 1):
+        summary = genomeMatch.summarize(stored[name]
+                                        for name in names[:count])
+        assert genomeMatch.summary_matches(summary) == (
+            genomeMatch.group_matches(stored, names[:count]))
+    # merging one more gives the summary of all of them
+    merged = genomeMatch.summarize([stored[names[-1]]],
+                                   genomeMatch.summarize(
+                                       stored[name] for name in names[:-1]))
+    assert merged == summary
+
+
+def test_summary_missing_trait():
+    stored = profiles(2)
+    del stored['profile1']['anger']
+    summary = genomeMatch.summarize(stored.values())
+    (high, moderate) = genomeMatch.summary_matches(summary)
+    anger = genomeMatch.TRAIT_LIST.index('anger')
+    assert anger not in high + moderate
+
+
+def test_common_intent(dynamodb):
+    backends.seed_user(dynamodb, events.USER_ID, 3)
+    reply = genomeMatch.lambda_handler(events.launch_request(), None)
+    common = genomeMatch.lambda_handler(events.intent_request(
+        'CommonIntent', attributes=reply['sessionAttributes']), None)
+    group = genomeMatch.lambda_handler(events.intent_request(
+        'GroupIntent', attributes=reply['sessionAttributes']), None)
+    assert common['response'] == group['response']
+    assert 'in 2 traits' in common['response']['outputSpeech']['ssml']
+    summary = common['sessionAttributes'][genomeMatch.COMMON_KEY]
+    assert not summary['saved']
+    genomeMatch.lambda_handler(events.session_ended_request(
+        common['sessionAttributes']), None)
+    stored = genomeMatch.load_common(events.USER_ID)
+    assert stored['names'] == summary['names']
+    assert (stored['low'], stored['high']) == (summary['low'],
+                                               summary['high'])
@@ -0,0 +1,101 @@
+"""
+test_untitled.py: expiry of 'untitled' downloads in the profile layout
+"""
+import pytest
+
+import backends
+import events
+import genomeMatch
+
+TTL = 7
+
+
+@pytest.fixture
+def table(dynamodb, monkeypatch):
+    """the profile table, with a stored 'untitled' profile"""
+    monkeypatch.setenv(genomeMatch.DB_LAYOUT_ENV, genomeMatch.LAYOUT_PROFILE)
+    monkeypatch.setenv(genomeMatch.UNTITLED_TTL_ENV, str(TTL))
+    backends.seed_user(dynamodb, events.USER_ID, 2)
+    return dynamodb.Table(genomeMatch.DEFAULT_DB_PROFILE_TABLE)
+
+
+def store_untitled(table, day):
+    """store an 'untitled' profile last used on `day`, 0 for undated"""
+    item = {genomeMatch.USERID: events.USER_ID,
+            genomeMatch.PROFILE: 'untitled',
+            genomeMatch.DATA: {'anger': (1, 'They are easily angered')}}
+    if day:
+        item[genomeMatch.LAST_USED] = day
+    table.put_item(item)
+
+
+def untitled(table):
+    """the stored 'untitled' item, or None"""
+    return table.items.get((events.USER_ID, 'untitled'))
+
+
+def launch_and_end():
+    """launch and end a session, returns the changes of the launch"""
+    reply = genomeMatch.lambda_handler(events.launch_request(), None)
+    attributes = reply['sessionAttributes']
+    genomeMatch.lambda_handler(events.session_ended_request(attributes),
+                               None)
+    # lambda_handler decoded them in place
+    return (attributes[genomeMatch.DATA_KEY],
+            attributes[genomeMatch.CHANGES_KEY])
+
+
+def test_expired(table):
+    store_untitled(table, genomeMatch.epoch_day() - TTL)
+    (data, changes) = launch_and_end()
+    assert 'untitled' not in data
+    assert changes[genomeMatch.REMOVED] == ['untitled']
+    assert untitled(table) is None
+
+
+def test_not_expired(table):
+    day = genomeMatch.epoch_day() - TTL + 1
+    store_untitled(table, day)
+    (data, changes) = launch_and_end()
+    assert 'untitled' in data
+    assert changes == genomeMatch.new_changes()
+    assert untitled(table)[genomeMatch.LAST_USED] == day
+
+
+def test_undated(table):
+    store_untitled(table, 0)
+    (data, changes) = launch_and_end()
+    # its time starts at the first launch
+    assert changes[genomeMatch.TOUCHED] == ['untitled']
+    item = untitled(table)
+    today = genomeMatch.epoch_day()
+    assert item[genomeMatch.LAST_USED] == today
+    assert item[genomeMatch.EXPIRES] == genomeMatch.untitled_expires(today)
+    assert genomeMatch.DATA in item
+    # so later launches have nothing to save
+    (data, changes) = launch_and_end()
+    assert changes == genomeMatch.new_changes()
+
+
+def touched():
+    """TrackedData with 'untitled' touched but not loaded"""
+    data = genomeMatch.TrackedData({'untitled': None},
+                                   genomeMatch.new_changes())
+    data.touch(['untitled'])
+    return data
+
+
+def test_day_alone(table):
+    store_untitled(table, 0)
+    genomeMatch.put_profiles(table, events.USER_ID, touched())
+    item = untitled(table)
+    today = genomeMatch.epoch_day()
+    assert item[genomeMatch.LAST_USED] == today
+    assert item[genomeMatch.EXPIRES] == genomeMatch.untitled_expires(today)
+    assert item[genomeMatch.DATA] == {'anger': (1, 'They are easily angered')}
+
+
+def test_day_alone_deleted(table):
+    genomeMatch.put_profiles(table, events.USER_ID, touched())
+    # a day isn't saved as an item of its own
+    assert untitled(table) is None
@@ -0,0 +1,71 @@
+"""
+build_match_index.py: build the cross-user match index offline
+
+Scans the DynamoDB tables configured for genomeMatch (see README) for
+the complete profiles of users who opted in to matching, and writes a
+MatchIndex file for GENOME_MATCH_INDEX.
+
+    python tools/build_match_index.py OUTPUT.npz
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomeMatch  # noqa: E402
+
+
+def scan(table, **options):
+    """yield every item of `table`, following scan pages"""
+    while True:
+        response = table.scan(**options)
+        for item in response['Items']:
+            yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        options['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def opted_in_profiles():
+    """yield (userId, name, record) for every opted-in profile"""
+    opted_in = {'FilterExpression': '#o = :t',
+                'ExpressionAttributeValues': {':t': True}}
+    if genomeMatch.use_profile_layout():
+        users = {item[genomeMatch.USERID] for item in scan(
+            genomeMatch.get_db_table(),
+            ProjectionExpression='#u',
+            ExpressionAttributeNames={'#u': genomeMatch.USERID,
+                                      '#o': genomeMatch.OPT_IN},
+            **opted_in)}
+        for item in scan(genomeMatch.get_profile_table()):
+            if item[genomeMatch.USERID] in users:
+                yield (item[genomeMatch.USERID], item[genomeMatch.PROFILE],
+                       item[genomeMatch.DATA])
+        return
+    for item in scan(genomeMatch.get_db_table(),
+                     ProjectionExpression='#u, #d',
+                     ExpressionAttributeNames={'#u': genomeMatch.USERID,
+                                               '#d': genomeMatch.DATA,
+                                               '#o': genomeMatch.OPT_IN},
+                     **opted_in):
+        for name, record in item.get(genomeMatch.DATA, {}).items():
+            yield (item[genomeMatch.USERID], name, record)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('output', help="index file to write")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    index = genomeMatch.MatchIndex()
+    for userId, name, record in opted_in_profiles():
+        if name != 'untitled' and genomeMatch.is_complete(record):
+            index.add(genomeMatch.member_id(userId, name), record)
+    index.save(args.output)
+    print("indexed {} profiles in {:.1f} s".format(
+        len(index), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
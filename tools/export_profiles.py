@@ -0,0 +1,265 @@
+"""
+export_profiles.py: export stored profiles to a compact columnar file
+
+Scans the DynamoDB tables configured for genomeMatch (see README) in
+parallel scan segments, one per worker, and streams every stored
+profile into OUTPUT in blocks of three columns: userIds, names and
+packed scores (see pack_profile).  Phrases are dropped from the
+profiles and written once at the end by trait and score, as the session
+codec sends them, so a profile costs a few bytes.  Pages wait in a
+bounded queue, so the table is never held in memory.
+
+--load reads an export back into the storage engine configured by
+GENOME_DB_ENGINE, like sqlite for local analysis, in the item layout.
+
+    python tools/export_profiles.py OUTPUT [-w WORKERS] [--block ROWS]
+    python tools/export_profiles.py --load INPUT
+
+File layout: MAGIC, a JSON line with the trait order, blocks of a BLOCK
+header and the zlib-compressed columns, a zlib-compressed JSON footer of
+phrases and counts, and the footer's offset as a TRAILER.
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomeMatch  # noqa: E402
+
+MAGIC = b'GENOME-PROFILES 1\n'
+BLOCK = struct.Struct('<IIII')  # rows, bytes of users, names and scores
+TRAILER = struct.Struct('<Q')   # offset of the footer
+BLOCK_ROWS = 8192               # profiles in each block
+QUEUE_PAGES = 32                # scan pages waiting to be written
+SEPARATOR = '\0'                # between strings of a column
+DEFAULT_WORKERS = 4
+
+
+def scan_pages(table, segment, segments, stop, **options):
+    """yield the Items of each page of one scan segment until `stop`"""
+    options.update(Segment=segment, TotalSegments=segments)
+    while not stop.is_set():
+        response = table.scan(**options)
+        yield response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        options['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def parallel_scan(table, workers, **options):
+    """
+    yield scan pages of `table` from `workers` segments scanned at once
+
+    At most QUEUE_PAGES pages wait in memory; a worker blocks until the
+    consumer catches up.  An error in any worker is raised at the end.
+    """
+    pages = queue.Queue(QUEUE_PAGES)
+    stop = threading.Event()
+    done = object()
+
+    def scan_segment(segment):
+        try:
+            for page in scan_pages(table, segment, workers, stop, **options):
+                while not stop.is_set():
+                    try:
+                        pages.put(page, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        finally:
+            pages.put(done)
+
+    with ThreadPoolExecutor(workers,
+                            thread_name_prefix='export') as pool:
+        futures = [pool.submit(scan_segment, segment)
+                   for segment in range(workers)]
+        try:
+            finished = 0
+            while finished < workers:
+                page = pages.get()
+                if page is done:
+                    finished += 1
+                else:
+                    yield page
+        finally:
+            stop.set()
+            # let workers waiting to put their last page finish
+            while not all(future.done() for future in futures):
+                try:
+                    pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        for future in futures:
+            future.result()
+
+
+def stored_profiles(workers):
+    """yield (userId, name, record) of every stored profile"""
+    if genomeMatch.use_profile_layout():
+        for items in parallel_scan(genomeMatch.get_profile_table(), workers):
+            for item in items:
+                yield (item[genomeMatch.USERID], item[genomeMatch.PROFILE],
+                       item[genomeMatch.DATA])
+        return
+    for items in parallel_scan(genomeMatch.get_db_table(), workers,
+                               ProjectionExpression='#u, #d',
+                               ExpressionAttributeNames={
+                                   '#u': genomeMatch.USERID,
+                                   '#d': genomeMatch.DATA}):
+        for item in items:
+            for name, record in item.get(genomeMatch.DATA, {}).items():
+                yield (item[genomeMatch.USERID], name, record)
+
+
+class ExportWriter:
+    """writes (userId, name, record) rows to an open export file"""
+
+    def __init__(self, file, block_rows=BLOCK_ROWS):
+        self.file = file
+        self.block_rows = block_rows
+        self.rows = 0
+        self.phrases = {}   # trait: {score: phrase}
+        self._block = ([], [], array('Q'))
+        file.write(MAGIC)
+        file.write(json.dumps({'traits': genomeMatch.TRAIT_LIST}).encode(
+            'utf-8') + b'\n')
+
+    def add(self, userId, name, record):
+        """add one profile, writing a block when it is full"""
+        (users, names, scores) = self._block
+        users.append(userId)
+        names.append(name)
+        scores.append(genomeMatch.pack_profile(record))
+        for trait, (score, phrase) in record.items():
+            self.phrases.setdefault(trait, {})[str(int(score))] = phrase
+        if len(scores) >= self.block_rows:
+            self.flush()
+
+    def flush(self):
+        """write the rows added since the last block"""
+        (users, names, scores) = self._block
+        if not scores:
+            return
+        if sys.byteorder == 'big':
+            scores.byteswap()
+        columns = [zlib.compress(SEPARATOR.join(users).encode('utf-8')),
+                   zlib.compress(SEPARATOR.join(names).encode('utf-8')),
+                   zlib.compress(scores.tobytes())]
+        self.file.write(BLOCK.pack(len(scores), *map(len, columns)))
+        for column in columns:
+            self.file.write(column)
+        self.rows += len(scores)
+        self._block = ([], [], array('Q'))
+
+    def close(self):
+        """write the last block, the footer and the trailer"""
+        self.flush()
+        offset = self.file.tell()
+        self.file.write(zlib.compress(json.dumps(
+            {'rows': self.rows, 'phrases': self.phrases}).encode('utf-8')))
+        self.file.write(TRAILER.pack(offset))
+
+
+def read_export(file):
+    """
+    yield (userId, name, record) of every profile in an open export file
+
+    Records get back the phrase of each trait and score from the footer.
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a profile export")
+    traits = json.loads(file.readline().decode('utf-8'))['traits']
+    start = file.tell()
+    file.seek(-TRAILER.size, os.SEEK_END)
+    (offset,) = TRAILER.unpack(file.read(TRAILER.size))
+    end = file.seek(0, os.SEEK_END) - TRAILER.size
+    file.seek(offset)
+    phrases = json.loads(zlib.decompress(file.read(end - offset)).decode(
+        'utf-8'))['phrases']
+    file.seek(start)
+    shifts = [(trait, genomeMatch.SCORE_BITS * i)
+              for i, trait in enumerate(traits)]
+    while file.tell() < offset:
+        (rows, *sizes) = BLOCK.unpack(file.read(BLOCK.size))
+        (users, names, packed) = [zlib.decompress(file.read(size))
+                                  for size in sizes]
+        scores = array('Q', packed)
+        if sys.byteorder == 'big':
+            scores.byteswap()
+        for (userId, name, code) in zip(
+                users.decode('utf-8').split(SEPARATOR),
+                names.decode('utf-8').split(SEPARATOR), scores):
+            record = {}
+            for trait, shift in shifts:
+                score = code >> shift & genomeMatch.SCORE_MASK
+                if score != genomeMatch.MISSING_CODE:
+                    record[trait] = (score, phrases[trait][str(score)])
+            yield (userId, name, record)
+
+
+def export_profiles(path, workers=DEFAULT_WORKERS, block_rows=BLOCK_ROWS):
+    """export every stored profile to `path`; returns rows written"""
+    with open(path, 'wb') as file:
+        writer = ExportWriter(file, block_rows)
+        for (userId, name, record) in stored_profiles(workers):
+            writer.add(userId, name, record)
+        writer.close()
+    return writer.rows
+
+
+def load_export(path, store):
+    """
+    save every profile of the export at `path` in `store`
+
+    Returns:
+        rows loaded
+    """
+    rows = 0
+    with open(path, 'rb') as file:
+        # a user's profiles come together, except in the profile layout
+        # where segments can split them; update adds to what is stored
+        for userId, profiles in itertools.groupby(read_export(file),
+                                                  lambda row: row[0]):
+            data = genomeMatch.TrackedData({}, genomeMatch.new_changes())
+            for (_, name, record) in profiles:
+                data[name] = record
+            store.update(userId, data)
+            rows += len(data)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('path', help="export file to write, or to --load")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help="scan segments scanned at once")
+    parser.add_argument('--block', type=int, default=BLOCK_ROWS,
+                        help="profiles in each block of the file")
+    parser.add_argument('--load', action='store_true',
+                        help="load the export into the storage engine")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    if args.load:
+        rows = load_export(args.path, genomeMatch.get_store())
+        action = 'loaded'
+    else:
+        rows = export_profiles(args.path, args.workers, args.block)
+        action = 'exported'
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(args.path)
+    print("{} {} profiles in {:.2f} s, {:.0f} rows/s, {} bytes, {:.1f} "
+          "bytes/profile".format(action, rows, seconds, rows / seconds,
+                                 size, size / max(rows, 1)))
+
+
+if __name__ == '__main__':
+    main()